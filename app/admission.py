@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from fastapi import HTTPException
+import math
+import os
+import threading
+import time
+
+# Limits apply per worker process, divide fleet-wide budgets by the worker count
+USER_RATE = float(os.environ.get("RATE_LIMIT_USER_PER_MINUTE", 20)) / 60
+USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", 5))
+GLOBAL_RATE = float(os.environ.get("RATE_LIMIT_GLOBAL_PER_MINUTE", 600)) / 60
+GLOBAL_BURST = float(os.environ.get("RATE_LIMIT_GLOBAL_BURST", 50))
+MAX_CONCURRENT_GRAPHS = int(os.environ.get("MAX_CONCURRENT_GRAPHS", 8))
+MAX_GRAPH_QUEUE = int(os.environ.get("MAX_GRAPH_QUEUE", 16))
+GRAPH_QUEUE_TIMEOUT = float(os.environ.get("GRAPH_QUEUE_TIMEOUT", 30))
+MAX_TRACKED_USERS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Returns 0 when a token is there to take, else the seconds until one is available
+    def available(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    # Returns 0 when a token was taken, else the seconds until one is available
+    def take(self) -> float:
+        wait = self.available()
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float, global_burst: float):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Returns None when the request is allowed, else (scope, retry_after)
+    def check(self, user_id: str):
+        # Both buckets are checked before either gives up a token, a rejected request costs nothing
+        with self.lock:
+            bucket = None
+            if self.user_rate > 0:
+                bucket = self.users.pop(user_id, None) or TokenBucket(self.user_rate, self.user_burst)
+                self.users[user_id] = bucket
+                if len(self.users) > MAX_TRACKED_USERS:
+                    self.users.popitem(last=False)
+                wait = bucket.available()
+                if wait:
+                    return "user", wait
+
+            if self.global_bucket is not None:
+                wait = self.global_bucket.take()
+                if wait:
+                    return "global", wait
+
+            if bucket is not None:
+                bucket.take()
+
+        return None
+
+
+class GateRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencyGate:
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.average_duration = 5.0
+        self.condition = threading.Condition()
+
+    def retry_after(self) -> float:
+        return self.average_duration * (self.waiting + 1) / max(self.limit, 1)
+
+    @contextmanager
+    def slot(self, timeout: float = None):
+        if self.limit <= 0:
+            yield
+            return
+
+        with self.condition:
+            if self.in_flight >= self.limit:
+                if self.waiting >= self.max_queue:
+                    raise GateRejected("queue_full", self.retry_after())
+                self.waiting += 1
+                try:
+                    wait = self.timeout if timeout is None else min(self.timeout, timeout)
+                    admitted = self.condition.wait_for(lambda: self.in_flight < self.limit, wait)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    raise GateRejected("queue_timeout", self.retry_after())
+            self.in_flight += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.average_duration = 0.9 * self.average_duration + 0.1 * (time.monotonic() - started)
+                self.condition.notify()
+
+
+rate_limiter = RateLimiter(USER_RATE, USER_BURST, GLOBAL_RATE, GLOBAL_BURST)
+graph_gate = ConcurrencyGate(MAX_CONCURRENT_GRAPHS, MAX_GRAPH_QUEUE, GRAPH_QUEUE_TIMEOUT)
+
+_counters = {
+    "admitted": 0,
+    "rejected_user_rate": 0,
+    "rejected_global_rate": 0,
+    "rejected_queue_full": 0,
+    "rejected_queue_timeout": 0,
+}
+_counters_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _too_many_requests(detail: str, retry_after: float):
+    raise HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def check_rate_limit(user_id: str):
+    limited = rate_limiter.check(user_id)
+    if limited:
+        scope, retry_after = limited
+        _count(f"rejected_{scope}_rate")
+        _too_many_requests(f"Rate limit exceeded ({scope})", retry_after)
+
+
+@contextmanager
+def graph_slot(timeout: float = None):
+    try:
+        with graph_gate.slot(timeout):
+            _count("admitted")
+            yield
+    except GateRejected as e:
+        _count(f"rejected_{e.reason}")
+        _too_many_requests("Server is busy, try again later", e.retry_after)
+
+
+def metrics() -> dict:
+    with _counters_lock:
+        counters = dict(_counters)
+    return {
+        **counters,
+        "in_flight": graph_gate.in_flight,
+        "queue_depth": graph_gate.waiting,
+        "concurrency_limit": graph_gate.limit,
+        "queue_limit": graph_gate.max_queue,
+        "average_graph_seconds": round(graph_gate.average_duration, 3),
+    }
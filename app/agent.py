@@ -1,30 +1,58 @@
-from langgraph.graph import StateGraph
-from pymongo import MongoClient
-from app.classifier import classifier_node, AgentState
-from app.agents.crm_agent import crm_agent_node
-from app.agents.unknown import unknown_node
+from app.db import LazyCollection
 import os
+import threading
 
-builder = StateGraph(AgentState)
+sessions_db = LazyCollection("sessions")
 
-sessions_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).crm.sessions
+# Answers as the likely agent while classify runs, which saves its round trip
+# when the guess is right and costs the speculative tokens when it is wrong
+SPECULATIVE_ROUTING = os.environ.get("SPECULATIVE_ROUTING", "false").lower() == "true"
 
-builder.add_node("classify", classifier_node)
-builder.add_node("crm-agent", crm_agent_node)
-builder.add_node("unknown", unknown_node)
+_graph = None
+_graph_lock = threading.Lock()
 
-builder.add_conditional_edges(
-    "classify",
-    lambda state: state["agent"],
-    {
-        "crm-agent": "crm-agent",
-        "unknown": "unknown"
-    }
-)
 
-builder.set_entry_point("classify")
+def build_graph(speculative: bool = None):
+    # langchain and langgraph take seconds to import, so they are only loaded here
+    from langgraph.graph import StateGraph, START, END
+    from app.classifier import classifier_node, AgentState
+    from app.history import history_node
+    from app.routing import AGENT_NODES, speculate_node, dispatch_node, route
 
-builder.set_finish_point("unknown")
-builder.set_finish_point("crm-agent")
+    speculative = SPECULATIVE_ROUTING if speculative is None else speculative
 
-graph = builder.compile()
\ No newline at end of file
+    builder = StateGraph(AgentState)
+
+    builder.add_node("classify", classifier_node)
+    builder.add_node("dispatch", dispatch_node)
+    for name, node in AGENT_NODES.items():
+        builder.add_node(name, node)
+        builder.add_edge(name, END)
+
+    # Both branches start together and dispatch waits for the two of them
+    prepare = "speculate" if speculative else "history"
+    builder.add_node(prepare, speculate_node if speculative else history_node)
+    builder.add_edge(START, "classify")
+    builder.add_edge(START, prepare)
+    builder.add_edge(["classify", prepare], "dispatch")
+
+    builder.add_conditional_edges(
+        "dispatch",
+        route,
+        {
+            "crm-agent": "crm-agent",
+            "unknown": "unknown",
+            END: END
+        }
+    )
+
+    return builder.compile()
+
+
+def get_graph():
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = build_graph()
+    return _graph
@@ -1,13 +1,76 @@
-from langchain.agents import initialize_agent, Tool
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from langchain.agents import initialize_agent, AgentType, Tool
+from langchain.schema import HumanMessage
+from langchain_core.runnables import ensure_config
 from langsmith import traceable
 from app.classifier import AgentState
-from app.crm_client import CRMClient
-import os
+from app.model_policy import chat_model
+from app.history import history_summary, recent_messages
+from app.crm_client import FAILURE_MESSAGE
+from app.deadline import DeadlineExceeded, deadline_scope
+from app.resolver import is_id
+from app.tenants import TenantProxy, tenant_scope
+from app import crm_mirror
 import json
 
-crm_client = CRMClient(api_key=os.environ.get("DIDAR_API_KEY"))
+# The client, name index and deal snapshot of the tenant whose turn is running
+crm_client = TenantProxy("client")
+resolver = TenantProxy("resolver")
+analytics = TenantProxy("analytics")
+
+# A prompt template, so {history_summary} is filled in per turn and literal braces must be doubled
+SYSTEM_PROMPT = (
+    "You are an AI agent in a smart Chatbot API for an online shop, designed to handle customer relationship management (CRM) queries. "
+    "You are the crm-agent, responsible for handling only CRM-related questions. "
+    "Your primary language is Persian, and you must respond in Persian when the user's input is in Persian. "
+    "If the user speaks in a language other than Persian, respond in their language but include a polite message in that language stating: 'The system is optimized for Persian. For the best experience, please use Persian for your CRM-related questions.' "
+    "For Persian inputs, do not include this message; respond only in Persian with the relevant CRM information. "
+    "In Persian, use these terms: کاربر (users), کاریز (pipelines), مشتری (contacts), معامله (deal), محصول (product), فعالیت (activity), کارت (card). "
+    "You have access to tools that connect to the DIDAR CRM API, allowing you to search for users, get user details, and update user information. "
+    "Strictly answer only CRM-related questions. Do not respond to questions unrelated to shopping, customer relations, or users. "
+    "When using tools to fetch data, format the output in a human-readable structure. For lists (e.g., 'list', 'show all', 'get all users'), present the full results as a bullet point list or table, including all data from the tool's observation without summarization. "
+    "Do not include explanatory phrases like 'I formatted the list' or summarize the output. The final answer must consist only of the formatted result from the tool (e.g., the full list or data structure). "
+    "If the user’s question involves listing, ensure the response is a clear multi-item structure (e.g., bullet points or table) representing the full result, not a single-item focus. "
+    "Use the previous messages to resolve follow-up questions such as 'his email' or 'the second one'. "
+    "The conversation before those messages is summarized as follows: {history_summary}"
+)
+
+# What AgentExecutor answers when it hits max_execution_time or max_iterations
+STOPPED_OUTPUT = "Agent stopped due to iteration limit or time limit."
+
+TIMEOUT_ANSWER = "The answer could not be completed in time, please try again or ask a narrower question."
+PARTIAL_ANSWER = "The answer could not be completed in time. This is what was found so far:"
+
+def partial_answer(steps: list) -> str:
+    observations = [str(observation) for _, observation in steps if observation]
+    if not observations:
+        return TIMEOUT_ANSWER
+    return f"{PARTIAL_ANSWER}\n\n{observations[-1]}"
+
+def mirrored_search(kind: str, query: str, fallback) -> str:
+    mirrored = crm_mirror.search(kind, query)
+    if mirrored is not None:
+        return json.dumps({
+            'data':mirrored['data'],
+            'freshness':mirrored['freshness'],
+            'prompt':f"Search for {kind} {query}"
+        }, default=str)
+
+    results = fallback(query)
+    if results == FAILURE_MESSAGE:
+        # Didar is unreachable, a stale mirror beats no answer at all
+        mirrored = crm_mirror.search(kind, query, max_age=None)
+        if mirrored is not None:
+            return json.dumps({
+                'data':mirrored['data'],
+                'freshness':{**mirrored['freshness'], 'stale':True},
+                'prompt':f"Search for {kind} {query}"
+            }, default=str)
+
+    return json.dumps({
+        'data':results,
+        'freshness':{'source':'live'},
+        'prompt':f"Search for {kind} {query}"
+    })
 
 def list_users(requested_prompt: str) -> str:
     users = crm_client.list_users()
@@ -59,18 +122,10 @@ def search_attachment(query: str) -> str:
     })
 
 def search_case(query: str) -> str:
-    cases = crm_client.search_case(query)
-    return json.dumps({
-        'data':cases,
-        'prompt':f"Search for case {query}"
-    })
+    return mirrored_search("case", query, crm_client.search_case)
 
 def search_deal(query: str) -> str:
-    deals = crm_client.search_deal(query)
-    return json.dumps({
-        'data':deals,
-        'prompt':f"Search for deal {query}"
-    })
+    return mirrored_search("deal", query, crm_client.search_deal)
 
 def search_company(query: str) -> str:
     companies = crm_client.search_company(query)
@@ -80,18 +135,85 @@ def search_company(query: str) -> str:
     })
 
 def search_contact(query: str) -> str:
-    contacts = crm_client.search_contact(query)
+    return mirrored_search("contact", query, crm_client.search_contact)
+
+def resolve_id(kind: str, name_or_id: str):
+    # Returns (id, None), or (None, an observation listing the candidates to pick from)
+    name_or_id = name_or_id.strip().strip("`'\"")
+    if is_id(name_or_id):
+        return name_or_id, None
+
+    resolved = resolver.resolve(kind, name_or_id)
+    if resolved["match"]:
+        return resolved["match"]["id"], None
+
+    if resolved["candidates"]:
+        message = f"`{name_or_id}` matches several {kind}s, ask the user which one they mean or retry with one of these IDs"
+    else:
+        message = resolved.get("error") or f"No {kind} named `{name_or_id}` was found"
+    return None, json.dumps({
+        'data':resolved["candidates"],
+        'message':message
+    }, ensure_ascii=False)
+
+def get_cards(owner: str) -> str:
+    owner_id, unresolved = resolve_id("user", owner)
+    if unresolved:
+        return unresolved
+
+    cards = crm_client.get_cards(owner_id)
     return json.dumps({
-        'data':contacts,
-        'prompt':f"Search for contact {query}"
+        'data':cards,
+        'prompt':f"Get 10 last cards of the Owner `{owner}` with the ID of `{owner_id}`"
     })
 
-def get_cards(ownerId: str) -> str:
-    cards = crm_client.get_cards(ownerId)
+def find_ids(name: str) -> str:
+    matches = []
+    for kind in ("user", "pipeline"):
+        resolved = resolver.resolve(kind, name)
+        matches += resolved["candidates"]
+    matches.sort(key=lambda match: match["score"], reverse=True)
     return json.dumps({
-        'data':cards,
-        'prompt':f"Get 10 last cards of the Owner with the ID of `{ownerId}`"
-    })
+        'data':matches[:5],
+        'prompt':f"Find the ID of `{name}`"
+    }, ensure_ascii=False)
+
+def deal_analytics(query: str) -> str:
+    # Takes a JSON object, e.g. {"group_by": "owner", "status": "won", "date": "closed", "period": "this_month"}
+    try:
+        options = json.loads(query.strip().strip("`").removeprefix("json").strip() or "{}")
+        if not isinstance(options, dict):
+            raise ValueError("Expected a JSON object")
+    except ValueError as e:
+        return json.dumps({'error':f"Invalid input: {e}"})
+
+    pipeline_id = None
+    if options.get("pipeline"):
+        pipeline_id, unresolved = resolve_id("pipeline", str(options["pipeline"]))
+        if unresolved:
+            return unresolved
+
+    try:
+        result = analytics.aggregate(
+            group_by=options.get("group_by") or "stage",
+            status=options.get("status"),
+            period=options.get("period") or "all",
+            start=options.get("start"),
+            end=options.get("end"),
+            date_field=options.get("date") or "created",
+            pipeline_id=pipeline_id
+        )
+    except ValueError as e:
+        return json.dumps({'error':str(e)})
+    except DeadlineExceeded:
+        return json.dumps({'error':"Ran out of time waiting for the deals to load from the CRM, ask again in a minute"})
+    if "error" in result:
+        return json.dumps({'error':result['error']})
+
+    return json.dumps({
+        'data':result,
+        'prompt':f"Aggregate deals {query}"
+    }, ensure_ascii=False, default=str)
 
 def get_contact_detail(Id: str) -> str:
     details = crm_client.get_contact_detail(Id)
@@ -108,7 +230,7 @@ def get_deal_detail(Id: str) -> str:
     })
 
 def format_json(json_input: str) -> str:
-    formatter_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    formatter_llm = chat_model("crm-agent", "format")
 
     prompt = (
         "You are a helpful assistant. Format the following JSON content into a readable list or table. "
@@ -121,40 +243,11 @@ def format_json(json_input: str) -> str:
 
 @traceable
 def crm_agent_node(state: AgentState) -> AgentState:
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    summerizer = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+    deadline = state.get("deadline")
+    llm = chat_model("crm-agent", "answer", deadline=deadline)
 
     chat_history = state.get("chat_history", [])
 
-    summary_messages = [
-        SystemMessage(content="You are a chat history summarizer. If there is no chat history, return nothing. Summarize this chat history:")
-    ]
-
-    for user, assistant in chat_history:
-        summary_messages.append(HumanMessage(content=user))
-        summary_messages.append(AIMessage(content=assistant))
-
-    summary = summerizer.invoke(summary_messages)
-
-    messages = [
-        SystemMessage(
-            content=(
-                "You are an AI agent in a smart Chatbot API for an online shop, designed to handle customer relationship management (CRM) queries. "
-                "You are the crm-agent, responsible for handling only CRM-related questions. "
-                "Your primary language is Persian, and you must respond in Persian when the user's input is in Persian. "
-                "If the user speaks in a language other than Persian, respond in their language but include a polite message in that language stating: 'The system is optimized for Persian. For the best experience, please use Persian for your CRM-related questions.' "
-                "For Persian inputs, do not include this message; respond only in Persian with the relevant CRM information. "
-                "In Persian, use these terms: کاربر (users), کاریز (pipelines), مشتری (contacts), معامله (deal), محصول (product), فعالیت (activity), کارت (card). "
-                "You have access to tools that connect to the DIDAR CRM API, allowing you to search for users, get user details, and update user information. "
-                "Strictly answer only CRM-related questions. Do not respond to questions unrelated to shopping, customer relations, or users. "
-                "When using tools to fetch data, format the output in a human-readable structure. For lists (e.g., 'list', 'show all', 'get all users'), present the full results as a bullet point list or table, including all data from the tool's observation without summarization. "
-                "Do not include explanatory phrases like 'I formatted the list' or summarize the output. The final answer must consist only of the formatted result from the tool (e.g., the full list or data structure). "
-                "If the user’s question involves listing, ensure the response is a clear multi-item structure (e.g., bullet points or table) representing the full result, not a single-item focus. "
-                f"The chat history is summarized as follows: {summary.content}"
-            )
-        )
-    ]
-
     list_users_tool = Tool(
         name="Fetch a List of Users",
         func=list_users,
@@ -212,7 +305,28 @@ def crm_agent_node(state: AgentState) -> AgentState:
     get_cards_tool = Tool(
         name="Fetch a list of an Owner's Cards",
         func=get_cards,
-        description="Takes an `OwnerID` which could be obtained through fetching a list of the owners by using the `Fetch a List of users` Tool and check if they are owner, then you can grab their Id to pass to this tool. This tool lists the details of the cards of that owner. This tool returns the list as a JSON that needs to be formatted then can be used as an answer"
+        description="Takes the owner's name (e.g. `Ali Rezaei`) or their ID and lists the details of the cards of that owner. Names are resolved to IDs by the tool itself, do not fetch the list of users first. If several owners match, it returns them to choose from. This tool returns the list as a JSON that needs to be formatted then can be used as an answer"
+    )
+
+    find_ids_tool = Tool(
+        name="Find the ID of a User or Pipeline",
+        func=find_ids,
+        description="Takes the name of a user (owner), pipeline or pipeline stage and returns the best matching IDs. Use this instead of fetching a whole list when only an ID is needed"
+    )
+
+    deal_analytics_tool = Tool(
+        name="Aggregate Deals",
+        func=deal_analytics,
+        description=(
+            "Computes exact counts, total and average deal value over all deals, grouped by one field. Use it for any question about "
+            "how many deals or how much value, never add up search results yourself. Takes a JSON object with the keys: "
+            "`group_by` (stage, pipeline, owner, status or month), `status` (open, won or lost), `date` (created or closed), "
+            "`period` (today, this_week, this_month, last_month, this_quarter, this_year, last_30_days, last_90_days or all), "
+            "or `start` and `end` as YYYY-MM-DD instead of `period`, and `pipeline` (a pipeline name or ID). All keys are optional. "
+            # Tool descriptions end up in the prompt template, so the braces are doubled
+            "For example, deals each owner won this month: {{\"group_by\": \"owner\", \"status\": \"won\", \"date\": \"closed\", \"period\": \"this_month\"}}. "
+            "It returns a table as JSON that needs to be formatted then can be used as an answer"
+        )
     )
 
     get_contact_detail_tool = Tool(
@@ -244,32 +358,54 @@ def crm_agent_node(state: AgentState) -> AgentState:
         search_contact_tool,
         search_deal_tool,
         get_cards_tool,
+        find_ids_tool,
+        deal_analytics_tool,
         get_contact_detail_tool,
         get_deal_detail_tool,
         format_json_tool
     ]
 
-    for user, assistant in chat_history:
-        messages.append(HumanMessage(content=user))
-        messages.append(AIMessage(content=assistant))
-
-    messages.append(HumanMessage(content=state["question"]))
-
     agent = initialize_agent(
         tools,
         llm,
+        agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+        agent_kwargs={
+            "system_message": SYSTEM_PROMPT,
+            "input_variables": ["input", "chat_history", "history_summary", "agent_scratchpad"]
+        },
         verbose=True,
-        handle_parsing_errors=True
+        handle_parsing_errors=True,
+        max_execution_time=deadline.remaining() if deadline else None,
+        early_stopping_method="force"
     )
 
-    response = agent.invoke({"input": state["question"]})["output"]
-
-    if "chat_history" not in state:
-        state["chat_history"] = []
-
-    state["chat_history"].append((state["question"], response))
+    inputs = {
+        "input": state["question"],
+        "chat_history": recent_messages(chat_history),
+        "history_summary": history_summary(state)
+    }
+
+    # Stepped through so the tool results gathered so far survive running out of time
+    steps, response = [], None
+    try:
+        with deadline_scope(deadline), tenant_scope(state.get("tenant")):
+            for output in agent.iter(inputs, callbacks=ensure_config().get("callbacks")):
+                steps += output.get("intermediate_step", [])
+                response = output.get("output", response)
+    except Exception:
+        # A call cut off by the deadline fails with its client's timeout error, not DeadlineExceeded
+        if deadline is None or not deadline.expired:
+            raise
+        response = partial_answer(steps)
+
+    if deadline is not None and deadline.cancelled:
+        raise DeadlineExceeded("Request was cancelled")
+
+    if response is None or response == STOPPED_OUTPUT:
+        response = partial_answer(steps)
 
     return {
         **state,
+        "chat_history": [*chat_history, (state["question"], response)],
         "answer": response
     }
\ No newline at end of file
@@ -0,0 +1,251 @@
+from datetime import date, timedelta
+from app.deadline import Deadline, call_timeout, deadline_scope
+import logging
+import numpy as np
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_PAGE_SIZE = int(os.environ.get("CRM_ANALYTICS_PAGE_SIZE", 100))
+# Deals loaded at most, in the order Didar returns them
+ANALYTICS_MAX_DEALS = int(os.environ.get("CRM_ANALYTICS_MAX_DEALS", 20000))
+ANALYTICS_TTL = float(os.environ.get("CRM_ANALYTICS_TTL", 300))
+# Snapshots load in the background under their own budget, not a user's request deadline
+ANALYTICS_LOAD_TIMEOUT = float(os.environ.get("CRM_ANALYTICS_LOAD_TIMEOUT", 300))
+# A question asked before the first snapshot is ready waits at most this long for it
+FIRST_LOAD_WAIT = 15
+
+GROUPS = ("stage", "pipeline", "owner", "status", "month")
+STATUSES = ("open", "won", "lost")
+PERIODS = ("today", "this_week", "this_month", "last_month", "this_quarter", "this_year", "last_30_days", "last_90_days", "all")
+
+# Didar spells the same things differently across endpoints and versions
+STATUS_NAMES = {"pending": "open", "open": "open", "inprogress": "open", "won": "won", "win": "won", "lost": "lost", "lose": "lost"}
+DATE_FIELDS = {
+    "created": ("RegisterTime", "RegisterDate", "CreateTime", "CreatedAt"),
+    "closed": ("ChangeToWonTime", "ChangeToLostTime", "CloseTime", "CloseDate", "DoneTime"),
+}
+NO_GROUP = "(none)"
+
+
+def _first(item: dict, keys: tuple):
+    for key in keys:
+        value = item.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _price(item: dict) -> float:
+    try:
+        return float(str(_first(item, ("Price", "Amount", "Value")) or 0).replace(",", ""))
+    except ValueError:
+        return 0.0
+
+
+def _day(value) -> str:
+    # Didar dates are ISO strings, only the day counts here
+    if not value:
+        return "NaT"
+    try:
+        return str(np.datetime64(str(value)[:10], "D"))
+    except ValueError:
+        return "NaT"
+
+
+def check_options(group_by: str, status: str = None, date_field: str = "created"):
+    if group_by not in GROUPS:
+        raise ValueError(f"Unknown group `{group_by}`, use one of {', '.join(GROUPS)}")
+    if status and status not in STATUSES:
+        raise ValueError(f"Unknown status `{status}`, use one of {', '.join(STATUSES)}")
+    if date_field not in DATE_FIELDS:
+        raise ValueError(f"Unknown date `{date_field}`, use one of {', '.join(DATE_FIELDS)}")
+
+
+def period_range(period: str, today: date = None) -> tuple:
+    # (start, end) as inclusive days, None for an open end
+    today = today or date.today()
+    if period in (None, "", "all"):
+        return None, None
+    if period == "today":
+        return today, today
+    if period == "this_week":
+        return today - timedelta(days=today.weekday()), today
+    if period == "this_month":
+        return today.replace(day=1), today
+    if period == "last_month":
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1), end
+    if period == "this_quarter":
+        return today.replace(month=(today.month - 1) // 3 * 3 + 1, day=1), today
+    if period == "this_year":
+        return today.replace(month=1, day=1), today
+    if period == "last_30_days":
+        return today - timedelta(days=29), today
+    if period == "last_90_days":
+        return today - timedelta(days=89), today
+    raise ValueError(f"Unknown period `{period}`, use one of {', '.join(PERIODS)}")
+
+
+class DealFrame:
+    # Deals as columns, so every aggregate is a handful of vectorized passes
+    def __init__(self, deals: list, users: list = None, pipelines: list = None):
+        deals = [deal for deal in deals if isinstance(deal, dict)]
+
+        self.owner_names = {}
+        for user in users or []:
+            if isinstance(user, dict) and (user.get("Id") or user.get("UserId")):
+                full_name = " ".join(part for part in (user.get("FirstName"), user.get("LastName")) if part)
+                self.owner_names[user.get("Id") or user.get("UserId")] = user.get("DisplayName") or full_name or user.get("UserName")
+
+        self.pipeline_names, self.stage_names, stage_pipelines = {}, {}, {}
+        for pipeline in pipelines or []:
+            if not isinstance(pipeline, dict) or not pipeline.get("Id"):
+                continue
+            self.pipeline_names[pipeline["Id"]] = pipeline.get("Title")
+            for stage in pipeline.get("Stages") or []:
+                if isinstance(stage, dict) and stage.get("Id"):
+                    self.stage_names[stage["Id"]] = f"{pipeline.get('Title')} / {stage.get('Title')}"
+                    stage_pipelines[stage["Id"]] = pipeline["Id"]
+
+        self.ids = np.array([str(deal.get("Id") or "") for deal in deals], dtype=object)
+        self.price = np.array([_price(deal) for deal in deals], dtype=np.float64)
+        self.status = np.array([STATUS_NAMES.get(str(deal.get("Status") or "pending").lower(), "open") for deal in deals], dtype=object)
+        self.stage = np.array([deal.get("PipelineStageId") or NO_GROUP for deal in deals], dtype=object)
+        self.pipeline = np.array([
+            deal.get("PipelineId") or stage_pipelines.get(deal.get("PipelineStageId")) or NO_GROUP for deal in deals
+        ], dtype=object)
+        self.owner = np.array([deal.get("OwnerId") or NO_GROUP for deal in deals], dtype=object)
+        self.dates = {
+            field: np.array([_day(_first(deal, keys)) for deal in deals], dtype="datetime64[D]")
+            for field, keys in DATE_FIELDS.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _label(self, group: str, key) -> str:
+        names = {"stage": self.stage_names, "pipeline": self.pipeline_names, "owner": self.owner_names}.get(group, {})
+        return names.get(key) or str(key)
+
+    def aggregate(self, group_by: str = "stage", status: str = None, start: date = None, end: date = None,
+                  date_field: str = "created", pipeline_id: str = None) -> dict:
+        check_options(group_by, status, date_field)
+        dates = self.dates[date_field]
+        mask = np.ones(len(self), dtype=bool)
+        if status:
+            mask &= self.status == status
+        if pipeline_id:
+            # The pipeline lookup also finds stages, a stage Id narrows to that stage
+            if pipeline_id in self.pipeline_names or (self.pipeline == pipeline_id).any():
+                mask &= self.pipeline == pipeline_id
+            elif pipeline_id in self.stage_names or (self.stage == pipeline_id).any():
+                mask &= self.stage == pipeline_id
+            else:
+                raise ValueError(f"Unknown pipeline or stage: {pipeline_id}")
+        # NaT compares False, so undated deals drop out of any date range
+        if start:
+            mask &= dates >= np.datetime64(start, "D")
+        if end:
+            mask &= dates <= np.datetime64(end, "D")
+
+        if group_by == "month":
+            months = dates[mask].astype("datetime64[M]")
+            keys = np.where(np.isnat(months), NO_GROUP, months.astype(str))
+        else:
+            keys = getattr(self, group_by)[mask]
+        prices = self.price[mask]
+
+        groups, inverse = np.unique(keys.astype(str), return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(groups))
+        totals = np.bincount(inverse, weights=prices, minlength=len(groups))
+        # Months read in order, everything else biggest first
+        order = np.arange(len(groups)) if group_by == "month" else np.lexsort((-counts, -totals))
+
+        return {
+            "columns": [group_by, "deals", "total_value", "average_value"],
+            "rows": [
+                [self._label(group_by, groups[i]), int(counts[i]), round(float(totals[i]), 2), round(float(totals[i] / counts[i]), 2)]
+                for i in order
+            ],
+            "deals": int(mask.sum()),
+            "total_value": round(float(prices.sum()), 2)
+        }
+
+
+class DealAnalytics:
+    # One columnar snapshot of the deals per worker, rebuilt in the background once it is older than the TTL
+    def __init__(self, client, ttl: float = ANALYTICS_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.frame = None
+        self.loaded_at = None
+        self.truncated = False
+        # Set when the running refresh ends, None while none runs
+        self.refreshing = None
+        self.lock = threading.Lock()
+
+    def _fetch_deals(self):
+        deals, offset = [], 0
+        while len(deals) < ANALYTICS_MAX_DEALS:
+            page = self.client.page_deals(offset, ANALYTICS_PAGE_SIZE)
+            if page is None:
+                return None, False
+            deals += page
+            offset += len(page)
+            if len(page) < ANALYTICS_PAGE_SIZE:
+                return deals, False
+        return deals[:ANALYTICS_MAX_DEALS], True
+
+    def _refresh(self, done: threading.Event):
+        frame = None
+        try:
+            with deadline_scope(Deadline(ANALYTICS_LOAD_TIMEOUT)):
+                deals, truncated = self._fetch_deals()
+                if deals is not None:
+                    frame = DealFrame(deals, self.client.fetch_users(), self.client.fetch_pipelines())
+        except Exception:
+            logger.exception("Deal snapshot refresh failed")
+        with self.lock:
+            if frame is not None:
+                self.frame, self.truncated, self.loaded_at = frame, truncated, time.monotonic()
+            else:
+                # Didar is unreachable, an older snapshot is still better than none
+                logger.warning("Could not refresh the deal snapshot, %s", "keeping the old one" if self.frame else "none loaded")
+            self.refreshing = None
+        done.set()
+
+    def load(self):
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at <= self.ttl:
+                return self.frame
+            done = self.refreshing
+            if done is None:
+                done = self.refreshing = threading.Event()
+                threading.Thread(target=self._refresh, args=(done,), name="deal-snapshot", daemon=True).start()
+            if self.frame is not None:
+                # Answered from the older snapshot while the new one loads
+                return self.frame
+        done.wait(call_timeout(FIRST_LOAD_WAIT))
+        return self.frame
+
+    def aggregate(self, group_by: str = "stage", status: str = None, period: str = "all", start: date = None,
+                  end: date = None, date_field: str = "created", pipeline_id: str = None) -> dict:
+        # Bad options are reported before anything is fetched
+        check_options(group_by, status, date_field)
+        if start is None and end is None:
+            start, end = period_range(period)
+        frame = self.load()
+        if frame is None:
+            if self.refreshing is not None:
+                return {"error": "The deals are still being loaded from the CRM, ask again in a minute"}
+            return {"error": "The deals could not be loaded"}
+
+        result = frame.aggregate(group_by, status, start, end, date_field, pipeline_id)
+        result["period"] = {"start": start, "end": end, "date": date_field}
+        result["as_of_seconds_ago"] = round(time.monotonic() - self.loaded_at)
+        if self.truncated:
+            result["note"] = f"Only the first {ANALYTICS_MAX_DEALS} deals Didar returned were counted"
+        return result
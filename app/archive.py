@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+from bson import Binary
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+from app.agent import sessions_db
+from app.db import LazyCollection, crm_db
+import json
+import logging
+import os
+import threading
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ENABLED = os.environ.get("SESSION_ARCHIVE_ENABLED", "false").lower() == "true"
+ARCHIVE_AFTER_DAYS = int(os.environ.get("SESSION_ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_TTL_DAYS = int(os.environ.get("SESSION_ARCHIVE_TTL_DAYS", 365))
+ARCHIVE_INTERVAL = int(os.environ.get("SESSION_ARCHIVE_INTERVAL", 3600))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("SESSION_ARCHIVE_BATCH_SIZE", 500))
+COMPRESSION_LEVEL = 10
+TITLE_LENGTH = 80
+# Kept uncompressed next to the history so listing sessions never decompresses it
+LIST_FIELDS = ("session_id", "user_id", "version", "created_at", "updated_at", "title", "turns")
+
+archived_sessions_db = LazyCollection("sessions_archive")
+
+_stop_event = threading.Event()
+_worker = None
+
+
+def compress_history(chat_history: list) -> Binary:
+    raw = json.dumps(chat_history, ensure_ascii=False).encode("utf-8")
+    return Binary(zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(raw))
+
+
+def decompress_history(blob: bytes) -> list:
+    return json.loads(zstandard.ZstdDecompressor().decompress(blob))
+
+
+def _expand(archived: dict) -> dict:
+    session = {key: value for key, value in archived.items() if key not in ("_id", "history_zstd", "turns", "title", "archived_at")}
+    session["chat_history"] = decompress_history(archived["history_zstd"])
+    return session
+
+
+def ensure_indexes():
+    sessions_db.create_index("updated_at")
+    archived_sessions_db.create_index("session_id", unique=True)
+    archived_sessions_db.create_index("user_id")
+
+    if ARCHIVE_TTL_DAYS <= 0:
+        try:
+            archived_sessions_db.drop_index("archived_ttl")
+        except OperationFailure:
+            pass
+        return
+
+    ttl = ARCHIVE_TTL_DAYS * 86400
+    try:
+        archived_sessions_db.create_index("archived_at", name="archived_ttl", expireAfterSeconds=ttl)
+    except OperationFailure:
+        # The TTL changed since the index was created
+        crm_db.command("collMod", "sessions_archive", index={"name": "archived_ttl", "expireAfterSeconds": ttl})
+
+
+def archive_session(session: dict, now: datetime) -> bool:
+    chat_history = session.get("chat_history", [])
+    archived = {key: value for key, value in session.items() if key not in ("_id", "chat_history")}
+    archived.update({
+        "history_zstd": compress_history(chat_history),
+        "turns": len(chat_history),
+        # The first question, until the title is generated again on reopening
+        "title": str(chat_history[0][0])[:TITLE_LENGTH] if chat_history else "",
+        "archived_at": now
+    })
+    archived_sessions_db.replace_one({"session_id": session["session_id"]}, archived, upsert=True)
+
+    # Only remove the hot copy if nobody wrote to it since it was read
+    deleted = sessions_db.delete_one({"session_id": session["session_id"], "version": session.get("version")})
+    if deleted.deleted_count:
+        return True
+
+    if sessions_db.find_one({"session_id": session["session_id"]}, {"_id": 1}):
+        archived_sessions_db.delete_one({"session_id": session["session_id"], "archived_at": now})
+    return False
+
+
+def archive_idle_sessions(now: datetime = None) -> int:
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+    # Sessions saved before timestamps existed start ageing from today
+    sessions_db.update_many({"updated_at": {"$exists": False}}, {"$set": {"updated_at": now}})
+
+    archived = 0
+    while not _stop_event.is_set():
+        batch = list(sessions_db.find({"updated_at": {"$lt": cutoff}}).limit(ARCHIVE_BATCH_SIZE))
+        if not batch:
+            break
+        archived += sum(archive_session(session, now) for session in batch)
+        if len(batch) < ARCHIVE_BATCH_SIZE:
+            break
+
+    return archived
+
+
+def rehydrate_session(session_id: str, user_id: str = None):
+    query = {"session_id": session_id}
+    if user_id is not None:
+        query["user_id"] = user_id
+
+    archived = archived_sessions_db.find_one(query)
+    if not archived:
+        return None
+
+    session = _expand(archived)
+    session["updated_at"] = datetime.utcnow()
+    try:
+        sessions_db.insert_one(dict(session))
+    except DuplicateKeyError:
+        # Another request brought it back first
+        return sessions_db.find_one({"session_id": session_id}, {"_id": 0})
+
+    archived_sessions_db.delete_one({"session_id": session_id})
+    return session
+
+
+def list_archived_sessions(user_id: str) -> list:
+    fields = {"_id": 0, **{field: 1 for field in LIST_FIELDS}}
+    return [
+        {**archived, "archived": True}
+        for archived in archived_sessions_db.find({"user_id": user_id}, fields)
+    ]
+
+
+def _run():
+    try:
+        ensure_indexes()
+    except PyMongoError:
+        logger.exception("Could not create archive indexes")
+
+    while not _stop_event.is_set():
+        try:
+            count = archive_idle_sessions()
+            if count:
+                logger.info("Archived %s idle session(s)", count)
+        except PyMongoError:
+            logger.exception("Session archival failed")
+        _stop_event.wait(ARCHIVE_INTERVAL)
+
+
+def start_archive_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    _stop_event.clear()
+    _worker = threading.Thread(target=_run, name="session-archiver", daemon=True)
+    _worker.start()
+
+
+def stop_archive_worker():
+    _stop_event.set()
+    if _worker is not None:
+        _worker.join(timeout=5)
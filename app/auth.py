@@ -4,18 +4,60 @@ from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from typing import Optional
 from fastapi import HTTPException
-from pymongo import MongoClient
+from pymongo import ReturnDocument
+from app.db import LazyCollection
 import os
+import threading
 
 def generate_random_string(length: int = 12) -> str:
     alphabet = string.ascii_letters + string.digits
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
-SECRET_KEY = os.environ.get("AUTH_SECRET_KEY", generate_random_string(32))
 ALGORITHM = os.environ.get("AUTH_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("AUTH_TOKEN_EXPIRE", 1440))
 
-users_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).crm.users
+users_db = LazyCollection("users")
+settings_db = LazyCollection("settings")
+
+_secret_key = None
+_secret_key_source = None
+_secret_key_lock = threading.Lock()
+
+def secret_key_source() -> str:
+    if os.environ.get("AUTH_SECRET_KEY"):
+        return "env"
+    if os.environ.get("AUTH_SECRET_KEY_FILE"):
+        return "file"
+    if os.environ.get("AUTH_SHARED_SECRET", "false").lower() == "true":
+        return "mongo"
+    return "random"
+
+def _load_secret_key(source: str) -> str:
+    if source == "env":
+        return os.environ["AUTH_SECRET_KEY"]
+    if source == "file":
+        with open(os.environ["AUTH_SECRET_KEY_FILE"]) as f:
+            return f.read().strip()
+    if source == "mongo":
+        # Every worker races to insert the same document, the first one wins
+        shared = settings_db.find_one_and_update(
+            {"_id": "auth_secret_key"},
+            {"$setOnInsert": {"value": generate_random_string(64)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return shared["value"]
+    return generate_random_string(32)
+
+def get_secret_key() -> str:
+    global _secret_key, _secret_key_source
+    source = secret_key_source()
+    if _secret_key is None or _secret_key_source != source:
+        with _secret_key_lock:
+            if _secret_key is None or _secret_key_source != source:
+                _secret_key = _load_secret_key(source)
+                _secret_key_source = source
+    return _secret_key
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -24,12 +66,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, get_secret_key(), algorithm=ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, get_secret_key(), algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
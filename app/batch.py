@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fastapi import HTTPException
+from app.deadline import Deadline
+from app.turns import run_turn
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 1000))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 8))
+
+
+def plan_waves(items: list) -> list:
+    # Items sharing a session run one per wave so each sees the turns before it,
+    # items without a session each get their own and all run in the first wave
+    lanes = {}
+    for index, item in enumerate(items):
+        session_id = item.get("session_id") or str(uuid.uuid4())
+        lanes.setdefault(session_id, []).append((index, session_id, item["query"]))
+
+    waves = []
+    for lane in lanes.values():
+        for depth, entry in enumerate(lane):
+            if depth == len(waves):
+                waves.append([])
+            waves[depth].append(entry)
+    return waves
+
+
+def _error(index: int, session_id: str, error: Exception, deadline: Deadline = None) -> dict:
+    if deadline is not None and deadline.expired:
+        return {"index": index, "session_id": session_id, "status": 504, "error": "Request deadline exceeded"}
+    if isinstance(error, HTTPException):
+        return {"index": index, "session_id": session_id, "status": error.status_code, "error": error.detail}
+    logger.error("Batch item %s failed: %r", index, error)
+    return {"index": index, "session_id": session_id, "status": 500, "error": str(error)}
+
+
+def _run_item(user: dict, index: int, session_id: str, question: str, deadlines: list, stopped: threading.Event) -> dict:
+    # The budget starts when a worker picks the item up, not while it waits behind others
+    deadline = Deadline()
+    deadlines.append(deadline)
+    if stopped.is_set():
+        deadline.cancel()
+    try:
+        result = run_turn(user, question, session_id, deadline=deadline, rate_limited=False)
+    except Exception as e:
+        return _error(index, session_id, e, deadline)
+    return {
+        "index": index,
+        "session_id": session_id,
+        "agent": result["agent"],
+        "response": result["response"],
+        "version": result["version"],
+        "models": result["models"]
+    }
+
+
+def run_batch(user: dict, items: list, concurrency: int):
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    started = time.monotonic()
+    failed = 0
+
+    for wave in plan_waves(items):
+        # Each item is a full turn, with its own graph slot and session lock taken when it starts
+        deadlines, stopped = [], threading.Event()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        futures = [
+            executor.submit(_run_item, user, index, session_id, question, deadlines, stopped)
+            for index, session_id, question in wave
+        ]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                failed += "error" in result
+                yield result
+        finally:
+            # Reached early when the client disconnects, queued items never start
+            # and running ones stop at their next call
+            stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            for deadline in deadlines:
+                deadline.cancel()
+
+    yield {"done": True, "total": len(items), "failed": failed, "elapsed_seconds": round(time.monotonic() - started, 3)}
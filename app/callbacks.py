@@ -0,0 +1,169 @@
+from collections import defaultdict
+from langchain_core.callbacks import BaseCallbackHandler
+import threading
+import time
+
+
+def _token_counts(response):
+    prompt_tokens = completion_tokens = cached_tokens = 0
+    model = None
+
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+                cached_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+            if message is not None:
+                model = model or message.response_metadata.get("model_name")
+
+    llm_output = response.llm_output or {}
+    if not prompt_tokens and not completion_tokens and llm_output.get("token_usage"):
+        token_usage = llm_output["token_usage"]
+        prompt_tokens = token_usage.get("prompt_tokens", 0)
+        completion_tokens = token_usage.get("completion_tokens", 0)
+        cached_tokens = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+    return model or llm_output.get("model_name"), prompt_tokens, completion_tokens, cached_tokens
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    def __init__(self, node: str = None):
+        self.node = node
+        self.runs = {}
+        self.totals = defaultdict(lambda: {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "total_tokens": 0
+        })
+        self.lock = threading.Lock()
+
+    def _start(self, run_id, metadata):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node", self.node)
+        self.runs[run_id] = (node, metadata.get("purpose"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        node, purpose = self.runs.pop(run_id, (self.node, None))
+        model, prompt_tokens, completion_tokens, cached_tokens = _token_counts(response)
+
+        with self.lock:
+            counts = self.totals[(node, purpose, model)]
+            counts["calls"] += 1
+            counts["prompt_tokens"] += prompt_tokens
+            counts["completion_tokens"] += completion_tokens
+            counts["cached_tokens"] += cached_tokens
+            counts["total_tokens"] += prompt_tokens + completion_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.runs.pop(run_id, None)
+
+    def models(self) -> dict:
+        # Which models answered each node and purpose, fallbacks included
+        models = {}
+        with self.lock:
+            for node, purpose, model in self.totals:
+                models.setdefault(f"{node}.{purpose}", set()).add(model)
+        return {key: sorted(filter(None, names)) for key, names in models.items()}
+
+
+class EventCallbackHandler(BaseCallbackHandler):
+    # Exceptions raised by emit, e.g. when a turn is cancelled, must stop the run
+    raise_error = True
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.tools = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name")
+        self.tools[run_id] = name
+        self.emit({"type": "tool", "name": name, "status": "started"})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.emit({"type": "tool", "name": self.tools.pop(run_id, None), "status": "finished"})
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.emit({"type": "tool", "name": self.tools.pop(run_id, None), "status": "failed"})
+
+
+class SpanCallbackHandler(BaseCallbackHandler):
+    # Timeline of one run: the graph, its nodes, LLM calls with their tokens and tools
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.open = {}
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def _elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def _start(self, run_id, parent_run_id, kind: str, name: str, node: str = None):
+        with self.lock:
+            self.open[run_id] = {
+                "id": str(run_id),
+                "parent": str(parent_run_id) if parent_run_id else None,
+                "kind": kind,
+                "name": name,
+                "node": node,
+                "thread": threading.current_thread().name,
+                "start_ms": self._elapsed_ms()
+            }
+
+    def _end(self, run_id, error: BaseException = None, **fields):
+        with self.lock:
+            span = self.open.pop(run_id, None)
+            if span is None:
+                return None
+            span["end_ms"] = self._elapsed_ms()
+            span["duration_ms"] = round(span["end_ms"] - span["start_ms"], 1)
+            if error is not None:
+                span["error"] = type(error).__name__
+            span.update(fields)
+            self.spans.append(span)
+            return span
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if parent_run_id is None:
+            self._start(run_id, None, "graph", kwargs.get("name") or "graph")
+        # Only the graph nodes themselves, not every runnable inside them
+        elif node and kwargs.get("name") == node:
+            self._start(run_id, parent_run_id, "node", node, node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        self._start(run_id, parent_run_id, "llm", metadata.get("purpose") or "llm", metadata.get("langgraph_node"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        self._start(run_id, parent_run_id, "llm", metadata.get("purpose") or "llm", metadata.get("langgraph_node"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model, prompt_tokens, completion_tokens, cached_tokens = _token_counts(response)
+        self._end(run_id, model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._start(run_id, parent_run_id, "tool", name, (metadata or {}).get("langgraph_node"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
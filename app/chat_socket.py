@@ -0,0 +1,180 @@
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+from app.agent import get_graph
+from app.auth import verify_token
+from app.deadline import DeadlineExceeded, request_deadline
+from app.sessions import load_session
+from app.turns import run_turn
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Events waiting to be written to a slow client before the agent run is paused
+SOCKET_QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", 64))
+AUTH_TIMEOUT = float(os.environ.get("WS_AUTH_TIMEOUT", 10))
+
+# The crm-agent's raw LLM output is ReAct scaffolding, only plain answers are streamed
+STREAMED_NODES = {"unknown"}
+
+POLICY_VIOLATION = 1008
+
+
+class TurnCancelled(Exception):
+    pass
+
+
+class ChatConnection:
+    def __init__(self, websocket: WebSocket, user: dict, session_id: str):
+        self.websocket = websocket
+        self.user = user
+        self.session_id = session_id
+        self.loop = asyncio.get_running_loop()
+        self.outbox = asyncio.Queue(maxsize=SOCKET_QUEUE_SIZE)
+        self.cancelled = threading.Event()
+        self.closed = False
+        self.turn = None
+        self.deadline = None
+
+    async def send(self, event: dict):
+        if not self.closed:
+            await self.outbox.put(event)
+
+    def emit(self, event: dict):
+        # Runs on the agent's thread and blocks while the outbox is full
+        while not self.cancelled.is_set():
+            future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(self.send(event), 0.5), self.loop)
+            try:
+                future.result()
+                return
+            except TimeoutError:
+                continue
+        raise TurnCancelled()
+
+    def execute(self, state: dict, config: dict) -> dict:
+        final = None
+        for mode, chunk in get_graph().stream(state, config=config, stream_mode=["updates", "messages", "values"]):
+            if self.cancelled.is_set():
+                raise TurnCancelled()
+
+            if mode == "updates":
+                for node, update in chunk.items():
+                    self.emit({"type": "event", "node": node, "agent": (update or {}).get("agent")})
+            elif mode == "messages":
+                message, metadata = chunk
+                if metadata.get("langgraph_node") in STREAMED_NODES and metadata.get("purpose") == "answer" and message.content:
+                    self.emit({"type": "token", "node": metadata["langgraph_node"], "content": message.content})
+            else:
+                final = chunk
+        return final
+
+    async def run(self, question: str):
+        from app.callbacks import EventCallbackHandler
+
+        self.cancelled.clear()
+        try:
+            result = await run_in_threadpool(
+                run_turn, self.user, question, self.session_id, self.execute, [EventCallbackHandler(self.emit)], self.deadline
+            )
+            await self.send({"type": "answer", **result})
+        except (TurnCancelled, DeadlineExceeded):
+            await self.send({"type": "cancelled"})
+        except HTTPException as e:
+            await self.send({"type": "error", "status": e.status_code, "detail": e.detail})
+        except Exception:
+            logger.exception("Chat turn failed")
+            await self.send({"type": "error", "status": 500, "detail": "Internal server error"})
+
+    async def send_loop(self):
+        while True:
+            event = await self.outbox.get()
+            await self.websocket.send_json(event)
+
+    async def receive_loop(self):
+        while True:
+            try:
+                message = json.loads(await self.websocket.receive_text())
+            except ValueError:
+                await self.send({"type": "error", "status": 400, "detail": "Messages must be JSON"})
+                continue
+            if not isinstance(message, dict):
+                await self.send({"type": "error", "status": 400, "detail": "Messages must be JSON objects"})
+                continue
+
+            kind = message.get("type")
+            busy = self.turn is not None and not self.turn.done()
+
+            if kind == "ask":
+                query = message.get("query")
+                question = query.strip() if isinstance(query, str) else ""
+                if not question:
+                    await self.send({"type": "error", "status": 400, "detail": "Query cannot be empty"})
+                elif busy:
+                    await self.send({"type": "error", "status": 409, "detail": "A question is already being answered"})
+                else:
+                    try:
+                        self.deadline = request_deadline(message.get("timeout"))
+                    except HTTPException as e:
+                        await self.send({"type": "error", "status": e.status_code, "detail": e.detail})
+                        continue
+                    self.turn = asyncio.create_task(self.run(question))
+            elif kind == "cancel":
+                if busy:
+                    self.cancelled.set()
+                    self.deadline.cancel()
+            elif kind == "ping":
+                await self.send({"type": "pong"})
+            else:
+                await self.send({"type": "error", "status": 400, "detail": f"Unknown message type: {kind}"})
+
+    async def serve(self):
+        sender = asyncio.create_task(self.send_loop())
+        try:
+            await self.send({"type": "ready", "session_id": self.session_id})
+            await self.receive_loop()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # Stops the agent at its next step instead of paying for an answer nobody reads
+            self.closed = True
+            self.cancelled.set()
+            if self.deadline is not None:
+                self.deadline.cancel()
+            sender.cancel()
+
+
+async def _authenticate(websocket: WebSocket, token: str = None) -> dict:
+    if not token:
+        message = json.loads(await asyncio.wait_for(websocket.receive_text(), AUTH_TIMEOUT))
+        if not isinstance(message, dict):
+            raise HTTPException(status_code=400, detail="Messages must be JSON objects")
+        if message.get("type") != "auth":
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        token = message.get("token")
+    if not token or not isinstance(token, str):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await run_in_threadpool(verify_token, token)
+
+
+async def serve_chat(websocket: WebSocket, token: str = None, session_id: str = None):
+    await websocket.accept()
+
+    try:
+        user = await _authenticate(websocket, token)
+        session_id = session_id or str(uuid.uuid4())
+        await run_in_threadpool(load_session, session_id, str(user["_id"]))
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        await websocket.close(code=POLICY_VIOLATION)
+        return
+    except (ValueError, asyncio.TimeoutError):
+        await websocket.close(code=POLICY_VIOLATION)
+        return
+    except WebSocketDisconnect:
+        return
+
+    await ChatConnection(websocket, user, session_id).serve()
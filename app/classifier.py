@@ -1,9 +1,8 @@
-from langchain_openai import ChatOpenAI
 from langsmith import traceable
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from typing import TypedDict, Literal
-
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+from typing import Any, TypedDict, Literal
+from app.model_policy import chat_model
+import re
 
 AgentType = Literal["crm-agent", "unknown"]
 
@@ -18,15 +17,12 @@ class AgentState(TypedDict, total=False):
     session_id: str
     agent: AgentType
     answer: str
+    history_summary: str
+    speculation: dict
+    deadline: Any
+    tenant: str
 
-@traceable
-def classifier_node(state: AgentState) -> AgentState:
-    question = state.get("question", "").strip()
-
-    summerizer = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
-    chat_history = state.get("chat_history", [])
-
+def summarize_history(chat_history: list, summerizer) -> str:
     summary_messages = [
         SystemMessage(content="You are a chat history summarizer. If there is no chat history, return nothing. Summarize this chat history:")
     ]
@@ -35,8 +31,9 @@ def classifier_node(state: AgentState) -> AgentState:
         summary_messages.append(HumanMessage(content=user))
         summary_messages.append(AIMessage(content=assistant))
 
-    summary = summerizer.invoke(summary_messages)
+    return summerizer.invoke(summary_messages).content.strip()
 
+def classifier_prompt(question: str, chat_history: list, summary: str = None) -> str:
     last_entry = chat_history[-1] if chat_history else None
     if last_entry != None:
         if isinstance(last_entry, dict):
@@ -57,23 +54,49 @@ def classifier_node(state: AgentState) -> AgentState:
             f"The user just asked: '{question}'. Classify this appropriately."
         )
     else:
+        summary_line = f"Here is a summary of the chat history:\n{summary}\n" if summary is not None else ""
         system_prompt = (
             "You are a smart classifier. Your job is to categorize a user's question and pass the prompt to the related agent.\n"
             "Return only one word: 'crm-agent' or 'unknown'.\n"
             "Return 'crm-agent' if the prompt is an Imperative sentence or the question is related to customer relationship management, orders, products, support, or user/account actions or it is requesting to pull off an action.\n"
             "عبارت 'crm-agent' را برگردان اگر پرامپت کاربر یک جمله ی امری است یا کاربر درخواست انجام کاری را انجام داده است یا سوال مرتبط به سیستم CRM، کاریز ها، پشتیبانی، محصولات، سفارشات یا کاربران و مشتریان است.\n"
             "If it doesn't clearly fit into those, return 'unknown'.\n"
-            f"Here is a summary of the chat history:\n{summary.content.strip()}\n"
+            f"{summary_line}"
             f"The last question asked by the user is: '{last_entry_question}' and the {last_entry_agent} answered: '{last_entry_answer}'."
             " If this new question is a follow-up or continuation, return the same agent. Otherwise, classify the new question."
         )
 
+    return system_prompt
+
+def parse_label(raw_output: str) -> AgentType:
+    raw_output = raw_output.strip().lower()
+    return raw_output if raw_output in {"crm-agent"} else "unknown"
+
+CRM_HINTS = re.compile(
+    r"\b(crm|deal|deals|contact|contacts|case|cases|customer|customers|order|orders|product|products|"
+    r"invoice|ticket|support|create|add|update|delete|find|search|show|list)\b|"
+    r"معامله|مخاطب|مشتری|سفارش|محصول|پشتیبانی|کاریز|ایجاد|اضافه|حذف|جستجو|نمایش|پیدا",
+    re.IGNORECASE
+)
+
+def guess_agent(question: str) -> AgentType:
+    # A free first guess for speculative runs, classify has the final say
+    return "crm-agent" if CRM_HINTS.search(question) else "unknown"
+
+# Routes on the question and the last turn only, so it does not wait for the history summary
+def classify(question: str, chat_history: list, llm=None) -> AgentType:
+    llm = llm or chat_model("classify", "classify")
+
     response = llm.invoke([
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": classifier_prompt(question, chat_history)},
         {"role": "user", "content": question}
     ])
 
-    raw_output = response.content.strip().lower()
-    label = raw_output if raw_output in {"crm-agent"} else "unknown"
+    return parse_label(response.content)
 
-    return {**state, "agent": label}
\ No newline at end of file
+@traceable
+def classifier_node(state: AgentState) -> AgentState:
+    # Runs in parallel with the history node, so it only returns the key it owns
+    question = state.get("question", "").strip()
+    llm = chat_model("classify", "classify", deadline=state.get("deadline"))
+    return {"agent": classify(question, state.get("chat_history", []), llm)}
@@ -0,0 +1,244 @@
+from app.resolver import normalize, is_id
+from app import crm_mirror
+import os
+import re
+
+COMMANDS_ENABLED = os.environ.get("COMMANDS_ENABLED", "true").lower() == "true"
+COMMAND_MAX_ROWS = int(os.environ.get("COMMAND_MAX_ROWS", 50))
+COMMAND_SEARCH_LIMIT = 10
+
+# Answers from a command are recorded under this agent name
+COMMAND_AGENT = "command"
+
+PERSIAN_LETTERS = re.compile(r"[؀-ۿ]")
+
+# Command -> (slash names, phrases, takes an argument). Phrases are compared after
+# normalize(), so Arabic and Persian spellings and half-spaces match alike
+GRAMMAR = {
+    "help": (("help", "commands"), ("help", "commands", "راهنما", "دستورات"), False),
+    "users": (("users",), ("list users", "show users", "all users", "لیست کاربران", "فهرست کاربران", "کاربران"), False),
+    "products": (("products",), ("list products", "show products", "all products", "لیست محصولات", "فهرست محصولات", "محصولات"), False),
+    "categories": (
+        ("categories",),
+        ("list product categories", "list categories", "product categories", "لیست دسته بندی محصولات", "دسته بندی محصولات", "لیست دسته بندی ها"),
+        False
+    ),
+    "pipelines": (("pipelines",), ("list pipelines", "show pipelines", "لیست کاریزها", "لیست کاریز ها", "کاریزها", "کاریز ها"), False),
+    "activity_types": (("activity-types", "activities"), ("list activity types", "activity types", "لیست انواع فعالیت", "انواع فعالیت"), False),
+    "contact": (
+        ("contact", "contacts"),
+        ("search contact", "search contacts", "find contact", "جستجوی مشتری", "جستجو مشتری", "جست وجوی مشتری", "جستجوی مخاطب"),
+        True
+    ),
+    "deal": (("deal", "deals"), ("search deal", "search deals", "find deal", "جستجوی معامله", "جستجو معامله", "جست وجوی معامله"), True),
+    "product": (("product",), ("search product", "find product", "جستجوی محصول", "جستجو محصول", "جست وجوی محصول"), True),
+    "company": (("company", "companies"), ("search company", "find company", "جستجوی شرکت", "جستجو شرکت", "جست وجوی شرکت"), True),
+    "case": (("case", "cases"), ("search case", "find case", "جستجوی پرونده", "جستجو پرونده"), True),
+    "cards": (("cards",), ("cards of", "list cards of", "list cards", "کارت های", "لیست کارت های"), True),
+}
+
+# A typed phrase takes only a lookup key, anything more is a question for the agent
+MAX_KEY_WORDS = 3
+PHONE = re.compile(r"^\+?[\d\s()\-]{5,}$")
+EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.\w+$")
+QUESTION_WORDS = {
+    "who", "whom", "whose", "what", "which", "when", "where", "why", "how", "that", "with", "of", "is", "are",
+    "my", "me", "most", "highest", "lowest", "top", "today", "this", "last", "all", "overdue",
+    "چه", "چی", "چیست", "چیه", "کدام", "کدوم", "کی", "کجا", "چرا", "چطور", "چگونه", "چند", "که", "با",
+    "است", "هست", "من", "امروز", "دیروز", "همه", "بیشترین", "کمترین",
+}
+
+SLASH_NAMES = {slash: command for command, (slashes, _, _) in GRAMMAR.items() for slash in slashes}
+PHRASES = sorted(
+    ((normalize(phrase), command) for command, (_, phrases, _) in GRAMMAR.items() for phrase in phrases),
+    key=lambda pair: len(pair[0]),
+    reverse=True
+)
+
+TEXTS = {
+    "en": {
+        "help": "Commands, answered without the assistant:",
+        "users": "Users", "products": "Products", "categories": "Product categories", "pipelines": "Pipelines",
+        "activity_types": "Activity types", "contact": "Contacts matching", "deal": "Deals matching",
+        "product": "Products matching", "company": "Companies matching", "case": "Cases matching", "cards": "Cards of",
+        "empty": "Nothing was found.",
+        "failed": "The CRM could not be reached, please try again.",
+        "usage": "This command needs a search term, e.g. `/{command} Ali`.",
+        "more": "and {count} more",
+        "choose": "Several users match `{name}`, repeat the command with one of these IDs:",
+        "unknown": "No user named `{name}` was found.",
+    },
+    "fa": {
+        "help": "دستورهایی که بدون دستیار پاسخ داده می‌شوند:",
+        "users": "کاربران", "products": "محصولات", "categories": "دسته‌بندی محصولات", "pipelines": "کاریزها",
+        "activity_types": "انواع فعالیت", "contact": "مشتریان مطابق با", "deal": "معاملات مطابق با",
+        "product": "محصولات مطابق با", "company": "شرکت‌های مطابق با", "case": "پرونده‌های مطابق با", "cards": "کارت‌های",
+        "empty": "موردی پیدا نشد.",
+        "failed": "ارتباط با CRM برقرار نشد، لطفاً دوباره تلاش کنید.",
+        "usage": "این دستور به عبارت جستجو نیاز دارد، مثلاً `/{command} علی`.",
+        "more": "و {count} مورد دیگر",
+        "choose": "چند کاربر با `{name}` مطابقت دارند، دستور را با یکی از این شناسه‌ها تکرار کنید:",
+        "unknown": "کاربری با نام `{name}` پیدا نشد.",
+    },
+}
+
+# Shown after the title of each row, when the record has them
+DETAIL_FIELDS = ("Code", "MobilePhone", "Email", "UnitPrice", "Price", "Status", "DueDate")
+
+
+def match_command(question: str):
+    # (command, argument) for a shortcut, or None to let the graph answer
+    if not COMMANDS_ENABLED:
+        return None
+    text = " ".join(str(question or "").split())
+    if not text:
+        return None
+
+    if text.startswith("/"):
+        name, _, argument = text[1:].partition(" ")
+        command = SLASH_NAMES.get(name.lower())
+        return (command, argument.strip()) if command else None
+
+    words = text.split(" ")
+    for count in range(1, len(words) + 1):
+        prefix = normalize(" ".join(words[:count]))
+        for phrase, command in PHRASES:
+            if prefix != phrase:
+                continue
+            argument = " ".join(words[count:]).strip()
+            takes_argument = GRAMMAR[command][2]
+            # "list products under 100" is a question for the agent, not the command
+            if not takes_argument and not argument or takes_argument and _lookup_key(argument):
+                return command, argument
+    return None
+
+
+def _lookup_key(argument: str) -> bool:
+    # A phone number, an Id, an email or a short name, "/command" takes any text
+    if is_id(argument) or EMAIL.match(argument):
+        return True
+    if PHONE.match(normalize(argument)) and sum(char.isdigit() for char in argument) >= 5:
+        return True
+    if not argument or "?" in argument or "؟" in argument:
+        return False
+    words = normalize(argument).split()
+    return 0 < len(words) <= MAX_KEY_WORDS and not QUESTION_WORDS.intersection(words)
+
+
+def _language(question: str) -> str:
+    return "fa" if PERSIAN_LETTERS.search(question) else "en"
+
+
+def _title(row: dict) -> str:
+    full_name = " ".join(part for part in (row.get("FirstName"), row.get("LastName")) if part)
+    return str(row.get("DisplayName") or row.get("Title") or row.get("FullName") or full_name or row.get("Name") or row.get("Id") or "-")
+
+
+def _row(row: dict) -> str:
+    if not isinstance(row, dict):
+        return f"- {row}"
+    details = [f"{field}: {row[field]}" for field in DETAIL_FIELDS if row.get(field) not in (None, "")]
+    stages = [stage.get("Title") for stage in row.get("Stages") or [] if isinstance(stage, dict) and stage.get("Title")]
+    if stages:
+        details.append(" → ".join(stages))
+    line = f"- {_title(row)}"
+    if details:
+        line += f" ({', '.join(details)})"
+    if row.get("Id"):
+        line += f" `{row['Id']}`"
+    return line
+
+
+def render(rows: list, heading: str, texts: dict) -> str:
+    if not rows:
+        return f"{heading}\n\n{texts['empty']}"
+    lines = [_row(row) for row in rows[:COMMAND_MAX_ROWS]]
+    if len(rows) > COMMAND_MAX_ROWS:
+        lines.append(f"- … {texts['more'].format(count=len(rows) - COMMAND_MAX_ROWS)}")
+    return f"{heading}\n\n" + "\n".join(lines)
+
+
+def _help(texts: dict) -> str:
+    lines = []
+    for command, (slashes, phrases, takes_argument) in GRAMMAR.items():
+        usage = f"/{slashes[0]}" + (" …" if takes_argument else "")
+        lines.append(f"- `{usage}` — {', '.join(phrases[:2])}")
+    return f"{texts['help']}\n\n" + "\n".join(lines)
+
+
+def _mirrored(kind: str, argument: str, client):
+    # The local mirror first, it answers in milliseconds
+    mirrored = crm_mirror.search(kind, argument, limit=COMMAND_SEARCH_LIMIT)
+    if mirrored is not None:
+        return mirrored["data"], None
+    return client.fetch_search(kind, argument), None
+
+
+def _owner_id(argument: str, resolver, texts: dict):
+    # (owner ID, None), or (None, an answer listing the candidates)
+    if is_id(argument):
+        return argument, None
+    resolved = resolver.resolve("user", argument)
+    if resolved["match"]:
+        return resolved["match"]["id"], None
+    if resolved.get("error"):
+        return None, texts["failed"]
+    if not resolved["candidates"]:
+        return None, texts["unknown"].format(name=argument)
+    candidates = [{"DisplayName": candidate["name"], "Id": candidate["id"]} for candidate in resolved["candidates"]]
+    return None, render(candidates, texts["choose"].format(name=argument), texts)
+
+
+def _fetch(command: str, argument: str, client, resolver, texts: dict):
+    # (rows or None when Didar failed, an answer that replaces the rows)
+    if command == "users":
+        return client.fetch_users(), None
+    if command == "products":
+        return client.fetch_products(), None
+    if command == "categories":
+        return client.fetch_product_categories(), None
+    if command == "pipelines":
+        return client.fetch_pipelines(), None
+    if command == "activity_types":
+        return client.fetch_activity_types(), None
+    if command in ("contact", "deal", "case"):
+        return _mirrored(command, argument, client)
+    if command == "company":
+        return client.fetch_search("company", argument), None
+    if command == "product":
+        return client.fetch_product_search(argument, COMMAND_SEARCH_LIMIT), None
+    if command == "cards":
+        owner_id, unresolved = _owner_id(argument, resolver, texts)
+        if unresolved:
+            return None, unresolved
+        return client.fetch_cards(owner_id), None
+    raise ValueError(f"Unknown command {command}")
+
+
+def run_command(command: str, argument: str, question: str, client=None, resolver=None) -> str:
+    if client is None or resolver is None:
+        # The agent's client and resolver, so their connections and caches are shared
+        from app.agents import crm_agent
+        client = client or crm_agent.crm_client
+        resolver = resolver or crm_agent.resolver
+
+    texts = TEXTS[_language(question)]
+    if command == "help":
+        return _help(texts)
+    if GRAMMAR[command][2] and not argument:
+        return texts["usage"].format(command=GRAMMAR[command][0][0])
+
+    rows, answer = _fetch(command, argument, client, resolver, texts)
+    if answer is not None:
+        return answer
+    if rows is None:
+        return texts["failed"]
+
+    heading = texts[command] + (f" `{argument}`" if GRAMMAR[command][2] else "")
+    return render(rows, f"**{heading}**", texts)
+
+
+def command_turn(question: str, chat_history: list, command: str, argument: str) -> dict:
+    # Shaped like a graph result, so the turn is saved the same way
+    answer = run_command(command, argument, question)
+    return {"agent": COMMAND_AGENT, "answer": answer, "chat_history": [*chat_history, (question, answer)]}
@@ -1,5 +1,10 @@
 import httpx
+import os
+import threading
+import time
 from typing import Any, Dict
+from app.admission import TokenBucket
+from app.deadline import call_timeout
 
 from typing import List, Optional
 from pydantic import BaseModel, root_validator
@@ -72,23 +77,90 @@ class CardData(BaseModel):
     LabelId: str
 
 
+FAILURE_MESSAGE = "Failed to retrieve information from server"
+
+# The most one Didar call may take, less when the request's deadline is closer
+CRM_TIMEOUT = float(os.environ.get("CRM_TIMEOUT", 10))
+
+
 class CRMClient:
-    def __init__(self, api_key: str, base_url: str = "https://app.didar.me/api"):
+    def __init__(self, api_key: str, base_url: str = "https://app.didar.me/api", rate: float = 0, burst: float = 1, max_connections: int = None):
         self.api_key = api_key
         self.base_url = base_url
-        self.client = httpx.Client(timeout=10.0)
+        self.max_connections = max_connections
+        # Calls per second to this Didar account, 0 for no limit
+        self._bucket = TokenBucket(rate, max(burst, 1)) if rate > 0 else None
+        self._bucket_lock = threading.Lock()
+        self._client = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.Client:
+        # httpx connection pools must not be shared across forked workers
+        pid = os.getpid()
+        if self._client is None or self._client_pid != pid:
+            with self._client_lock:
+                if self._client is None or self._client_pid != pid:
+                    limits = {}
+                    if self.max_connections:
+                        limits["limits"] = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+                    self._client = httpx.Client(timeout=CRM_TIMEOUT, **limits)
+                    self._client_pid = pid
+        return self._client
+
+    def close(self):
+        with self._client_lock:
+            if self._client is not None and self._client_pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._client_pid = None
 
     def _url(self, path: str) -> str:
         return f"{self.base_url}/{path}?apikey={self.api_key}"
 
+    def _throttle(self, timeout: float) -> bool:
+        # Waits for the account's rate limit, False when that takes longer than the call may
+        if self._bucket is None:
+            return True
+        waited = 0.0
+        while True:
+            with self._bucket_lock:
+                wait = self._bucket.take()
+            if not wait:
+                return True
+            if waited + wait > timeout:
+                return False
+            time.sleep(wait)
+            waited += wait
+
     def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Raises DeadlineExceeded instead of starting a call that cannot finish in time
+        timeout = call_timeout(CRM_TIMEOUT)
+        if not self._throttle(timeout):
+            return FAILURE_MESSAGE
         try:
-            response = self.client.post(self._url(path), json=payload)
+            response = self.client.post(self._url(path), json=payload, timeout=timeout)
             response.raise_for_status()
         except:
-            return "Failed to retrieve information from server"
+            return FAILURE_MESSAGE
         
         return response.json()["Response"]
+
+    def _items(self, response) -> Optional[List[Dict[str, Any]]]:
+        if isinstance(response, dict):
+            # A reply without a list is an error body, not an empty page
+            return response["List"] or [] if "List" in response else None
+        if isinstance(response, list):
+            return response
+        return None
+
+    def _page(self, path: str, offset: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post(path, {
+            "Criteria": {},
+            "From": offset,
+            "Limit": limit
+        }))
     
     def list_users(self):
         response = self._post("User/List", {})
@@ -159,6 +231,58 @@ class CRMClient:
         })
         return str(response)
     
+    def fetch_users(self) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post("User/List", {}))
+
+    def fetch_pipelines(self, num: int = 0) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post(f"pipeline/list/{num}", {}))
+
+    def fetch_products(self) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post("product/GetProductsList", {}))
+
+    def fetch_product_categories(self) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post("product/categories", {}))
+
+    def fetch_activity_types(self) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post("activity/GetActivityType", {}))
+
+    def fetch_search(self, kind: str, query: str) -> Optional[List[Dict[str, Any]]]:
+        response = self._post("search/search", {
+            "Keyword": query,
+            "Types": [kind]
+        })
+        if isinstance(response, dict) and "List" not in response:
+            # Search results come grouped by type
+            return [item for value in response.values() if isinstance(value, list) for item in value]
+        return self._items(response)
+
+    def fetch_product_search(self, query: str, num: int = 10) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post("product/search", {
+            "Criteria": {
+                "Keywords": query
+            },
+            "From": 0,
+            "Limit": num
+        }))
+
+    def fetch_cards(self, owner_id: str, num: int = 10) -> Optional[List[Dict[str, Any]]]:
+        return self._items(self._post("Case/search", {
+            "Criteria": {
+                "OwnerId": owner_id
+            },
+            "From": 0,
+            "Limit": num
+        }))
+
+    def page_contacts(self, offset: int = 0, limit: int = 100):
+        return self._page("contact/PersonSearch", offset, limit)
+
+    def page_deals(self, offset: int = 0, limit: int = 100):
+        return self._page("deal/search", offset, limit)
+
+    def page_cases(self, offset: int = 0, limit: int = 100):
+        return self._page("Case/search", offset, limit)
+    
     def get_cards(self, owner_id: str, num: int = 10):
         response = self._post("Case/search", {
             "Criteria":{
@@ -0,0 +1,215 @@
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReturnDocument, TEXT
+from pymongo.errors import PyMongoError, DuplicateKeyError
+from app.db import crm_db
+from app.tenants import DEFAULT_TENANT, current_tenant
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MIRROR_ENABLED = os.environ.get("CRM_MIRROR_ENABLED", "false").lower() == "true"
+# Didar's search has no modified-since filter or sort order, so every pass reads
+# the whole account, the interval is set with that in mind
+SYNC_INTERVAL = int(os.environ.get("CRM_MIRROR_SYNC_INTERVAL", 1800))
+PAGE_SIZE = int(os.environ.get("CRM_MIRROR_PAGE_SIZE", 100))
+MAX_AGE = int(os.environ.get("CRM_MIRROR_MAX_AGE", 3600))
+LEASE_SECONDS = SYNC_INTERVAL * 2
+
+mirror_db = crm_db
+
+# Mirrored entity kind -> CRMClient paging method
+KINDS = {
+    "contact": "page_contacts",
+    "deal": "page_deals",
+    "case": "page_cases",
+}
+
+HIDDEN_FIELDS = {"_id": 0, "_hash": 0, "_seen_at": 0, "_seen_by": 0, "_synced_at": 0}
+
+_stop_event = threading.Event()
+_worker = None
+
+
+def _collection(kind: str):
+    return mirror_db[f"mirror_{kind}"]
+
+
+def _digest(item: dict) -> str:
+    return hashlib.sha1(json.dumps(item, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def ensure_indexes():
+    for kind in KINDS:
+        collection = _collection(kind)
+        collection.create_index("Id", unique=True)
+        collection.create_index([("$**", TEXT)], name="mirror_text")
+    mirror_db.mirror_state.create_index("kind", unique=True, sparse=True)
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def sync_kind(client, kind: str, renew=None) -> int:
+    # One pass over every page: changed records are written, unchanged ones only
+    # marked as seen, and records Didar no longer returns are dropped at the end
+    collection = _collection(kind)
+    fetch = getattr(client, KINDS[kind])
+    started = datetime.utcnow()
+    # Stored dates keep only milliseconds, so records are marked with the pass that saw them
+    pass_id = uuid.uuid4().hex
+    offset = 0
+    changed = 0
+    seen = 0
+
+    while True:
+        # A long pass keeps the lease, or stops once another worker has taken it
+        if renew is not None and not renew():
+            raise LeaseLost(f"Lost the mirror sync lease while paging {kind} records")
+        page = fetch(offset, PAGE_SIZE)
+        if not isinstance(page, list):
+            raise RuntimeError(f"Failed to page {kind} records from CRM")
+
+        items = {item["Id"]: item for item in page if isinstance(item, dict) and item.get("Id")}
+        known = {
+            doc["Id"]: doc.get("_hash")
+            for doc in collection.find({"Id": {"$in": list(items)}}, {"Id": 1, "_hash": 1})
+        }
+
+        operations = []
+        unchanged = []
+        for item_id, item in items.items():
+            digest = _digest(item)
+            if known.get(item_id) == digest:
+                unchanged.append(item_id)
+                continue
+            operations.append(UpdateOne(
+                {"Id": item_id},
+                {"$set": {**item, "_hash": digest, "_synced_at": started, "_seen_at": started, "_seen_by": pass_id}},
+                upsert=True
+            ))
+
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        if unchanged:
+            collection.update_many({"Id": {"$in": unchanged}}, {"$set": {"_seen_at": started, "_seen_by": pass_id}})
+
+        changed += len(operations)
+        seen += len(items)
+        offset += len(page)
+
+        if len(page) < PAGE_SIZE:
+            break
+
+    # A pass that saw nothing is more likely a bad reply than an empty account, keep the mirror
+    if seen:
+        collection.delete_many({"_seen_by": {"$ne": pass_id}})
+    update = {"kind": kind, "synced_at": started, "error": None, "count": collection.estimated_document_count()}
+
+    mirror_db.mirror_state.update_one({"kind": kind}, {"$set": update}, upsert=True)
+    return changed
+
+
+def _acquire_lease() -> bool:
+    now = datetime.utcnow()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        lease = mirror_db.mirror_state.find_one_and_update(
+            {"_id": "sync-lease", "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=LEASE_SECONDS)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return False
+    return lease is not None and lease.get("owner") == owner
+
+
+def sync_all(client):
+    if not _acquire_lease():
+        return
+
+    for kind in KINDS:
+        try:
+            changed = sync_kind(client, kind, renew=_acquire_lease)
+            logger.info("Mirrored %s changed %s record(s)", changed, kind)
+        except LeaseLost:
+            logger.warning("Another worker took over the mirror sync")
+            return
+        except Exception as e:
+            logger.exception("Mirror sync of %s failed", kind)
+            mirror_db.mirror_state.update_one({"kind": kind}, {"$set": {"error": str(e)}}, upsert=True)
+
+
+def _run(client):
+    try:
+        ensure_indexes()
+    except PyMongoError:
+        logger.exception("Could not create mirror indexes")
+
+    while not _stop_event.is_set():
+        try:
+            sync_all(client)
+        except PyMongoError:
+            logger.exception("Mirror sync failed")
+        _stop_event.wait(SYNC_INTERVAL)
+
+
+def start_sync_worker(client):
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    _stop_event.clear()
+    _worker = threading.Thread(target=_run, args=(client,), name="crm-mirror-sync", daemon=True)
+    _worker.start()
+
+
+def stop_sync_worker():
+    _stop_event.set()
+    if _worker is not None:
+        _worker.join(timeout=5)
+
+
+def search(kind: str, query: str, limit: int = 10, max_age: int = MAX_AGE):
+    # The mirror holds the default tenant's Didar account only
+    if current_tenant() != DEFAULT_TENANT:
+        return None
+    try:
+        state = mirror_db.mirror_state.find_one({"kind": kind})
+        if not state or not state.get("synced_at"):
+            return None
+
+        age = (datetime.utcnow() - state["synced_at"]).total_seconds()
+        if max_age is not None and age > max_age:
+            return None
+
+        results = list(
+            _collection(kind)
+            .find({"$text": {"$search": query}}, {**HIDDEN_FIELDS, "score": {"$meta": "textScore"}})
+            .sort([("score", {"$meta": "textScore"})])
+            .limit(limit)
+        )
+    except PyMongoError:
+        logger.exception("Mirror search for %s failed", kind)
+        return None
+
+    if not results:
+        return None
+
+    for result in results:
+        result.pop("score", None)
+
+    return {
+        "data": results,
+        "freshness": {
+            "source": "mirror",
+            "synced_at": state["synced_at"].isoformat(),
+            "age_seconds": int(age)
+        }
+    }
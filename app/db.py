@@ -0,0 +1,51 @@
+from pymongo import MongoClient
+import os
+import threading
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    # MongoClient is not fork-safe, so every worker process opens its own
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/"))
+                _client_pid = pid
+    return _client
+
+
+def get_db():
+    return get_client().crm
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+class LazyDatabase:
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+class LazyCollection:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+
+crm_db = LazyDatabase()
@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import os
+import time
+
+# The whole budget of one turn, every LLM and CRM call inside it gets what is left
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 60))
+REQUEST_DEADLINE_MAX = float(os.environ.get("REQUEST_DEADLINE_MAX_SECONDS", 300))
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# A call with less than this left would only time out, so it is not started
+MIN_CALL_SECONDS = 0.5
+DISCONNECT_POLL = 0.5
+
+CLIENT_CLOSED_REQUEST = 499
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float = REQUEST_DEADLINE):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.cancelled = False
+
+    def cancel(self):
+        # Called when the client went away, the next call sees no budget left
+        self.cancelled = True
+
+    def remaining(self) -> float:
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() < MIN_CALL_SECONDS
+
+    def timeout(self, limit: float = None) -> float:
+        remaining = self.remaining()
+        if remaining < MIN_CALL_SECONDS:
+            raise DeadlineExceeded("Request was cancelled" if self.cancelled else "Request deadline exceeded")
+        return remaining if limit is None else min(limit, remaining)
+
+
+def request_deadline(timeout=None) -> Deadline:
+    # From the X-Request-Timeout header or a WebSocket message, capped at REQUEST_DEADLINE_MAX
+    if not timeout:
+        return Deadline(REQUEST_DEADLINE)
+    try:
+        seconds = float(timeout)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} must be a number of seconds")
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} must be positive")
+    return Deadline(min(seconds, REQUEST_DEADLINE_MAX))
+
+
+# Tools only get their arguments from the agent, so the deadline of the
+# running node reaches the CRM client and the formatter through this
+_current = ContextVar("deadline", default=None)
+
+
+def current_deadline():
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline = None):
+    token = _current.set(deadline)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def call_timeout(limit: float = None, deadline: Deadline = None) -> float:
+    deadline = deadline or current_deadline()
+    if deadline is None:
+        return limit
+    return deadline.timeout(limit)
+
+
+async def run_until_disconnected(request, deadline: Deadline, func, /, *args, **kwargs):
+    # Runs func on the threadpool and cancels its deadline if the client disconnects
+    work = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+    while not work.done():
+        await asyncio.wait({work}, timeout=DISCONNECT_POLL)
+        if not work.done() and await request.is_disconnected():
+            deadline.cancel()
+            break
+
+    try:
+        return await work
+    except DeadlineExceeded:
+        if not deadline.cancelled:
+            raise
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed request")
@@ -0,0 +1,23 @@
+from app.auth import secret_key_source
+import os
+
+
+def worker_count() -> int:
+    return int(os.environ.get("WEB_CONCURRENCY", 1))
+
+
+def check_worker_settings():
+    problems = []
+
+    if worker_count() > 1 and secret_key_source() == "random":
+        problems.append(
+            "AUTH_SECRET_KEY, AUTH_SECRET_KEY_FILE or AUTH_SHARED_SECRET=true is required when running "
+            "more than one worker, otherwise each worker signs tokens with its own random key"
+        )
+
+    key_file = os.environ.get("AUTH_SECRET_KEY_FILE")
+    if key_file and not os.path.isfile(key_file):
+        problems.append(f"AUTH_SECRET_KEY_FILE points to a missing file: {key_file}")
+
+    if problems:
+        raise RuntimeError("Refusing to start with unsafe settings:\n- " + "\n- ".join(problems))
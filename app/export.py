@@ -0,0 +1,115 @@
+from datetime import datetime, time as day_time
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from app.agent import sessions_db
+from app.archive import archived_sessions_db, decompress_history
+import base64
+import binascii
+import json
+import orjson
+import os
+
+# Documents per round trip to Mongo, and so the most the export holds in memory
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 200))
+
+# Live sessions are exported first, then the archive, each in _id order
+SOURCES = [("sessions", sessions_db, False), ("sessions_archive", archived_sessions_db, True)]
+
+
+def ensure_indexes():
+    sessions_db.create_index([("user_id", 1), ("_id", 1)])
+    archived_sessions_db.create_index([("user_id", 1), ("_id", 1)])
+
+
+def encode_cursor(source: str, last_id: ObjectId) -> str:
+    raw = json.dumps({"source": source, "after": str(last_id)}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        cursor = json.loads(raw)
+        if cursor["source"] not in [name for name, _, _ in SOURCES]:
+            raise ValueError(cursor["source"])
+        return cursor["source"], ObjectId(cursor["after"])
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid export cursor")
+
+
+def _query(user_id: str = None, start=None, end=None) -> dict:
+    query = {}
+    if user_id:
+        query["user_id"] = user_id
+    if start or end:
+        query["updated_at"] = {}
+        if start:
+            query["updated_at"]["$gte"] = datetime.combine(start, day_time.min)
+        if end:
+            query["updated_at"]["$lte"] = datetime.combine(end, day_time.max)
+    return query
+
+
+def _lines(session: dict, chat_history: list, unit: str, archived: bool) -> list:
+    meta = {
+        "session_id": session.get("session_id"),
+        "user_id": session.get("user_id"),
+        "created_at": session.get("created_at"),
+        "updated_at": session.get("updated_at"),
+        "archived": archived
+    }
+    if unit == "session":
+        return [{"type": "session", **meta, "version": session.get("version"), "chat_history": chat_history}]
+    return [
+        {"type": "turn", **meta, "turn": index, "question": turn[0], "answer": turn[1]}
+        for index, turn in enumerate(chat_history)
+    ]
+
+
+def _dumps(line: dict) -> bytes:
+    return orjson.dumps(line, default=str) + b"\n"
+
+
+def export_sessions(user_id: str = None, start=None, end=None, unit: str = "session", archived: bool = True, cursor: str = None):
+    # Not a generator itself, so a bad cursor is a 400 before the stream starts
+    sources = SOURCES if archived else SOURCES[:1]
+    resume_source, resume_after = decode_cursor(cursor) if cursor else (None, None)
+    if resume_source is not None:
+        names = [name for name, _, _ in sources]
+        if resume_source not in names:
+            raise HTTPException(status_code=400, detail="Invalid export cursor")
+        sources = sources[names.index(resume_source):]
+    return _export(_query(user_id, start, end), sources, unit, resume_source, resume_after)
+
+
+def _export(query: dict, sources: list, unit: str, resume_source: str, resume_after: ObjectId):
+    # Yields NDJSON one batch at a time. After every batch comes a
+    # {"type": "cursor"} line, passing its token back resumes right after it
+    sessions = turns = 0
+    for name, collection, is_archive in sources:
+        source_query = dict(query)
+        if name == resume_source:
+            source_query["_id"] = {"$gt": resume_after}
+
+        found = collection.find(source_query).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+        try:
+            chunk, in_chunk, last_id = [], 0, None
+            for session in found:
+                chat_history = decompress_history(session["history_zstd"]) if is_archive else session.get("chat_history", [])
+                chunk += [_dumps(line) for line in _lines(session, chat_history, unit, is_archive)]
+                sessions += 1
+                turns += len(chat_history)
+                in_chunk += 1
+                last_id = session["_id"]
+                if in_chunk >= EXPORT_BATCH_SIZE:
+                    chunk.append(_dumps({"type": "cursor", "cursor": encode_cursor(name, last_id)}))
+                    yield b"".join(chunk)
+                    chunk, in_chunk = [], 0
+            if in_chunk:
+                chunk.append(_dumps({"type": "cursor", "cursor": encode_cursor(name, last_id)}))
+                yield b"".join(chunk)
+        finally:
+            found.close()
+
+    yield _dumps({"type": "done", "sessions": sessions, "turns": turns})
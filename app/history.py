@@ -0,0 +1,43 @@
+from langchain.schema import HumanMessage, AIMessage
+from app.classifier import AgentState, summarize_history
+from app.model_policy import chat_model
+import os
+
+# Turns the agents see verbatim, older ones only reach them as a summary
+HISTORY_TURNS = int(os.environ.get("AGENT_HISTORY_TURNS", 6))
+
+NO_SUMMARY = "No earlier conversation."
+
+
+def split_history(chat_history: list):
+    if not HISTORY_TURNS:
+        return chat_history, []
+    return chat_history[:-HISTORY_TURNS], chat_history[-HISTORY_TURNS:]
+
+
+def summarize_older_turns(chat_history: list, deadline=None) -> str:
+    older_turns, _ = split_history(chat_history)
+    if not older_turns:
+        return NO_SUMMARY
+    return summarize_history(older_turns, chat_model("history", "summarize", deadline=deadline)) or NO_SUMMARY
+
+
+def history_summary(state: AgentState) -> str:
+    # Set by the history node, computed here when an agent runs outside the graph
+    if "history_summary" in state:
+        return state["history_summary"]
+    return summarize_older_turns(state.get("chat_history", []), state.get("deadline"))
+
+
+def recent_messages(chat_history: list) -> list:
+    _, recent_turns = split_history(chat_history)
+    messages = []
+    for user, assistant in recent_turns:
+        messages.append(HumanMessage(content=user))
+        messages.append(AIMessage(content=assistant))
+    return messages
+
+
+def history_node(state: AgentState) -> AgentState:
+    # Runs next to the classifier, so it only returns the key it owns
+    return {"history_summary": summarize_older_turns(state.get("chat_history", []), state.get("deadline"))}
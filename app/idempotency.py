@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+from app.db import LazyCollection
+from app.deadline import REQUEST_DEADLINE_MAX
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+# How long a finished result is replayed for the same key
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 86400))
+# A claim older than this is taken to belong to a worker that died mid-turn
+IDEMPOTENCY_LEASE = int(os.environ.get("IDEMPOTENCY_LEASE", REQUEST_DEADLINE_MAX + 30))
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 1.0
+
+idempotency_db = LazyCollection("idempotency_keys")
+
+# Entry ID -> event set when this worker's run of it ends, so waiters here need not poll
+_finished = {}
+
+
+def ensure_indexes():
+    idempotency_db.create_index("expires_at", expireAfterSeconds=0)
+
+
+def fingerprint(*parts) -> str:
+    return hashlib.sha256("\x1f".join(str(part or "") for part in parts).encode()).hexdigest()
+
+
+def _entry_id(user_id: str, key: str) -> str:
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters")
+    # Keys are scoped to the user, another user's key never replays their answer
+    return f"{user_id}:{key}"
+
+
+def _claim(entry_id: str, digest: str):
+    # (token, None) when this request runs the work, (None, entry) when another has or does
+    now = datetime.utcnow()
+    token = str(uuid.uuid4())
+    try:
+        idempotency_db.update_one(
+            {"_id": entry_id, "expires_at": {"$lt": now}},
+            {
+                "$set": {"status": "running", "token": token, "fingerprint": digest, "created_at": now, "expires_at": now + timedelta(seconds=IDEMPOTENCY_LEASE)},
+                "$unset": {"result": ""}
+            },
+            upsert=True
+        )
+        return token, None
+    except DuplicateKeyError:
+        entry = idempotency_db.find_one({"_id": entry_id})
+        if entry is None:
+            # Released in between, try again
+            return _claim(entry_id, digest)
+        if entry.get("fingerprint") != digest:
+            raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} was already used for a different request")
+        return None, entry
+
+
+def _complete(entry_id: str, token: str, result: dict):
+    now = datetime.utcnow()
+    idempotency_db.update_one(
+        {"_id": entry_id, "token": token},
+        {"$set": {"status": "done", "result": result, "finished_at": now, "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL)}}
+    )
+
+
+def _release(entry_id: str, token: str):
+    # Failed runs are not stored, a retry runs the work again
+    idempotency_db.delete_one({"_id": entry_id, "token": token})
+
+
+async def _wait(entry_id: str, until: float):
+    delay = POLL_INTERVAL
+    while time.monotonic() < until:
+        event = _finished.get(entry_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(delay, until - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(min(delay, max(0.0, until - time.monotonic())))
+        entry = await run_in_threadpool(idempotency_db.find_one, {"_id": entry_id}, {"status": 1})
+        if entry is None or entry.get("status") == "done":
+            return
+        delay = min(delay * 2, MAX_POLL_INTERVAL)
+    raise HTTPException(status_code=409, detail=f"A request with this {IDEMPOTENCY_HEADER} is still in progress, retry later")
+
+
+async def run_once(user_id: str, key: str, digest: str, func, wait_seconds: float):
+    # (result, replayed). The first request with a key runs func, requests with the
+    # same key share its result, waiting up to wait_seconds while it is still running
+    entry_id = _entry_id(user_id, key)
+    until = time.monotonic() + wait_seconds
+
+    while True:
+        token, entry = await run_in_threadpool(_claim, entry_id, digest)
+        if token is None:
+            if entry["status"] == "done":
+                return entry["result"], True
+            await _wait(entry_id, until)
+            continue
+
+        event = _finished.setdefault(entry_id, asyncio.Event())
+        try:
+            result = await func()
+        except BaseException:
+            await run_in_threadpool(_release, entry_id, token)
+            raise
+        else:
+            await run_in_threadpool(_complete, entry_id, token, result)
+            return result, False
+        finally:
+            _finished.pop(entry_id, None)
+            event.set()
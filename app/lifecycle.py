@@ -0,0 +1,103 @@
+from contextlib import asynccontextmanager
+from app.agent import get_graph
+from app.auth import get_secret_key
+from app.deployment import check_worker_settings
+from app.db import get_client, close_client
+from app import archive, crm_mirror, export, idempotency, profiling, sessions, tenants, tracing, usage
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+WARMUP_RETRY_INTERVAL = int(os.environ.get("WARMUP_RETRY_INTERVAL", 5))
+
+_ready = threading.Event()
+_stop_event = threading.Event()
+_status = {}
+
+
+def _connect_mongo():
+    get_client().admin.command("ping")
+    get_secret_key()
+
+
+def _create_indexes():
+    sessions.ensure_indexes()
+    usage.ensure_indexes()
+    profiling.ensure_indexes()
+    export.ensure_indexes()
+    tracing.ensure_indexes()
+    idempotency.ensure_indexes()
+    tenants.ensure_indexes()
+
+
+def _build_graph():
+    get_graph()
+
+
+def _start_mirror():
+    if crm_mirror.MIRROR_ENABLED:
+        from app.agents.crm_agent import crm_client
+        crm_mirror.start_sync_worker(crm_client)
+
+
+def _start_archiver():
+    if archive.ARCHIVE_ENABLED:
+        archive.start_archive_worker()
+
+
+WARMUP_STEPS = [
+    ("graph", _build_graph),
+    ("mongo", _connect_mongo),
+    ("indexes", _create_indexes),
+    ("mirror", _start_mirror),
+    ("archive", _start_archiver),
+]
+
+
+def warm_up():
+    for name, _ in WARMUP_STEPS:
+        _status[name] = "pending"
+
+    for name, step in WARMUP_STEPS:
+        while not _stop_event.is_set():
+            try:
+                step()
+                _status[name] = "ok"
+                break
+            except Exception as e:
+                logger.exception("Warm-up step '%s' failed", name)
+                _status[name] = f"failed: {e}"
+                _stop_event.wait(WARMUP_RETRY_INTERVAL)
+
+    if not _stop_event.is_set():
+        _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def readiness() -> dict:
+    return {"ready": is_ready(), "checks": dict(_status)}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    check_worker_settings()
+
+    # Connections and heavy imports are warmed up after the worker has been forked and
+    # without blocking startup, so liveness probes are answered right away
+    _stop_event.clear()
+    _ready.clear()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+    yield
+
+    _stop_event.set()
+    crm_mirror.stop_sync_worker()
+    archive.stop_archive_worker()
+    tracing.trace_writer.stop()
+    tenants.crm_pool.close()
+    close_client()
@@ -1,22 +1,49 @@
 from fastapi.openapi.utils import get_openapi
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, WebSocket
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, Dict, List, Literal, Tuple
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, AIMessage, HumanMessage
-from app.agent import graph, sessions_db
+from app.agent import sessions_db
 from app.auth import create_access_token, verify_token, users_db
+from app.lifecycle import lifespan, readiness
+from app.turns import run_turn
+from app.deadline import DEADLINE_HEADER, request_deadline, run_until_disconnected
+from app.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, fingerprint, run_once
+from app.profiling import PROFILE_ID_HEADER, request_profile, list_profiles, get_profile, folded
+from app.chat_socket import serve_chat
+from app.batch import run_batch, BATCH_MAX_ITEMS
+from app.archive import archived_sessions_db, list_archived_sessions, rehydrate_session
+from app.usage import record_usage, query_usage
+from app.export import export_sessions
+from app.tenants import crm_pool, user_tenant
+from app.tracing import SPAN_KINDS, trace_writer, slowest_spans, get_trace
+from app.admission import check_rate_limit, metrics as admission_metrics
+from app.static_files import load_pages, load_web_app
+from app.responses import ORJSONResponse, projection
+from datetime import date, datetime
+import json
+import os
 import uuid
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+pages = load_pages()
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/signin")
 
+# Responses smaller than this are sent as-is, compressing them costs more than it saves
+GZIP_MINIMUM_SIZE = int(os.environ.get("GZIP_MINIMUM_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 5))
+
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_LEVEL)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -34,16 +61,19 @@ def admin_required(token: str = Depends(oauth2_scheme)):
     user = verify_token(token)
     if user.get("permission") != "admin":
         raise HTTPException(status_code=403, detail="Admin permission required")
-    return True
+    return user
 
 load_dotenv()
 
-sessions_db.create_index("session_id", unique=True)
-
 @app.get("/health")
 def health_check():
     return JSONResponse(content={"status": True})
 
+@app.get("/ready")
+def readiness_check():
+    status = readiness()
+    return JSONResponse(content={"status": status["ready"], "checks": status["checks"]}, status_code=200 if status["ready"] else 503)
+
 @app.post("/signup")
 def signup(form_data: OAuth2PasswordRequestForm = Depends()):
     if users_db.find_one({"username": form_data.username}):
@@ -66,7 +96,23 @@ def signin(form_data: OAuth2PasswordRequestForm = Depends()):
     access_token = create_access_token(data={"sub": user["username"]})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.get("/users", response_model=List[dict])
+class UserResponse(BaseModel):
+    username: str
+    permission: str
+
+class SessionResponse(BaseModel):
+    session_id: str
+    user_id: str
+    chat_history: List[Tuple[str, str]] = []
+    version: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    archived: bool = False
+
+class SessionDetailResponse(SessionResponse):
+    title: str
+
+@app.get("/users", response_model=List[UserResponse], response_class=ORJSONResponse)
 def list_users(token: str = Depends(oauth2_scheme)):
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -78,10 +124,10 @@ def list_users(token: str = Depends(oauth2_scheme)):
     if user.get("permission") != "admin":
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    users = list(users_db.find({}, {"_id": 0, "password": 0}))
-    return users
+    users = list(users_db.find({}, projection(UserResponse)))
+    return ORJSONResponse(users)
 
-@app.get("/users/{username}")
+@app.get("/users/{username}", response_model=UserResponse, response_class=ORJSONResponse)
 def get_user(username: str, token: str = Depends(oauth2_scheme)):
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -94,12 +140,12 @@ def get_user(username: str, token: str = Depends(oauth2_scheme)):
     if user.get("permission") != "admin" or user["username"] != username:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    user_data = users_db.find_one({"username": username}, {"_id": 0, "password": 0})
+    user_data = users_db.find_one({"username": username}, projection(UserResponse))
 
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return user_data
+    return ORJSONResponse(user_data)
 
 @app.delete("/users/{username}")
 def delete_user(username: str, token: str = Depends(oauth2_scheme)):
@@ -118,10 +164,11 @@ def delete_user(username: str, token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=404, detail="User not found")
     
     resultsession = sessions_db.delete_many({"user_id": str(user["_id"])})
+    resultarchive = archived_sessions_db.delete_many({"user_id": str(user["_id"])})
     
-    return {"message": f"User '{username}' and {resultsession.deleted_count} session(s) deleted successfully"}
+    return {"message": f"User '{username}' and {resultsession.deleted_count + resultarchive.deleted_count} session(s) deleted successfully"}
 
-@app.get("/sessions", response_model=List[dict])
+@app.get("/sessions", response_model=List[SessionResponse], response_class=ORJSONResponse)
 def list_sessions(token: str = Depends(oauth2_scheme)):
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -131,10 +178,14 @@ def list_sessions(token: str = Depends(oauth2_scheme)):
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=e.detail)
     
-    sessions = list(sessions_db.find({"user_id": str(user["_id"])}, {"_id": 0}))
-    return sessions
+    sessions = [
+        {**session, "archived": False}
+        for session in sessions_db.find({"user_id": str(user["_id"])}, projection(SessionResponse))
+    ]
+    sessions += list_archived_sessions(str(user["_id"]))
+    return ORJSONResponse(sessions)
 
-@app.get("/sessions/{session_id}", response_model=dict)
+@app.get("/sessions/{session_id}", response_model=SessionDetailResponse, response_class=ORJSONResponse)
 def get_session(session_id: str, token: str = Depends(oauth2_scheme)):
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -144,11 +195,21 @@ def get_session(session_id: str, token: str = Depends(oauth2_scheme)):
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=e.detail)
     
-    session = sessions_db.find_one({"session_id": session_id, "user_id": str(user["_id"])}, {"_id": 0})
+    session = (
+        sessions_db.find_one({"session_id": session_id, "user_id": str(user["_id"])}, projection(SessionResponse))
+        or rehydrate_session(session_id, str(user["_id"]))
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    title_generator = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.3)
+    from langchain.schema import SystemMessage, AIMessage, HumanMessage
+    from app.model_policy import chat_model
+    from app.callbacks import UsageCallbackHandler
+
+    user_id, username = str(user["_id"]), user["username"]
+    usage_handler = UsageCallbackHandler(node="title")
+
+    title_generator = chat_model("title", "title")
 
     chat_history = session["chat_history"]
 
@@ -160,9 +221,12 @@ def get_session(session_id: str, token: str = Depends(oauth2_scheme)):
         prompts.append(HumanMessage(content=user))
         prompts.append(AIMessage(content=assistant))
     
-    title = title_generator.invoke(prompts)
+    try:
+        title = title_generator.invoke(prompts, config={"callbacks": [usage_handler]})
+    finally:
+        record_usage(usage_handler.totals, user_id, username, session_id)
     
-    return {**session, "title":title.content}
+    return ORJSONResponse({**session, "archived": False, "title": title.content})
 
 @app.delete("/sessions/{session_id}")
 def delete_session(session_id: str, token: str = Depends(oauth2_scheme)):
@@ -178,8 +242,12 @@ def delete_session(session_id: str, token: str = Depends(oauth2_scheme)):
         "session_id": session_id,
         "user_id": str(user["_id"])
     })
+    archived = archived_sessions_db.delete_one({
+        "session_id": session_id,
+        "user_id": str(user["_id"])
+    })
 
-    if result.deleted_count == 0:
+    if result.deleted_count == 0 and archived.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Session not found")
     
     return {"message": f"Session '{session_id}' deleted successfully"}
@@ -191,254 +259,169 @@ class QueryRequest(BaseModel):
 class QueryResponse(BaseModel):
     agent: str
     response: str
+    session_id: Optional[str] = None
+    version: Optional[int] = None
+    models: Dict[str, List[str]] = {}
 
 @app.post("/ask", response_model=QueryResponse)
-def ask(query: QueryRequest, token: str = Depends(oauth2_scheme)):
+async def ask(query: QueryRequest, request: Request, response: Response, token: str = Depends(oauth2_scheme)):
     session_id = query.session_id or str(uuid.uuid4())
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
-        user = verify_token(token)
+        user = await run_in_threadpool(verify_token, token)
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=e.detail)
     
     if not query.query:
         raise HTTPException(status_code=400, detail="Query cannot be empty")
-    
-    session = sessions_db.find_one({"session_id": session_id})
-    if session and session.get("user_id") != str(user["_id"]):
-        raise HTTPException(status_code=403, detail="Permission denied for this session")
-    
-    chat_history = session.get("chat_history", []) if session else []
-
-    state = {
-        "question": query.query,
-        "chat_history": chat_history,
-        "session_id": session_id,
-        "user_id": str(user["_id"])
-    }
 
-    result = graph.invoke(state)
-
-    sessions_db.update_one(
-        {"session_id": session_id},
-        {"$set": {
-            "chat_history": result["chat_history"],
-            "user_id": str(user["_id"])
-        }},
-        upsert=True
-    )
+    # Async only to notice a disconnect, the turn itself runs on the threadpool
+    deadline = request_deadline(request.headers.get(DEADLINE_HEADER))
+    turn, callbacks = run_turn, None
+
+    profile = request_profile(request.headers, user, "/ask", query.query)
+    if profile is not None:
+        turn, callbacks = profile.wrap(run_turn), [profile.spans]
+
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not idempotency_key:
+        result = await run_until_disconnected(request, deadline, turn, user, query.query, session_id, callbacks=callbacks, deadline=deadline)
+        _profile_header(response, profile)
+        return QueryResponse(**result)
+
+    # A keyed turn is not cancelled when its client disconnects, the retry picks up its result
+    async def run():
+        return await run_in_threadpool(turn, user, query.query, session_id, callbacks=callbacks, deadline=deadline)
+
+    digest = fingerprint(query.query, query.session_id)
+    result, replayed = await run_once(str(user["_id"]), idempotency_key, digest, run, deadline.remaining())
+    if replayed:
+        response.headers[REPLAYED_HEADER] = "true"
+    # A replay runs nothing, so only a turn this request ran has a profile to point to
+    _profile_header(response, profile)
+    return QueryResponse(**result)
+
+def _profile_header(response: Response, profile):
+    if profile is not None and profile.saved:
+        response.headers[PROFILE_ID_HEADER] = profile.profile_id
+
+class BatchItem(BaseModel):
+    query: str
+    session_id: Optional[str] = None
 
-    return QueryResponse(
-        agent = result["agent"],
-        response = result.get("answer", "No answer provided")
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: int = 4
+
+@app.post("/admin/ask/batch")
+def ask_batch(batch: BatchRequest, admin: dict = Depends(admin_required)):
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="Batch cannot be empty")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch cannot hold more than {BATCH_MAX_ITEMS} items")
+    if any(not item.query for item in batch.items):
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    # A batch counts as one request against the rate limit, its items each take a graph slot
+    check_rate_limit(str(admin["_id"]))
+    # An unknown tenant is refused before the stream starts
+    crm_pool.get(user_tenant(admin))
+
+    lines = (
+        json.dumps(result, ensure_ascii=False) + "\n"
+        for result in run_batch(admin, [item.dict() for item in batch.items], batch.concurrency)
     )
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, token: Optional[str] = None, session_id: Optional[str] = None):
+    await serve_chat(websocket, token, session_id)
+
+@app.get("/admin/usage", response_model=List[dict])
+def get_usage(
+    start: date,
+    end: Optional[date] = None,
+    username: Optional[str] = None,
+    group_by: Literal["user", "session", "node"] = "user",
+    admin: bool = Depends(admin_required)
+):
+    end = end or date.today()
+    if end < start:
+        raise HTTPException(status_code=400, detail="End date must not be before start date")
+    return query_usage(start.isoformat(), end.isoformat(), username, group_by)
+
+@app.get("/admin/export/sessions")
+def export_sessions_ndjson(
+    username: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    unit: Literal["session", "turn"] = "session",
+    archived: bool = True,
+    cursor: Optional[str] = None,
+    admin: bool = Depends(admin_required)
+):
+    user_id = None
+    if username:
+        user = users_db.find_one({"username": username}, {"_id": 1})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_id = str(user["_id"])
+    if start and end and end < start:
+        raise HTTPException(status_code=400, detail="End date must not be before start date")
+
+    # A sync generator, so Starlette pulls each batch on the threadpool and the event loop stays free
+    return StreamingResponse(export_sessions(user_id, start, end, unit, archived, cursor), media_type="application/x-ndjson")
+
+@app.get("/admin/metrics")
+def get_metrics(admin: bool = Depends(admin_required)):
+    from app.model_policy import metrics as model_metrics
+    return {"admission": admission_metrics(), "models": model_metrics(), "traces": trace_writer.stats(), "tenants": crm_pool.stats()}
+
+@app.get("/admin/profiles", response_class=ORJSONResponse)
+def get_profiles(limit: int = 20, admin: bool = Depends(admin_required)):
+    return ORJSONResponse(list_profiles(min(max(limit, 1), 100)))
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile_detail(profile_id: str, format: Literal["json", "folded"] = "json", admin: bool = Depends(admin_required)):
+    profile = get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(folded(profile))
+    return ORJSONResponse(profile)
+
+@app.get("/admin/traces/slowest", response_class=ORJSONResponse)
+def get_slowest_spans(
+    kind: Literal[SPAN_KINDS] = "node",
+    name: Optional[str] = None,
+    since_hours: float = 24,
+    limit: int = 20,
+    admin: bool = Depends(admin_required)
+):
+    return ORJSONResponse(slowest_spans(kind, name, since_hours, min(max(limit, 1), 100)))
+
+@app.get("/admin/traces/{trace_id}", response_class=ORJSONResponse)
+def get_trace_detail(trace_id: str, admin: bool = Depends(admin_required)):
+    trace = get_trace(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return ORJSONResponse(trace)
 
 @app.get("/", response_class=HTMLResponse)
-async def main_page():
-    return """
-    <html>
-        <head>
-            <title>🛒 CRM Chatbot API for Online Shop</title>
-            <meta charset="UTF-8" />
-        </head>
-        <body style="font-family: Arial, sans-serif; background-color: #f4f4f4; color: #333; padding: 20px;">
-            <h1>🛒 CRM Chatbot API for Online Shop</h1>
-            <p>This project implements an AI-powered chatbot API for customer relationship management (CRM) in an online shop, seamlessly integrated with Didar CRM. It leverages advanced language model orchestration with LangChain and LangGraph, includes robust LangSmith tracing for monitoring agent behavior, and uses FastAPI for a high-performance web API layer. The project is fully containerized with Docker and supports on-demand testing via GitHub Actions.</p>
-            <h1>API Documentation</h1>
-            <p>To access the Chatbot, <a href="/chatbot">Click here</a>.</p>
-            <p>To access the API, <a href="/login">Login Here</a>.</p>
-            <p>To explore the API documentation, Visit <a href="/docs">Documentation</a></p>
-            <h1>GitHub Repository</h1>
-            <p>For source code and contributions, visit the <a href="https://github.com/BMDarkLight/CRM-ChatBot-API">GitHub repository</a>.</p>
-        </body>
-    </html>
-    """
+async def main_page(request: Request):
+    return pages.response("index.html", request)
 
 @app.get("/login", response_class=HTMLResponse)
-def login():
-    return """
-    <html>
-        <head>
-            <title>API Login</title>
-            <meta charset="UTF-8" />
-        </head>
-        <body style="font-family: Arial, sans-serif; background-color: #f4f4f4; color: #333; padding: 20px;">
-            <h1>Login</h1>
-            <div style="display: flex; justify-content: space-between; border: 1px solid #ccc; padding: 20px; margin: 20px; border-radius: 10px;background-color: #f9f9f9; text-align: center;">
-                <form id="login-form" style="display: inline-block;">
-                    <label for="login-username">Username:</label>
-                    <input type="text" id="login-username" name="username" required></p>
-                    <p><label for="login-password">Password:</label>
-                    <input type="password" id="login-password" name="password" required></p>
-                    <button type="submit">Sign In</button>
-                </form>
-            </div>
-
-            <h1>Sign Up</h1>
-            <div style="display: flex; justify-content: space-between; border: 1px solid #ccc; padding: 20px; margin: 20px; border-radius: 10px;background-color: #f9f9f9; text-align: center;">
-                <form id="signup-form" style="display: inline-block;">
-                    <p><label for="signup-username">Username:</label>
-                    <input type="text" id="signup-username" name="username" required></p>
-                    <p><label for="signup-password">Password:</label>
-                    <input type="password" id="signup-password" name="password" required></p>
-                    <button type="submit">Sign Up</button>
-                </form>
-            </div>
-
-            <pre id="output"></pre>
-
-            <script>
-            document.getElementById("login-form").addEventListener("submit", async function(e) {
-                e.preventDefault();
-                const username = document.getElementById("login-username").value;
-                const password = document.getElementById("login-password").value;
-                const formData = new URLSearchParams();
-                formData.append("username", username);
-                formData.append("password", password);
-
-                const response = await fetch("/signin", {
-                    method: "POST",
-                    headers: {
-                        "Content-Type": "application/x-www-form-urlencoded"
-                    },
-                    body: formData
-                });
-
-                const result = await response.json();
-                document.getElementById("output").textContent = JSON.stringify(result, null, 2);
-            });
-
-            document.getElementById("signup-form").addEventListener("submit", async function(e) {
-                e.preventDefault();
-                const username = document.getElementById("signup-username").value;
-                const password = document.getElementById("signup-password").value;
-                const formData = new URLSearchParams();
-                formData.append("username", username);
-                formData.append("password", password);
-
-                const response = await fetch("/signup", {
-                    method: "POST",
-                    headers: {
-                        "Content-Type": "application/x-www-form-urlencoded"
-                    },
-                    body: formData
-                });
-
-                const result = await response.json();
-                document.getElementById("output").textContent = JSON.stringify(result, null, 2);
-            });
-            </script>
-        </body>
-    </html>
-    """
+async def login(request: Request):
+    return pages.response("login.html", request)
 
 @app.get("/chatbot", response_class=HTMLResponse)
-def chatbot():
-    return """
-    <html>
-        <head>
-            <title>Chatbot Interface</title>
-            <meta charset="UTF-8" />
-        </head>
-        <body style="font-family: Arial, sans-serif; background-color: #f4f4f4; color: #333; padding: 20px;">
-            <h1>CRM Chatbot Interface</h1>
-
-            <div id="auth-section">
-                <h2>Login</h2>
-                <div id="login-container" style="display: flex; justify-content: space-between; border: 1px solid #ccc; padding: 20px; margin: 20px; border-radius: 10px;background-color: #f9f9f9; text-align: center;">
-                    <form id="login-form">
-                        <label>Username: <input type="text" id="login-username" required></label><br>
-                        <label>Password: <input type="password" id="login-password" required></label><br>
-                        <button type="submit">Login</button>
-                    </form>
-                </div>
-                <pre id="auth-output"></pre>
-            </div>
-
-            <div id="chat-container" style="display: none; border: 1px solid #ccc;">
-                <div id="chat-history" style="max-height: 400px; overflow-y: auto; margin-bottom: 20px;"></div>
-                <div style="display: flex; gap: 10px; align-items: center;">
-                    <input type="text" id="user-input" placeholder="Type your message here..." style="flex: 1; padding: 10px; box-sizing: border-box;">
-                    <button id="send-button">Send</button>
-                </div>
-            </div>
-
-            <script>
-            const sessionId = Math.random().toString(36).substring(2, 18);
-
-            document.getElementById("login-form").addEventListener("submit", async function(e) {
-                e.preventDefault();
-                const username = document.getElementById("login-username").value;
-                const password = document.getElementById("login-password").value;
-                const formData = new URLSearchParams();
-                formData.append("username", username);
-                formData.append("password", password);
-
-                const response = await fetch("/signin", {
-                    method: "POST",
-                    headers: {
-                        "Content-Type": "application/x-www-form-urlencoded"
-                    },
-                    body: formData
-                });
-
-                const result = await response.json();
-                if (response.ok) {
-                    localStorage.setItem("access_token", result.access_token);
-                    document.getElementById("auth-section").style.display = "none";
-                    document.getElementById("chat-container").style.display = "block";
-                }
-                document.getElementById("auth-output").textContent = JSON.stringify(result, null, 2);
-            });
-
-            document.getElementById("send-button").addEventListener("click", async function() {
-                document.getElementById("send-button").disabled = true;
-                document.getElementById("send-button").textContent = "Sending...";
-                document.getElementById("user-input").disabled = true;
-                const token = localStorage.getItem("access_token");
-                const userInput = document.getElementById("user-input").value;
-
-                if (!token || !userInput) {
-                    alert("Missing token or input.");
-                    return;
-                }
-
-                const response = await fetch("/ask", {
-                    method: "POST",
-                    headers: {
-                        "Content-Type": "application/json",
-                        "Authorization": "Bearer " + token
-                    },
-                    body: JSON.stringify({ query: userInput, session_id: sessionId })
-                });
-
-                const result = await response.json();
-                if (!response.ok) {
-                    alert("Error: " + result.detail);
-                    return;
-                }
-
-                const chatHistory = document.getElementById("chat-history");
-                chatHistory.innerHTML += `<div><b>You:</b> ${userInput}</div>`;
-                chatHistory.innerHTML += `<div><b>Bot (${result.agent}):</b> ${result.response}</div>`;
-                document.getElementById("user-input").value = "";
-                chatHistory.scrollTop = chatHistory.scrollHeight;
-                document.getElementById("send-button").disabled = false;
-                document.getElementById("send-button").textContent = "Send";
-                document.getElementById("user-input").disabled = false;
-            });
-            // Add Enter-to-send for user-input
-            document.getElementById("user-input").addEventListener("keypress", function(e) {
-                if (e.key === "Enter") {
-                    e.preventDefault();
-                    document.getElementById("send-button").click();
-                }
-            });
-            </script>
-        </body>
-    </html>
-    """
+async def chatbot(request: Request):
+    return pages.response("chatbot.html", request)
+
+web_app = load_web_app()
+if web_app is not None:
+    app.mount("/app", web_app, name="web")
 
 def custom_openapi():
     if app.openapi_schema:
@@ -0,0 +1,187 @@
+from collections import deque
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_openai import ChatOpenAI
+from typing import Any
+from app.deadline import DeadlineExceeded, call_timeout, current_deadline
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Keyed "node.purpose", "*.purpose" applies to every node without its own entry.
+# p95_ms is the rolling p95 of the primary model above which calls go to the fallback
+DEFAULT_MODEL_POLICY = {
+    "classify.classify": {"model": "gpt-3.5-turbo", "fallback": "gpt-4o-mini", "timeout": 10, "p95_ms": 2000, "temperature": 0},
+    "*.summarize": {"model": "gpt-3.5-turbo", "fallback": "gpt-4o-mini", "timeout": 20, "p95_ms": 5000, "temperature": 0},
+    "unknown.answer": {"model": "gpt-3.5-turbo", "fallback": "gpt-4o-mini", "timeout": 60, "p95_ms": 10000, "temperature": 0.2},
+    "crm-agent.answer": {"model": "gpt-4o-mini", "fallback": "gpt-3.5-turbo", "timeout": 60, "p95_ms": 15000, "temperature": 0},
+    "crm-agent.format": {"model": "gpt-4o-mini", "fallback": "gpt-3.5-turbo", "timeout": 30, "p95_ms": 10000, "temperature": 0},
+    "title.title": {"model": "gpt-3.5-turbo", "fallback": "gpt-4o-mini", "timeout": 10, "p95_ms": 3000, "temperature": 0.3},
+}
+
+DEFAULT_ENTRY = {"model": "gpt-4o-mini", "fallback": None, "timeout": 60, "p95_ms": None, "temperature": 0}
+
+
+def _load_policy() -> dict:
+    policy = {key: dict(entry) for key, entry in DEFAULT_MODEL_POLICY.items()}
+    for key, entry in json.loads(os.environ.get("MODEL_POLICY", "{}")).items():
+        policy[key] = {**policy.get(key, DEFAULT_ENTRY), **entry}
+    return policy
+
+
+MODEL_POLICY = _load_policy()
+
+# Latencies older than the window are forgotten, so a primary that was
+# switched away from gets retried once its slow samples have aged out
+LATENCY_WINDOW = float(os.environ.get("MODEL_LATENCY_WINDOW", 300))
+LATENCY_MIN_SAMPLES = int(os.environ.get("MODEL_LATENCY_MIN_SAMPLES", 20))
+MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", 1))
+
+
+class LatencyTracker:
+    def __init__(self, window: float = LATENCY_WINDOW, min_samples: int = LATENCY_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def _recent(self, key, now: float) -> deque:
+        samples = self.samples.setdefault(key, deque(maxlen=1000))
+        while samples and samples[0][0] < now - self.window:
+            samples.popleft()
+        return samples
+
+    def record(self, key, seconds: float, now: float = None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._recent(key, now).append((now, seconds))
+
+    def p95(self, key, now: float = None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            latencies = sorted(seconds for _, seconds in self._recent(key, now))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+
+latency_tracker = LatencyTracker()
+
+
+class LatencyRecorder(BaseCallbackHandler):
+    # Attached to one model, failures count as well so timeouts push the p95 up
+    def __init__(self, key):
+        self.key = key
+        self.started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.started[run_id] = time.monotonic()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.started[run_id] = time.monotonic()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if isinstance(error, DeadlineExceeded):
+            # Never sent, so it says nothing about the model's latency
+            self.started.pop(run_id, None)
+            return
+        self._finish(run_id)
+
+    def _finish(self, run_id):
+        started = self.started.pop(run_id, None)
+        if started is not None:
+            latency_tracker.record(self.key, time.monotonic() - started)
+
+
+class DeadlineChatOpenAI(ChatOpenAI):
+    # Each request, including every step of a ReAct loop, times out with
+    # whatever is left of the turn's deadline when it is sent
+    deadline: Any = None
+
+    def _get_request_payload(self, input_, *, stop=None, **kwargs):
+        if self.deadline is not None:
+            kwargs["timeout"] = call_timeout(self.request_timeout, self.deadline)
+        return super()._get_request_payload(input_, stop=stop, **kwargs)
+
+
+def policy_key(node: str, purpose: str) -> str:
+    key = f"{node}.{purpose}"
+    if key in MODEL_POLICY:
+        return key
+    return f"*.{purpose}"
+
+
+def policy_for(node: str, purpose: str) -> dict:
+    return MODEL_POLICY.get(policy_key(node, purpose), DEFAULT_ENTRY)
+
+
+_degraded = set()
+
+
+def _select(key: str, entry: dict) -> str:
+    if not entry.get("fallback") or not entry.get("p95_ms"):
+        return entry["model"]
+
+    p95 = latency_tracker.p95((key, entry["model"]))
+    degraded = p95 is not None and p95 * 1000 > entry["p95_ms"]
+
+    if degraded and key not in _degraded:
+        _degraded.add(key)
+        logger.warning("%s: p95 of %s is %.0f ms, switching to %s", key, entry["model"], p95 * 1000, entry["fallback"])
+    elif not degraded and key in _degraded:
+        _degraded.discard(key)
+        logger.info("%s: switching back to %s", key, entry["model"])
+
+    return entry["fallback"] if degraded else entry["model"]
+
+
+def select_model(node: str, purpose: str) -> str:
+    return _select(policy_key(node, purpose), policy_for(node, purpose))
+
+
+def _build(model: str, key: str, purpose: str, entry: dict, deadline=None, **kwargs):
+    return DeadlineChatOpenAI(
+        model=model,
+        temperature=entry.get("temperature", 0),
+        timeout=entry.get("timeout"),
+        deadline=deadline,
+        # Under a deadline a retry would reuse a timeout that no longer fits, the fallback is the retry
+        max_retries=0 if deadline is not None else MAX_RETRIES,
+        metadata={"purpose": purpose},
+        callbacks=[LatencyRecorder((key, model))],
+        **kwargs
+    )
+
+
+def chat_model(node: str, purpose: str, deadline=None, **kwargs):
+    # The primary model, or its fallback while the primary is slow. Errors and
+    # timeouts of the primary are retried once on the fallback either way.
+    # Nodes pass the deadline from the graph state, tools inherit their node's
+    key, entry = policy_key(node, purpose), policy_for(node, purpose)
+    deadline = deadline or current_deadline()
+    model = _select(key, entry)
+    llm = _build(model, key, purpose, entry, deadline, **kwargs)
+
+    fallback = entry.get("fallback")
+    if fallback and model != fallback:
+        llm = llm.with_fallbacks([_build(fallback, key, purpose, entry, deadline, **kwargs)])
+    return llm
+
+
+def metrics() -> dict:
+    snapshot = {}
+    for key, entry in MODEL_POLICY.items():
+        p95 = latency_tracker.p95((key, entry["model"]))
+        snapshot[key] = {
+            "primary": entry["model"],
+            "fallback": entry.get("fallback"),
+            "primary_p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "active": _select(key, entry)
+        }
+    return snapshot
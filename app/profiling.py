@@ -0,0 +1,202 @@
+from collections import Counter
+from datetime import datetime
+from bson.errors import InvalidDocument
+from pymongo.errors import PyMongoError
+from app.callbacks import SpanCallbackHandler
+from app.db import LazyCollection
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+profiles_db = LazyCollection("profiles")
+
+# Sent by an admin to profile that one request, ignored for everyone else
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_HEADER_VALUES = ("1", "true")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+PROFILE_RETENTION_DAYS = int(os.environ.get("PROFILE_RETENTION_DAYS", 7))
+# Rarest stacks beyond this are dropped so a long turn stays one small document
+PROFILE_MAX_STACKS = int(os.environ.get("PROFILE_MAX_STACKS", 2000))
+MAX_DEPTH = 128
+
+# A sample counts as waiting on the network or Mongo when one of these is on its stack,
+# the innermost Python frame is the one that called into the blocking C code
+MONGO_MODULES = ("pymongo", "bson")
+NETWORK_MODULES = ("socket.py", "ssl.py", "selectors.py", "httpcore", "httpx", os.path.join("http", "client.py"))
+WAIT_MODULES = ("threading.py", "queue.py", os.path.join("concurrent", "futures"))
+
+
+def ensure_indexes():
+    profiles_db.create_index("created_at", expireAfterSeconds=PROFILE_RETENTION_DAYS * 86400)
+    profiles_db.create_index("profile_id", unique=True)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _category(frame) -> str:
+    filename = frame.f_code.co_filename
+    walker = frame
+    while walker is not None:
+        if any(module in walker.f_code.co_filename for module in MONGO_MODULES):
+            return "mongo"
+        walker = walker.f_back
+    if any(module in filename for module in NETWORK_MODULES):
+        return "network"
+    if any(module in filename for module in WAIT_MODULES):
+        return "wait"
+    return "cpu"
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    # Samples only the threads the request runs on, every other thread goes on undisturbed
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        # Thread ident -> open spans on it, a pool thread back from its node is idle and not sampled
+        self.threads = Counter()
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_thread(self, ident: int = None):
+        self.threads[ident or threading.get_ident()] += 1
+
+    def remove_thread(self, ident: int):
+        self.threads[ident] -= 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, active in list(self.threads.items()):
+                frame = frames.get(ident)
+                if frame is None or active <= 0:
+                    continue
+                self.samples += 1
+                category = _category(frame)
+                self.categories[category] += 1
+                self.stacks[f"{category};{_stack(frame)}"] += 1
+
+
+class SpanRecorder(SpanCallbackHandler):
+    # The span timeline, which also tells the profiler which threads to follow
+    def __init__(self, profiler: SamplingProfiler):
+        super().__init__()
+        self.profiler = profiler
+        self.idents = {}
+
+    def _start(self, run_id, parent_run_id, kind: str, name: str, node: str = None):
+        self.profiler.add_thread()
+        self.idents[run_id] = threading.get_ident()
+        super()._start(run_id, parent_run_id, kind, name, node)
+
+    def _end(self, run_id, error: BaseException = None, **fields):
+        ident = self.idents.pop(run_id, None)
+        if ident is not None:
+            self.profiler.remove_thread(ident)
+        return super()._end(run_id, error, **fields)
+
+
+class RequestProfile:
+    def __init__(self, user: dict, path: str, question: str = None):
+        self.profile_id = str(uuid.uuid4())
+        self.user = user
+        self.path = path
+        self.question = question
+        self.profiler = SamplingProfiler()
+        self.spans = SpanRecorder(self.profiler)
+        self.saved = False
+
+    def wrap(self, func):
+        # Profiles func on whichever threadpool thread ends up running it
+        def profiled(*args, **kwargs):
+            self.profiler.add_thread()
+            self.profiler.start()
+            started, error = time.perf_counter(), None
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self.profiler.stop()
+                self.save(time.perf_counter() - started, error)
+        return profiled
+
+    def document(self, seconds: float, error: BaseException = None) -> dict:
+        stacks = self.profiler.stacks.most_common(PROFILE_MAX_STACKS)
+        return {
+            "profile_id": self.profile_id,
+            "username": self.user.get("username"),
+            "path": self.path,
+            "question": self.question,
+            "created_at": datetime.utcnow(),
+            "duration_ms": round(seconds * 1000, 1),
+            "error": type(error).__name__ if error is not None else None,
+            "interval_ms": self.profiler.interval * 1000,
+            "samples": self.profiler.samples,
+            # Samples per category: cpu, network, mongo or wait on another thread
+            "breakdown": dict(self.profiler.categories),
+            "stacks": [{"stack": stack, "count": count} for stack, count in stacks],
+            "dropped_stacks": max(0, len(self.profiler.stacks) - len(stacks)),
+            "spans": sorted(self.spans.spans, key=lambda span: span["start_ms"])
+        }
+
+    def save(self, seconds: float, error: BaseException = None):
+        # Runs in the turn's finally, a profile that cannot be stored must not fail the turn
+        try:
+            profiles_db.insert_one(self.document(seconds, error))
+            self.saved = True
+        except (PyMongoError, InvalidDocument):
+            # InvalidDocument covers DocumentTooLarge, a profile over Mongo's 16MB limit
+            logger.exception("Could not store profile %s", self.profile_id)
+
+
+def request_profile(headers, user: dict, path: str, question: str = None):
+    # None, and so no overhead at all, unless an admin asked for a profile
+    if str(headers.get(PROFILE_HEADER) or "").strip().lower() not in PROFILE_HEADER_VALUES or user.get("permission") != "admin":
+        return None
+    return RequestProfile(user, path, question)
+
+
+def folded(profile: dict) -> str:
+    # Collapsed stacks, readable by flamegraph.pl, inferno and speedscope
+    return "".join(f"{entry['stack']} {entry['count']}\n" for entry in profile["stacks"])
+
+
+def list_profiles(limit: int = 20) -> list:
+    return list(
+        profiles_db.find({}, {"_id": 0, "stacks": 0, "spans": 0})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+
+
+def get_profile(profile_id: str):
+    return profiles_db.find_one({"profile_id": profile_id}, {"_id": 0})
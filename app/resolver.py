@@ -0,0 +1,151 @@
+from difflib import SequenceMatcher
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Users and pipelines rarely change, one fetch per worker serves every lookup in between
+RESOLVER_TTL = float(os.environ.get("CRM_RESOLVER_TTL", 600))
+FUZZY_CUTOFF = float(os.environ.get("CRM_RESOLVER_CUTOFF", 0.75))
+# A best match this far ahead of the runner-up is taken without asking
+UNIQUE_MARGIN = 0.1
+
+GUID = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+# Arabic code points that Persian keyboards and pasted text mix with the Persian ones
+CHARACTER_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "أ": "ا", "إ": "ا", "آ": "ا", "ؤ": "و",
+    "\u200c": " ", "\u200e": "", "\u200f": "",
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+})
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", str(text or "")).translate(CHARACTER_MAP).lower()
+    # Drops diacritics and punctuation, keeps letters and digits of every script
+    text = "".join(char for char in text if not unicodedata.category(char).startswith("M"))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def is_id(value: str) -> bool:
+    return bool(GUID.match(str(value).strip()))
+
+
+def _score(query: str, name: str) -> float:
+    if query == name:
+        return 1.0
+    query_tokens, name_tokens = query.split(), name.split()
+    # "ali" finds "ali rezaei" ahead of "alireza karimi", "rez" finds both
+    if all(part in name_tokens for part in query_tokens):
+        return 0.95
+    if all(any(token.startswith(part) for token in name_tokens) for part in query_tokens):
+        return 0.85
+    ratio = SequenceMatcher(None, query, name).ratio()
+    if len(query_tokens) == 1:
+        ratio = max([ratio] + [SequenceMatcher(None, query, token).ratio() * 0.95 for token in name_tokens])
+    return ratio
+
+
+class NameIndex:
+    def __init__(self, entries: list):
+        # Each entry is {"id", "kind", "name", "names": [every name it goes by]}
+        self.entries = [
+            {**entry, "keys": {normalize(name) for name in entry["names"] if normalize(name)}}
+            for entry in entries
+        ]
+
+    def match(self, query: str, limit: int = 5) -> list:
+        query = normalize(query)
+        if not query:
+            return []
+
+        scored = []
+        for entry in self.entries:
+            score = max((_score(query, key) for key in entry["keys"]), default=0)
+            if score >= FUZZY_CUTOFF:
+                scored.append((round(score, 3), entry))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return [{"id": entry["id"], "kind": entry["kind"], "name": entry["name"], "score": score} for score, entry in scored[:limit]]
+
+
+def _user_entries(users: list) -> list:
+    entries = []
+    for user in users:
+        if not isinstance(user, dict) or not (user.get("Id") or user.get("UserId")):
+            continue
+        full_name = " ".join(part for part in (user.get("FirstName"), user.get("LastName")) if part)
+        names = [user.get("DisplayName"), full_name, user.get("UserName"), user.get("Email")]
+        names = [name for name in names if name]
+        if names:
+            entries.append({"id": user.get("Id") or user.get("UserId"), "kind": "user", "name": names[0], "names": names})
+    return entries
+
+
+def _pipeline_entries(pipelines: list) -> list:
+    entries = []
+    for pipeline in pipelines:
+        if not isinstance(pipeline, dict) or not pipeline.get("Id"):
+            continue
+        title = pipeline.get("Title") or ""
+        entries.append({"id": pipeline["Id"], "kind": "pipeline", "name": title, "names": [title]})
+        for stage in pipeline.get("Stages") or []:
+            if isinstance(stage, dict) and stage.get("Id") and stage.get("Title"):
+                # A stage is found by its own title or "pipeline stage"
+                entries.append({
+                    "id": stage["Id"],
+                    "kind": "stage",
+                    "name": f"{title} / {stage['Title']}",
+                    "names": [stage["Title"], f"{title} {stage['Title']}"]
+                })
+    return entries
+
+
+# Resolver kind -> (CRMClient fetch method, entries builder)
+SOURCES = {
+    "user": ("fetch_users", _user_entries),
+    "pipeline": ("fetch_pipelines", _pipeline_entries),
+}
+
+
+class CRMResolver:
+    def __init__(self, client, ttl: float = RESOLVER_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.indexes = {}
+        self.loaded_at = {}
+        self.lock = threading.Lock()
+
+    def index(self, kind: str):
+        with self.lock:
+            loaded_at = self.loaded_at.get(kind)
+            if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+                fetch, build = SOURCES[kind]
+                items = getattr(self.client, fetch)()
+                if items is not None:
+                    self.indexes[kind] = NameIndex(build(items))
+                    self.loaded_at[kind] = time.monotonic()
+                else:
+                    # Didar is unreachable, an older index is still better than none
+                    logger.warning("Could not refresh the %s index, %s", kind, "keeping the old one" if kind in self.indexes else "none loaded")
+            return self.indexes.get(kind)
+
+    def resolve(self, kind: str, query: str) -> dict:
+        # "match" is set when one entry clearly wins, otherwise the candidates are left to the agent
+        index = self.index(kind)
+        if index is None:
+            return {"query": query, "match": None, "candidates": [], "error": f"The {kind} list could not be loaded"}
+
+        candidates = index.match(query)
+        unique = candidates and (
+            len(candidates) == 1
+            # An exact name wins outright, "Sales" is the pipeline even though its stages contain the word
+            or candidates[0]["score"] == 1.0 > candidates[1]["score"]
+            or round(candidates[0]["score"] - candidates[1]["score"], 3) >= UNIQUE_MARGIN
+        )
+        return {"query": query, "match": candidates[0] if unique else None, "candidates": candidates}
@@ -0,0 +1,13 @@
+from starlette.responses import JSONResponse
+import orjson
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        # ObjectIds and other unknown types fall back to str like jsonable_encoder does
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+def projection(model) -> dict:
+    # Reads only the fields a response model declares, so documents can be sent without re-validating them
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
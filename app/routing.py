@@ -0,0 +1,44 @@
+from langgraph.graph import END
+from app.classifier import AgentState, guess_agent
+from app.history import summarize_older_turns
+from app.agents.crm_agent import crm_agent_node
+from app.agents.unknown import unknown_node
+
+AGENT_NODES = {
+    "crm-agent": crm_agent_node,
+    "unknown": unknown_node
+}
+
+# An agent may only be speculated while all of its tools are read-only,
+# a wrong guess is thrown away but anything it wrote would stay
+SPECULATIVE_AGENTS = {"crm-agent", "unknown"}
+
+
+def _speculation_hit(state: AgentState) -> bool:
+    speculation = state.get("speculation")
+    return bool(speculation) and speculation["agent"] == state.get("agent")
+
+
+def speculate_node(state: AgentState) -> AgentState:
+    # Runs next to the classifier: prepares the history, then answers as the guessed agent
+    summary = summarize_older_turns(state.get("chat_history", []), state.get("deadline"))
+    update = {"history_summary": summary}
+
+    agent = guess_agent(state.get("question", ""))
+    if agent in SPECULATIVE_AGENTS:
+        result = AGENT_NODES[agent]({**state, "history_summary": summary})
+        update["speculation"] = {"agent": agent, "answer": result["answer"], "chat_history": result["chat_history"]}
+
+    return update
+
+
+def dispatch_node(state: AgentState) -> AgentState:
+    # Joins the parallel branches, a speculative answer is kept only if classify agrees with it
+    if _speculation_hit(state):
+        speculation = state["speculation"]
+        return {"answer": speculation["answer"], "chat_history": speculation["chat_history"]}
+    return {}
+
+
+def route(state: AgentState) -> str:
+    return END if _speculation_hit(state) else state["agent"]
@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.agent import sessions_db
+from app.archive import archived_sessions_db, rehydrate_session
+from app.db import LazyCollection
+import os
+import time
+import uuid
+
+# What to do when another request saved a turn while this one was running:
+# "merge" appends this turn after theirs, "reject" answers 409
+CONFLICT_POLICY = os.environ.get("SESSION_CONFLICT_POLICY", "merge")
+LOCK_ENABLED = os.environ.get("SESSION_LOCK_ENABLED", "false").lower() == "true"
+LOCK_WAIT = float(os.environ.get("SESSION_LOCK_WAIT", 30))
+LOCK_TTL = int(os.environ.get("SESSION_LOCK_TTL", 300))
+
+session_locks_db = LazyCollection("session_locks")
+
+
+def ensure_indexes():
+    sessions_db.create_index("session_id", unique=True)
+    session_locks_db.create_index("expires_at", expireAfterSeconds=0)
+
+
+def load_session(session_id: str, user_id: str):
+    session = sessions_db.find_one({"session_id": session_id}, {"_id": 0}) or rehydrate_session(session_id, user_id)
+    # Another user's archived session stays archived and is refused like a live one
+    if session is None and archived_sessions_db.find_one({"session_id": session_id}, {"_id": 1}):
+        raise HTTPException(status_code=403, detail="Permission denied for this session")
+    if session and session.get("user_id") != user_id:
+        raise HTTPException(status_code=403, detail="Permission denied for this session")
+    return session
+
+
+def _merge_turn(session_id: str, user_id: str, turn, now: datetime) -> int:
+    # A turn that read the session before it was archived brings the history back,
+    # instead of upserting a new session that holds only this turn
+    rehydrate_session(session_id, user_id)
+    try:
+        session = sessions_db.find_one_and_update(
+            {"session_id": session_id, "user_id": user_id},
+            {
+                "$push": {"chat_history": turn},
+                "$inc": {"version": 1},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True,
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=403, detail="Permission denied for this session")
+    return session["version"]
+
+
+def save_turn(session_id: str, user_id: str, session, chat_history: list) -> int:
+    now = datetime.utcnow()
+    turn = chat_history[-1]
+
+    if session is None:
+        try:
+            sessions_db.insert_one({
+                "session_id": session_id,
+                "user_id": user_id,
+                "chat_history": chat_history,
+                "version": 1,
+                "created_at": now,
+                "updated_at": now
+            })
+            return 1
+        except DuplicateKeyError:
+            pass
+    else:
+        # Sessions saved before versioning have no version field, None matches them
+        version = session.get("version")
+        result = sessions_db.update_one(
+            {"session_id": session_id, "user_id": user_id, "version": version},
+            {"$set": {"chat_history": chat_history, "updated_at": now}, "$inc": {"version": 1}}
+        )
+        if result.matched_count:
+            return (version or 0) + 1
+
+    if CONFLICT_POLICY == "reject":
+        raise HTTPException(status_code=409, detail="Session was updated by another request, retry with the latest history")
+    return _merge_turn(session_id, user_id, turn, now)
+
+
+@contextmanager
+def session_lock(session_id: str):
+    if not LOCK_ENABLED:
+        yield
+        return
+
+    token = str(uuid.uuid4())
+    deadline = time.monotonic() + LOCK_WAIT
+    delay = 0.05
+
+    while True:
+        now = datetime.utcnow()
+        try:
+            session_locks_db.update_one(
+                {"_id": session_id, "expires_at": {"$lt": now}},
+                {"$set": {"token": token, "expires_at": now + timedelta(seconds=LOCK_TTL)}},
+                upsert=True
+            )
+            break
+        except DuplicateKeyError:
+            if time.monotonic() + delay > deadline:
+                raise HTTPException(status_code=409, detail="Session is busy with another request")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    try:
+        yield
+    finally:
+        session_locks_db.delete_one({"_id": session_id, "token": token})
@@ -0,0 +1,132 @@
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+import hashlib
+import logging
+import mimetypes
+import os
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Output of scripts/build_static.py, the pages are served from app/static until it has run
+STATIC_DIR = os.environ.get("STATIC_DIR", os.path.join(ROOT, "build", "static"))
+SOURCE_PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Preferred first, each is a sibling file with the suffix added, e.g. app.js.br
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+class StaticFile:
+    def __init__(self, path: str, media_type: str, cache_control: str):
+        self.path = path
+        self.media_type = media_type
+        self.cache_control = cache_control
+        # Each representation has its own strong ETag, as their bytes differ
+        self.representations = {None: _representation(path)}
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix):
+                self.representations[encoding] = _representation(path + suffix)
+
+
+def _representation(path: str):
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:32]
+    return path, f'"{digest}"', os.stat(path)
+
+
+def _accepted_encodings(header: str) -> dict:
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class PrecompressedFiles:
+    # Files are hashed once when created, requests only pick a representation and stream it
+    def __init__(self, directory: str, immutable_dirs: tuple = ("assets",), index: str = None):
+        self.directory = directory
+        self.index = index
+        self.files = {}
+
+        for folder, _, names in os.walk(directory):
+            for name in names:
+                if any(name.endswith(suffix) for _, suffix in ENCODINGS):
+                    continue
+                path = os.path.join(folder, name)
+                relative = os.path.relpath(path, directory).replace(os.sep, "/")
+                immutable = relative.split("/")[0] in immutable_dirs
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                self.files[relative] = StaticFile(path, media_type, IMMUTABLE if immutable else REVALIDATE)
+
+    def response(self, name: str, request: Request) -> Response:
+        static_file = self.files.get(name)
+        if static_file is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next(
+            (
+                encoding for encoding, _ in ENCODINGS
+                if encoding in static_file.representations and accepted.get(encoding, accepted.get("*", 0)) > 0
+            ),
+            None
+        )
+        path, etag, stat_result = static_file.representations[encoding]
+
+        headers = {"ETag": etag, "Cache-Control": static_file.cache_control}
+        if len(static_file.representations) > 1:
+            headers["Vary"] = "Accept-Encoding"
+
+        if _matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return FileResponse(path, media_type=static_file.media_type, headers=headers, stat_result=stat_result)
+
+    async def __call__(self, scope, receive, send):
+        # Mounted as an ASGI app, the route path is relative to the mount point
+        request = Request(scope, receive)
+        if request.method not in ("GET", "HEAD"):
+            response = Response("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+        else:
+            path = scope["path"]
+            root_path = scope.get("root_path", "")
+            if root_path and path.startswith(root_path):
+                path = path[len(root_path):]
+            name = path.lstrip("/") or self.index
+            response = self.response(name, request)
+        await response(scope, receive, send)
+
+
+def load_pages() -> PrecompressedFiles:
+    built = os.path.join(STATIC_DIR, "pages")
+    if os.path.isdir(built):
+        return PrecompressedFiles(built)
+    logger.info("No static build in %s, serving uncompressed pages from %s", STATIC_DIR, SOURCE_PAGES_DIR)
+    return PrecompressedFiles(SOURCE_PAGES_DIR)
+
+
+def load_web_app():
+    built = os.path.join(STATIC_DIR, "web")
+    if not os.path.isdir(built):
+        return None
+    return PrecompressedFiles(built, index="index.html")
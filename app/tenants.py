@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import HTTPException
+from app.analytics import DealAnalytics
+from app.crm_client import CRMClient
+from app.db import LazyCollection
+from app.resolver import CRMResolver
+import os
+import threading
+import time
+
+# Users without a tenant use the Didar account from DIDAR_API_KEY, as before
+DEFAULT_TENANT = "default"
+DEFAULT_BASE_URL = os.environ.get("DIDAR_URI") or "https://app.didar.me/api"
+# Tenants with a live CRMClient in one worker, the least recently used is closed beyond it
+TENANT_POOL_SIZE = int(os.environ.get("TENANT_POOL_SIZE", 64))
+TENANT_IDLE_SECONDS = float(os.environ.get("TENANT_IDLE_SECONDS", 900))
+# A changed API key or limit is picked up once the tenant's client is this old
+TENANT_MAX_AGE = float(os.environ.get("TENANT_MAX_AGE", 3600))
+# Defaults for tenants whose document does not set their own
+CRM_RATE_PER_SECOND = float(os.environ.get("CRM_RATE_PER_SECOND", 0))
+CRM_RATE_BURST = float(os.environ.get("CRM_RATE_BURST", 5))
+CRM_MAX_CONNECTIONS = int(os.environ.get("CRM_MAX_CONNECTIONS", 10))
+
+# One document per shop: {"tenant_id", "didar_api_key", "didar_base_url",
+# "rate_per_second", "burst", "max_connections", "disabled"}
+tenants_db = LazyCollection("tenants")
+
+_current_tenant = ContextVar("tenant", default=DEFAULT_TENANT)
+
+
+def ensure_indexes():
+    tenants_db.create_index("tenant_id", unique=True)
+
+
+def user_tenant(user: dict) -> str:
+    return user.get("tenant") or DEFAULT_TENANT
+
+
+def current_tenant() -> str:
+    return _current_tenant.get()
+
+
+@contextmanager
+def tenant_scope(tenant: str = None):
+    # Every CRM call in the block goes to this tenant's Didar account
+    token = _current_tenant.set(tenant or DEFAULT_TENANT)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def _load_config(tenant: str) -> dict:
+    if tenant == DEFAULT_TENANT:
+        return {"didar_api_key": os.environ.get("DIDAR_API_KEY")}
+    config = tenants_db.find_one({"tenant_id": tenant, "disabled": {"$ne": True}}, {"_id": 0})
+    if not config or not config.get("didar_api_key"):
+        raise HTTPException(status_code=403, detail="No CRM account is configured for this tenant")
+    return config
+
+
+class TenantResources:
+    # A tenant's client with its own connections and rate limit, and the caches built on it
+    def __init__(self, tenant: str, config: dict):
+        self.tenant = tenant
+        self.client = CRMClient(
+            api_key=config.get("didar_api_key"),
+            base_url=config.get("didar_base_url") or DEFAULT_BASE_URL,
+            rate=float(config.get("rate_per_second", CRM_RATE_PER_SECOND)),
+            burst=float(config.get("burst", CRM_RATE_BURST)),
+            max_connections=int(config.get("max_connections", CRM_MAX_CONNECTIONS))
+        )
+        self.resolver = CRMResolver(self.client)
+        self.analytics = DealAnalytics(self.client)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def close(self):
+        self.client.close()
+
+
+class CRMClientPool:
+    def __init__(self, max_size: int = TENANT_POOL_SIZE, idle_seconds: float = TENANT_IDLE_SECONDS, max_age: float = TENANT_MAX_AGE):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def _expired(self, now: float) -> list:
+        # Least recently used first, so the scan stops at the first one still in use
+        expired = []
+        for tenant, entry in list(self.entries.items()):
+            if now - entry.last_used <= self.idle_seconds and now - entry.created_at <= self.max_age:
+                break
+            expired.append(self.entries.pop(tenant))
+        while len(self.entries) > self.max_size:
+            expired.append(self.entries.popitem(last=False)[1])
+        return expired
+
+    def get(self, tenant: str = None) -> TenantResources:
+        tenant = tenant or current_tenant()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(tenant)
+            if entry is not None and now - entry.created_at <= self.max_age:
+                return self._use(tenant, entry, now)
+
+        # The tenant lookup is a Mongo round trip, done outside the lock
+        created = TenantResources(tenant, _load_config(tenant))
+        with self.lock:
+            entry = self.entries.get(tenant)
+            if entry is None or now - entry.created_at > self.max_age:
+                stale = self.entries.pop(tenant, None)
+                if stale is not None:
+                    stale.close()
+                entry = self.entries[tenant] = created
+            else:
+                # Another request built it in the meantime
+                created.close()
+            return self._use(tenant, entry, now)
+
+    def _use(self, tenant: str, entry: TenantResources, now: float) -> TenantResources:
+        # Called with the lock held
+        entry.last_used = now
+        self.entries.move_to_end(tenant)
+        expired = self._expired(now)
+        self.evicted += len(expired)
+        # A request still using a closed client reconnects on its next call
+        for resources in expired:
+            resources.close()
+        return entry
+
+    def close(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        for entry in entries:
+            entry.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"tenants": len(self.entries), "max_size": self.max_size, "evicted": self.evicted}
+
+
+crm_pool = CRMClientPool()
+
+
+class TenantProxy:
+    # Stands in for a module-level client or cache, resolved per call to the current tenant's
+    def __init__(self, attribute: str):
+        self._attribute = attribute
+
+    def __getattr__(self, name):
+        return getattr(getattr(crm_pool.get(), self._attribute), name)
@@ -0,0 +1,220 @@
+from datetime import datetime, timedelta
+from pymongo.errors import CollectionInvalid, PyMongoError
+from app.callbacks import SpanCallbackHandler
+from app.db import LazyCollection, crm_db
+import logging
+import os
+import queue
+import random
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+TRACE_STORE_ENABLED = os.environ.get("TRACE_STORE_ENABLED", "false").lower() == "true"
+# Head sampling: share of ordinary runs kept, decided when the run starts
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.05))
+# Tail sampling: runs at least this slow, and failed runs, are always kept
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 10000))
+# Size of the capped collection, the oldest traces are overwritten once it is full
+TRACE_STORE_SIZE_MB = int(os.environ.get("TRACE_STORE_SIZE_MB", 256))
+TRACE_BATCH_SIZE = int(os.environ.get("TRACE_BATCH_SIZE", 50))
+TRACE_FLUSH_INTERVAL = float(os.environ.get("TRACE_FLUSH_INTERVAL", 2))
+# Traces waiting to be written, beyond this they are dropped rather than slow a request down
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", 1000))
+
+SPAN_KINDS = ("graph", "node", "llm", "tool")
+
+traces_db = LazyCollection("traces")
+
+
+def ensure_capped():
+    size = TRACE_STORE_SIZE_MB * 1024 * 1024
+    try:
+        crm_db.create_collection("traces", capped=True, size=size)
+    except CollectionInvalid:
+        # An insert that came first creates it uncapped, a resize of a capped one needs convertToCapped by hand
+        if not traces_db.options().get("capped"):
+            crm_db.command("convertToCapped", "traces", size=size)
+
+
+def ensure_indexes():
+    if not TRACE_STORE_ENABLED:
+        return
+    ensure_capped()
+    traces_db.create_index("trace_id")
+    traces_db.create_index("started_at")
+    traces_db.create_index([("spans.kind", 1), ("spans.name", 1)])
+
+
+class TraceWriter:
+    # Requests only put finished traces on a queue, a daemon thread writes them in batches
+    def __init__(self, max_size: int = TRACE_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._capped = False
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started on first use, and again in a forked worker where the thread is gone
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, trace: dict) -> bool:
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(trace)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _batch(self) -> list:
+        try:
+            batch = [self.queue.get(timeout=TRACE_FLUSH_INTERVAL)]
+        except queue.Empty:
+            return []
+        while len(batch) < TRACE_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list):
+        try:
+            # Never let the first insert create the collection uncapped
+            if not self._capped:
+                ensure_capped()
+                self._capped = True
+            traces_db.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except PyMongoError:
+            self.failed += len(batch)
+            logger.exception("Could not store %s traces", len(batch))
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._batch()
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        # Writes whatever is still queued on the calling thread
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= TRACE_BATCH_SIZE:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(TRACE_FLUSH_INTERVAL + 1)
+        self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped, "failed": self.failed}
+
+
+trace_writer = TraceWriter()
+
+
+class TraceCallbackHandler(SpanCallbackHandler):
+    def __init__(self, user: dict, session_id: str, writer: TraceWriter = None):
+        super().__init__()
+        self.trace_id = str(uuid.uuid4())
+        self.user = user
+        self.session_id = session_id
+        self.writer = writer or trace_writer
+        self.started_at = datetime.utcnow()
+        self.head_sampled = random.random() < TRACE_SAMPLE_RATE
+
+    def _end(self, run_id, error: BaseException = None, **fields):
+        span = super()._end(run_id, error, **fields)
+        # The root run ending closes the trace
+        if span is not None and span["parent"] is None:
+            self._finish(span)
+        return span
+
+    def _kept_by(self, root: dict):
+        if root.get("error"):
+            return "error"
+        if root["duration_ms"] >= TRACE_SLOW_MS:
+            return "slow"
+        if self.head_sampled:
+            return "sample"
+        return None
+
+    def _finish(self, root: dict):
+        kept_by = self._kept_by(root)
+        if kept_by is None:
+            return
+        spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        self.writer.submit({
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "user_id": str(self.user.get("_id")),
+            "username": self.user.get("username"),
+            "started_at": self.started_at,
+            "duration_ms": root["duration_ms"],
+            "status": "error" if root.get("error") else "ok",
+            "error": root.get("error"),
+            "kept_by": kept_by,
+            "tokens": {
+                "prompt": sum(span.get("prompt_tokens") or 0 for span in spans),
+                "completion": sum(span.get("completion_tokens") or 0 for span in spans)
+            },
+            "spans": spans
+        })
+
+
+def trace_handler(user: dict, session_id: str):
+    # None, and so nothing recorded at all, unless the store is enabled
+    if not TRACE_STORE_ENABLED:
+        return None
+    return TraceCallbackHandler(user, session_id)
+
+
+def slowest_spans(kind: str = "node", name: str = None, since_hours: float = 24, limit: int = 20) -> list:
+    match = {"spans.kind": kind}
+    if name:
+        match["spans.name"] = name
+    pipeline = [
+        {"$match": {"started_at": {"$gte": datetime.utcnow() - timedelta(hours=since_hours)}, **match}},
+        {"$unwind": "$spans"},
+        {"$match": match},
+        {"$sort": {"spans.duration_ms": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "trace_id": 1,
+            "session_id": 1,
+            "username": 1,
+            "started_at": 1,
+            "trace_duration_ms": "$duration_ms",
+            "status": 1,
+            "span": "$spans"
+        }}
+    ]
+    return list(traces_db.aggregate(pipeline))
+
+
+def get_trace(trace_id: str):
+    return traces_db.find_one({"trace_id": trace_id}, {"_id": 0})
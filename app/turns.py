@@ -0,0 +1,71 @@
+from fastapi import HTTPException
+from app.admission import check_rate_limit, graph_slot
+from app.agent import get_graph
+from app.commands import match_command, command_turn
+from app.deadline import Deadline, DeadlineExceeded, deadline_scope
+from app.tenants import crm_pool, tenant_scope, user_tenant
+from app.sessions import load_session, save_turn, session_lock
+from app.tracing import trace_handler
+from app.usage import record_usage
+
+
+def invoke_graph(state: dict, config: dict) -> dict:
+    return get_graph().invoke(state, config=config)
+
+
+def run_turn(user: dict, question: str, session_id: str, execute=invoke_graph, callbacks: list = None, deadline: Deadline = None, rate_limited: bool = True) -> dict:
+    from app.callbacks import UsageCallbackHandler
+
+    deadline = deadline or Deadline()
+    user_id = str(user["_id"])
+    # A batch is counted once for all of its items
+    if rate_limited:
+        check_rate_limit(user_id)
+    # An unknown tenant is refused before any LLM work
+    tenant = user_tenant(user)
+    crm_pool.get(tenant)
+
+    with session_lock(session_id):
+        session = load_session(session_id, user_id)
+        chat_history = list(session.get("chat_history", [])) if session else []
+
+        state = {
+            "question": question,
+            "chat_history": chat_history,
+            "session_id": session_id,
+            "user_id": user_id,
+            "deadline": deadline,
+            "tenant": tenant
+        }
+
+        usage_handler = UsageCallbackHandler()
+        shortcut = match_command(question)
+        try:
+            if shortcut is not None:
+                # Answered straight from Didar and rendered locally, no LLM call and no graph slot
+                with deadline_scope(deadline), tenant_scope(tenant):
+                    result = command_turn(question, chat_history, *shortcut)
+            else:
+                trace = trace_handler(user, session_id)
+                handlers = [usage_handler, *([trace] if trace else []), *(callbacks or [])]
+                with graph_slot(deadline.remaining()):
+                    result = execute(state, {"callbacks": handlers})
+        except Exception as e:
+            # A call cut off by the deadline fails with its client's own timeout error
+            if not deadline.expired:
+                raise
+            if deadline.cancelled:
+                raise DeadlineExceeded("Request was cancelled") from e
+            raise HTTPException(status_code=504, detail="Request deadline exceeded") from e
+        finally:
+            record_usage(usage_handler.totals, user_id, user["username"], session_id)
+
+        version = save_turn(session_id, user_id, session, result["chat_history"])
+
+    return {
+        "agent": result["agent"],
+        "response": result.get("answer", "No answer provided"),
+        "session_id": session_id,
+        "version": version,
+        "models": usage_handler.models()
+    }
@@ -0,0 +1,106 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from app.db import LazyCollection
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+usage_db = LazyCollection("usage")
+
+# USD per million tokens: (prompt, completion, cached prompt)
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gpt-3.5-turbo": (0.50, 1.50, 0.50),
+}
+
+MODEL_PRICES = {
+    **DEFAULT_MODEL_PRICES,
+    **{model: tuple(price) for model, price in json.loads(os.environ.get("MODEL_PRICES", "{}")).items()}
+}
+
+COUNTERS = ["calls", "prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens", "cost_usd"]
+
+
+def ensure_indexes():
+    usage_db.create_index([("day", 1), ("user_id", 1)])
+    # /admin/usage?username=... matches on the name, then the date range
+    usage_db.create_index([("username", 1), ("day", 1)])
+    usage_db.create_index([("session_id", 1), ("day", 1)])
+
+
+def _price(model: str):
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    # Dated snapshots such as gpt-4o-mini-2024-07-18 are billed like their base model
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_PRICES[name]
+    return (0, 0, 0)
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    prompt_price, completion_price, cached_price = _price(model or "")
+    return (
+        (prompt_tokens - cached_tokens) * prompt_price
+        + cached_tokens * cached_price
+        + completion_tokens * completion_price
+    ) / 1_000_000
+
+
+def record_usage(totals: dict, user_id: str, username: str, session_id: str = None):
+    if not totals:
+        return
+
+    day = datetime.utcnow().strftime("%Y-%m-%d")
+    operations = []
+    for (node, purpose, model), counts in totals.items():
+        operations.append(UpdateOne(
+            {
+                "day": day,
+                "user_id": user_id,
+                "session_id": session_id,
+                "node": node,
+                "purpose": purpose,
+                "model": model
+            },
+            {
+                "$inc": {
+                    **counts,
+                    "cost_usd": cost(model, counts["prompt_tokens"], counts["completion_tokens"], counts["cached_tokens"])
+                },
+                "$setOnInsert": {"username": username}
+            },
+            upsert=True
+        ))
+
+    try:
+        usage_db.bulk_write(operations, ordered=False)
+    except Exception:
+        # Accounting must never fail the request it is accounting for
+        logger.exception("Could not record token usage")
+
+
+def query_usage(start: str, end: str, username: str = None, group_by: str = "user"):
+    match = {"day": {"$gte": start, "$lte": end}}
+    if username:
+        match["username"] = username
+
+    key = {"username": "$username", "day": "$day"}
+    if group_by == "session":
+        key["session_id"] = "$session_id"
+    elif group_by == "node":
+        key.update({"node": "$node", "purpose": "$purpose", "model": "$model"})
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": key, **{counter: {"$sum": f"${counter}"} for counter in COUNTERS}}},
+        {"$sort": {"_id.day": 1, "cost_usd": -1}},
+    ]
+
+    return [
+        {**row.pop("_id"), **row, "cost_usd": round(row["cost_usd"], 6)}
+        for row in usage_db.aggregate(pipeline)
+    ]
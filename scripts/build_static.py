@@ -0,0 +1,99 @@
+"""Build the static frontend and precompress it for the API to serve.
+
+Usage:
+    python scripts/build_static.py [--skip-npm] [--out build/static]
+
+Copies the pages in app/static and the Vite build of web/ (hashed assets
+under assets/) into the output directory, then writes .gz and .br siblings
+for every compressible file so no compression happens while serving.
+Brotli variants need the `brotli` package and are skipped without it.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES_DIR = os.path.join(ROOT, "app", "static")
+WEB_DIR = os.path.join(ROOT, "web")
+
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".svg", ".json", ".map", ".txt", ".xml", ".ico", ".wasm"}
+MIN_SIZE = 1024
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def build_web():
+    npm = shutil.which("npm")
+    if npm is None:
+        raise SystemExit("npm is required to build web/, install Node.js or pass --skip-npm")
+    if not os.path.isdir(os.path.join(WEB_DIR, "node_modules")):
+        subprocess.run([npm, "ci"], cwd=WEB_DIR, check=True)
+    subprocess.run([npm, "run", "build"], cwd=WEB_DIR, check=True)
+
+
+def compress(path: str) -> dict:
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    sizes = {"raw": len(raw)}
+    variants = {"gzip": (".gz", gzip.compress(raw, compresslevel=9, mtime=0))}
+    if brotli is not None:
+        variants["br"] = (".br", brotli.compress(raw, quality=11))
+
+    for encoding, (suffix, data) in variants.items():
+        # A variant that barely helps is not worth the extra file and Vary handling
+        if len(data) < len(raw) * 0.9:
+            with open(path + suffix, "wb") as f:
+                f.write(data)
+            sizes[encoding] = len(data)
+    return sizes
+
+
+def _row(name: str, sizes: dict) -> str:
+    variants = "".join(f"  {key} {sizes[key]:>9,}" if key in sizes else f"  {key} {'-':>9}" for key in ("gzip", "br"))
+    return f"{name:<50} {sizes['raw']:>9,} B{variants}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skip-npm", action="store_true", help="use an existing web/dist instead of running the Vite build")
+    parser.add_argument("--out", default=os.path.join(ROOT, "build", "static"))
+    args = parser.parse_args()
+
+    if not args.skip_npm:
+        build_web()
+
+    shutil.rmtree(args.out, ignore_errors=True)
+    shutil.copytree(PAGES_DIR, os.path.join(args.out, "pages"))
+
+    dist = os.path.join(WEB_DIR, "dist")
+    if os.path.isdir(dist):
+        shutil.copytree(dist, os.path.join(args.out, "web"))
+    else:
+        print(f"{dist} not found, the web app will not be served", file=sys.stderr)
+
+    if brotli is None:
+        print("brotli is not installed, only gzip variants are written", file=sys.stderr)
+
+    total = {"raw": 0, "gzip": 0, "br": 0}
+    for folder, _, names in os.walk(args.out):
+        for name in sorted(names):
+            path = os.path.join(folder, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE or os.path.getsize(path) < MIN_SIZE:
+                continue
+            sizes = compress(path)
+            for key in total:
+                total[key] += sizes.get(key, sizes["raw"])
+            print(_row(os.path.relpath(path, args.out), sizes))
+
+    print(_row("total", total))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""Replay a labeled dataset through classifier variants and compare their routing.
+
+Usage:
+    python scripts/eval_classifier.py DATASET [--variants baseline,with-summary] [--llm keyword|openai|replay]
+                                              [--recordings .classifier_recordings.jsonl] [--json]
+
+DATASET is a JSONL file with one case per line:
+    {"history": [["question", "answer"], ...], "question": "...", "expected": "crm-agent"}
+
+A variant is one of VARIANTS, optionally followed by "@model" to run it on a
+different model, e.g. "baseline@gpt-4o-mini".
+
+--llm keyword uses a keyword stand-in so the harness runs without an API key,
+--llm openai calls the real models and appends every response to the
+recordings file, and --llm replay answers from that file so a dataset can be
+re-scored offline with the latency and tokens of the recorded run.
+"""
+from collections import Counter
+from typing import Any, List, Optional
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "eval")
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_openai import ChatOpenAI
+from app.callbacks import UsageCallbackHandler
+from app.model_policy import policy_for
+from app.classifier import classify, classifier_prompt, guess_agent, parse_label, summarize_history
+
+LABELS = ["crm-agent", "unknown"]
+
+
+def _classify_with_summary(question, chat_history, make_llm):
+    # The router before the history summary moved to its own graph branch
+    summary = summarize_history(chat_history, make_llm("summarize"))
+    response = make_llm("classify").invoke([
+        {"role": "system", "content": classifier_prompt(question, chat_history, summary)},
+        {"role": "user", "content": question}
+    ])
+    return parse_label(response.content)
+
+
+def _classify_question_only(question, chat_history, make_llm):
+    response = make_llm("classify").invoke([
+        {"role": "system", "content": classifier_prompt(question, [])},
+        {"role": "user", "content": question}
+    ])
+    return parse_label(response.content)
+
+
+VARIANTS = {
+    "baseline": lambda question, chat_history, make_llm: classify(question, chat_history, make_llm("classify")),
+    "with-summary": _classify_with_summary,
+    "question-only": _classify_question_only,
+}
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class KeywordChatModel(BaseChatModel):
+    model_name: str = "keyword"
+
+    @property
+    def _llm_type(self) -> str:
+        return "keyword"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if (self.metadata or {}).get("purpose") == "summarize":
+            content = ""
+        else:
+            content = guess_agent(messages[-1].content)
+
+        prompt_tokens = sum(_estimate_tokens(message.content) for message in messages)
+        message = AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": prompt_tokens, "output_tokens": 1, "total_tokens": prompt_tokens + 1},
+            response_metadata={"model_name": self.model_name}
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def recording_key(model: str, purpose: str, messages) -> str:
+    payload = json.dumps([model, purpose, [[message.type, message.content] for message in messages]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RecordingChatModel(BaseChatModel):
+    inner: Any
+    path: str
+    lock: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        started = time.perf_counter()
+        response = self.inner.invoke(messages)
+        latency = time.perf_counter() - started
+
+        entry = {
+            "key": recording_key(self.inner.model_name, (self.metadata or {}).get("purpose"), messages),
+            "content": response.content,
+            "usage_metadata": response.usage_metadata,
+            "model_name": response.response_metadata.get("model_name", self.inner.model_name),
+            "latency": latency
+        }
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+
+class ReplayChatModel(BaseChatModel):
+    model_name: str
+    recordings: dict
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = recording_key(self.model_name, (self.metadata or {}).get("purpose"), messages)
+        if key not in self.recordings:
+            raise KeyError(f"No recorded response for this {self.model_name} call, run once with --llm openai first")
+
+        entry = self.recordings[key]
+        message = AIMessage(
+            content=entry["content"],
+            usage_metadata=entry.get("usage_metadata"),
+            response_metadata={"model_name": entry.get("model_name"), "recorded_latency": entry.get("latency", 0)}
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class RecordedLatencyHandler(BaseCallbackHandler):
+    def __init__(self):
+        self.seconds = 0.0
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                self.seconds += generation.message.response_metadata.get("recorded_latency", 0)
+
+
+def load_recordings(path: str) -> dict:
+    recordings = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    recordings[entry["key"]] = entry
+    return recordings
+
+
+def model_factory(mode: str, model: str, recordings_path: str):
+    lock = threading.Lock()
+    recordings = load_recordings(recordings_path) if mode == "replay" else None
+
+    def factory(purpose: str, callbacks: list):
+        metadata = {"purpose": purpose}
+        if mode == "keyword":
+            return KeywordChatModel(metadata=metadata, callbacks=callbacks)
+        if mode == "replay":
+            return ReplayChatModel(model_name=model, recordings=recordings, metadata=metadata, callbacks=callbacks)
+        inner = ChatOpenAI(model=model, temperature=0)
+        return RecordingChatModel(inner=inner, path=recordings_path, lock=lock, metadata=metadata, callbacks=callbacks)
+
+    return factory
+
+
+def load_dataset(path: str) -> list:
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if case.get("expected") not in LABELS:
+                raise SystemExit(f"{path}:{number}: expected must be one of {LABELS}")
+            cases.append({"history": case.get("history", []), "question": case["question"], "expected": case["expected"]})
+    return cases
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def evaluate(variant: str, cases: list, mode: str, recordings_path: str) -> dict:
+    name, _, model = variant.partition("@")
+    if name not in VARIANTS:
+        raise SystemExit(f"Unknown variant {name!r}, choose from {', '.join(VARIANTS)}")
+
+    run = VARIANTS[name]
+    factory = model_factory(mode, model or policy_for("classify", "classify")["model"], recordings_path)
+    confusion = Counter()
+    latencies, misroutes = [], []
+    tokens = Counter()
+    errors = 0
+
+    for case in cases:
+        usage, recorded = UsageCallbackHandler(), RecordedLatencyHandler()
+        make_llm = lambda purpose: factory(purpose, [usage, recorded])
+
+        started = time.perf_counter()
+        try:
+            predicted = run(case["question"], case["history"], make_llm)
+        except KeyError as e:
+            raise SystemExit(str(e.args[0]))
+        except Exception as e:
+            errors += 1
+            predicted = "error"
+            print(f"[{variant}] {case['question']!r} failed: {e!r}", file=sys.stderr)
+        latencies.append(recorded.seconds if mode == "replay" else time.perf_counter() - started)
+
+        for counts in usage.totals.values():
+            tokens.update({key: counts[key] for key in ("calls", "prompt_tokens", "completion_tokens")})
+
+        confusion[(case["expected"], predicted)] += 1
+        if predicted != case["expected"]:
+            misroutes.append({"question": case["question"], "expected": case["expected"], "predicted": predicted})
+
+    total = len(cases)
+    correct = sum(count for (expected, predicted), count in confusion.items() if expected == predicted)
+    return {
+        "variant": variant,
+        "cases": total,
+        "accuracy": correct / total if total else 0.0,
+        "errors": errors,
+        "confusion": {
+            expected: {predicted: confusion[(expected, predicted)] for predicted in LABELS + (["error"] if errors else [])}
+            for expected in LABELS
+        },
+        "latency": {
+            "source": "recorded" if mode == "replay" else "measured",
+            "mean": sum(latencies) / total if total else 0.0,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95)
+        },
+        "tokens_per_case": {key: tokens[key] / total if total else 0.0 for key in ("calls", "prompt_tokens", "completion_tokens")},
+        "misroutes": misroutes
+    }
+
+
+def print_report(report: dict, show_misroutes: int):
+    latency, tokens = report["latency"], report["tokens_per_case"]
+    print(f"== {report['variant']} ==")
+    print(f"accuracy     {report['accuracy']:.1%} of {report['cases']} case(s), {report['errors']} error(s)")
+    print(
+        f"latency      mean {latency['mean'] * 1000:.0f} ms, p50 {latency['p50'] * 1000:.0f} ms, "
+        f"p95 {latency['p95'] * 1000:.0f} ms ({latency['source']})"
+    )
+    print(
+        f"per case     {tokens['calls']:.2f} call(s), {tokens['prompt_tokens']:.0f} prompt + "
+        f"{tokens['completion_tokens']:.0f} completion token(s)"
+    )
+
+    columns = list(next(iter(report["confusion"].values())))
+    print("expected \\ predicted  " + "".join(f"{label:>12}" for label in columns))
+    for expected, row in report["confusion"].items():
+        print(f"{expected:<21}" + "".join(f"{row[label]:>12}" for label in columns))
+
+    for miss in report["misroutes"][:show_misroutes]:
+        print(f"  misrouted to {miss['predicted']}: {miss['question']}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dataset")
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--llm", choices=["keyword", "openai", "replay"], default="keyword")
+    parser.add_argument("--recordings", default=os.path.join(ROOT, ".classifier_recordings.jsonl"))
+    parser.add_argument("--misroutes", type=int, default=5, help="misrouted questions to list per variant")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args()
+
+    if args.llm == "openai" and os.environ["OPENAI_API_KEY"] == "eval":
+        raise SystemExit("OPENAI_API_KEY must be set for --llm openai")
+
+    cases = load_dataset(args.dataset)
+    reports = [evaluate(variant.strip(), cases, args.llm, args.recordings) for variant in args.variants.split(",") if variant.strip()]
+
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+        return
+
+    for report in reports:
+        print_report(report, args.misroutes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Measure how long importing the API takes and keep a history of the results.
+
+Usage:
+    python scripts/profile_startup.py [--module app.main] [--top 15] [--history .startup_history.jsonl]
+
+Every run appends one JSON line to the history file and prints the change
+against the previous run, so a regression in startup cost shows up as soon
+as it lands.
+"""
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def profile_import(module: str):
+    env = {**os.environ, "PYTHONPATH": ROOT, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "profile")}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        # Self time is summed per top-level package, e.g. langchain_core.* -> langchain_core
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+
+    return wall_ms, packages
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--history", default=os.path.join(ROOT, ".startup_history.jsonl"))
+    args = parser.parse_args()
+
+    wall_ms, packages = profile_import(args.module)
+    top = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    record = {
+        "at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "module": args.module,
+        "wall_ms": round(wall_ms, 1),
+        "import_ms": round(sum(packages.values()) / 1000, 1),
+        "top": {name: round(us / 1000, 1) for name, us in top},
+    }
+
+    previous = None
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+        runs = [run for run in runs if run.get("module") == args.module]
+        previous = runs[-1] if runs else None
+
+    with open(args.history, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(f"import {args.module}: {record['import_ms']} ms imports, {record['wall_ms']} ms wall")
+    if previous:
+        delta = record["import_ms"] - previous["import_ms"]
+        print(f"  {delta:+.1f} ms since {previous.get('revision') or previous['at']}")
+    for name, ms in record["top"].items():
+        print(f"  {ms:>9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import threading
+import pytest
+from fastapi import HTTPException
+from app import admission
+from app.admission import TokenBucket, RateLimiter, ConcurrencyGate, GateRejected
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 1
+
+def test_rate_limiter_is_per_user():
+    limiter = RateLimiter(user_rate=1, user_burst=1, global_rate=0, global_burst=0)
+    assert limiter.check("a") is None
+    assert limiter.check("a")[0] == "user"
+    assert limiter.check("b") is None
+
+def test_global_rejection_leaves_the_user_tokens_alone():
+    limiter = RateLimiter(user_rate=0.01, user_burst=1, global_rate=0.01, global_burst=1)
+    assert limiter.check("other") is None
+    assert limiter.check("alice")[0] == "global"
+    limiter.global_bucket.tokens = 1
+    assert limiter.check("alice") is None
+
+def test_rate_limit_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "rate_limiter", RateLimiter(1, 1, 0, 0))
+    admission.check_rate_limit("user")
+    with pytest.raises(HTTPException) as e:
+        admission.check_rate_limit("user")
+    assert e.value.status_code == 429
+    assert int(e.value.headers["Retry-After"]) >= 1
+
+def test_gate_rejects_when_queue_is_full():
+    gate = ConcurrencyGate(limit=1, max_queue=0, timeout=1)
+    with gate.slot():
+        with pytest.raises(GateRejected) as e:
+            with gate.slot():
+                pass
+        assert e.value.reason == "queue_full"
+    assert gate.in_flight == 0
+
+def test_gate_queues_until_a_slot_frees_up():
+    gate = ConcurrencyGate(limit=1, max_queue=1, timeout=5)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with gate.slot():
+            entered.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait()
+    threading.Timer(0.1, release.set).start()
+
+    with gate.slot():
+        assert gate.in_flight == 1
+    holder.join()
@@ -0,0 +1,117 @@
+import json
+import pytest
+from datetime import date
+from app import analytics
+from app.analytics import DealAnalytics, period_range
+from app.resolver import CRMResolver
+from app.agents import crm_agent
+
+USERS = [{"Id": "u1", "DisplayName": "Ali Rezaei"}, {"Id": "u2", "FirstName": "Sara", "LastName": "Ahmadi"}]
+PIPELINE_ID = "0b6f2d4e-1c3a-4f5b-9e8d-7a6c5b4d3e2f"
+PIPELINES = [{"Id": PIPELINE_ID, "Title": "Sales", "Stages": [{"Id": "s1", "Title": "Lead"}, {"Id": "s2", "Title": "Offer"}]}]
+DEALS = [
+    {"Id": "d1", "Price": "1,000", "Status": "Pending", "PipelineStageId": "s1", "OwnerId": "u1", "RegisterTime": "2025-03-02T10:00:00"},
+    {"Id": "d2", "Price": 2500, "Status": "Pending", "PipelineStageId": "s2", "OwnerId": "u1", "RegisterTime": "2025-03-05T10:00:00"},
+    {"Id": "d3", "Price": 500, "Status": "Pending", "PipelineStageId": "s2", "OwnerId": "u2", "RegisterTime": "2025-02-20T10:00:00"},
+    {"Id": "d4", "Price": 4000, "Status": "Won", "PipelineStageId": "s2", "OwnerId": "u2", "RegisterTime": "2025-01-10", "ChangeToWonTime": "2025-03-10"},
+    {"Id": "d5", "Price": 700, "Status": "Won", "PipelineStageId": "s2", "OwnerId": "u2", "RegisterTime": "2025-01-11", "ChangeToWonTime": "2025-02-01"},
+    {"Id": "d6", "Price": 300, "Status": "Lost", "PipelineStageId": "s1", "OwnerId": "u1", "RegisterTime": None},
+]
+
+class PagedClient:
+    def __init__(self, deals):
+        self.deals = deals
+        self.pages = 0
+
+    def page_deals(self, offset, limit):
+        self.pages += 1
+        return self.deals[offset:offset + limit]
+
+    def fetch_users(self):
+        return USERS
+
+    def fetch_pipelines(self, num=0):
+        return PIPELINES
+
+def test_deals_are_paged_in_and_grouped_exactly(monkeypatch):
+    monkeypatch.setattr(analytics, "ANALYTICS_PAGE_SIZE", 4)
+    client = PagedClient(DEALS)
+    deal_analytics = DealAnalytics(client)
+
+    by_stage = deal_analytics.aggregate("stage", status="open")
+    assert by_stage["rows"] == [["Sales / Offer", 2, 3000.0, 1500.0], ["Sales / Lead", 1, 1000.0, 1000.0]]
+    assert by_stage["deals"] == 3 and by_stage["total_value"] == 4000.0
+
+    won = deal_analytics.aggregate("owner", status="won", date_field="closed", start=date(2025, 3, 1), end=date(2025, 3, 31))
+    assert won["rows"] == [["Sara Ahmadi", 1, 4000.0, 4000.0]]
+
+    by_month = deal_analytics.aggregate("month")
+    assert [row[:2] for row in by_month["rows"]] == [["(none)", 1], ["2025-01", 2], ["2025-02", 1], ["2025-03", 2]]
+
+    # One snapshot serves every question until it expires
+    assert client.pages == 2
+
+def test_deal_limit_is_reported(monkeypatch):
+    monkeypatch.setattr(analytics, "ANALYTICS_PAGE_SIZE", 2)
+    monkeypatch.setattr(analytics, "ANALYTICS_MAX_DEALS", 4)
+
+    result = DealAnalytics(PagedClient(DEALS)).aggregate("status")
+    assert result["deals"] == 4
+    assert "note" in result
+
+def test_periods_are_inclusive_day_ranges():
+    today = date(2025, 3, 15)
+    assert period_range("this_month", today) == (date(2025, 3, 1), today)
+    assert period_range("last_month", today) == (date(2025, 2, 1), date(2025, 2, 28))
+    assert period_range("this_quarter", today) == (date(2025, 1, 1), today)
+    with pytest.raises(ValueError):
+        period_range("someday", today)
+
+def test_agent_tool_takes_json_and_reports_bad_options(monkeypatch):
+    monkeypatch.setattr(crm_agent, "analytics", DealAnalytics(PagedClient(DEALS)))
+
+    result = json.loads(crm_agent.deal_analytics(f'```json\n{{"group_by": "pipeline", "pipeline": "{PIPELINE_ID}"}}\n```'))
+    assert result["data"]["rows"] == [["Sales", 6, 9000.0, 1500.0]]
+
+    assert "Unknown group" in json.loads(crm_agent.deal_analytics('{"group_by": "city"}'))["error"]
+    assert "Invalid input" in json.loads(crm_agent.deal_analytics("total deals"))["error"]
+
+def test_agent_tool_filters_on_a_pipeline_or_stage_name(monkeypatch):
+    client = PagedClient(DEALS)
+    monkeypatch.setattr(crm_agent, "analytics", DealAnalytics(client))
+    monkeypatch.setattr(crm_agent, "resolver", CRMResolver(client))
+
+    pipeline = json.loads(crm_agent.deal_analytics('{"group_by": "status", "pipeline": "Sales"}'))
+    assert pipeline["data"]["deals"] == 6
+
+    stage = json.loads(crm_agent.deal_analytics('{"group_by": "stage", "pipeline": "Sales Lead"}'))
+    assert stage["data"]["rows"] == [["Sales / Lead", 2, 1300.0, 650.0]]
+
+    unknown = json.loads(crm_agent.deal_analytics('{"pipeline": "0b6f2d4e-0000-4f5b-9e8d-7a6c5b4d3e2f"}'))
+    assert "Unknown pipeline or stage" in unknown["error"]
+
+def test_snapshots_load_in_the_background(monkeypatch):
+    import threading
+    monkeypatch.setattr(analytics, "FIRST_LOAD_WAIT", 0.1)
+    release = threading.Event()
+
+    class SlowClient(PagedClient):
+        def page_deals(self, offset, limit):
+            release.wait(5)
+            return super().page_deals(offset, limit)
+
+    deal_analytics = DealAnalytics(SlowClient(DEALS), ttl=0)
+    monkeypatch.setattr(crm_agent, "analytics", deal_analytics)
+
+    # The first question does not wait for the whole account
+    assert "still being loaded" in json.loads(crm_agent.deal_analytics('{"group_by": "status"}'))["error"]
+    loading = deal_analytics.refreshing
+    release.set()
+    loading.wait(5)
+    assert deal_analytics.aggregate("status")["deals"] == 6
+
+    # Once stale, the old snapshot answers while a new one loads
+    release.clear()
+    assert deal_analytics.aggregate("status")["deals"] == 6
+    assert deal_analytics.refreshing is not None
+    release.set()
@@ -73,4 +73,13 @@ def test_ui_routes():
 
     res = client.get("/chatbot")
     assert res.status_code == 200
-    assert "Chatbot Interface" in res.text
\ No newline at end of file
+    assert "Chatbot Interface" in res.text
+
+def test_health_and_readiness():
+    res = client.get("/health")
+    assert res.status_code == 200
+    assert res.json()["status"] is True
+
+    res = client.get("/ready")
+    assert res.status_code in (200, 503)
+    assert "checks" in res.json()
@@ -0,0 +1,71 @@
+import pytest
+from fastapi import HTTPException
+from datetime import datetime, timedelta
+from app import archive, sessions
+from app.agent import sessions_db
+from app.archive import archived_sessions_db
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    sessions_db.delete_many({"user_id": "archive-user"})
+    archived_sessions_db.delete_many({"user_id": "archive-user"})
+    yield
+    sessions_db.delete_many({"user_id": "archive-user"})
+    archived_sessions_db.delete_many({"user_id": "archive-user"})
+
+def test_history_compression_round_trip():
+    history = [["سلام", "درود، چطور می‌توانم کمک کنم؟"]] * 50
+    blob = archive.compress_history(history)
+    assert len(blob) < len(str(history).encode())
+    assert archive.decompress_history(blob) == history
+
+def test_idle_session_is_archived_and_rehydrated():
+    sessions.save_turn("idle-session", "archive-user", None, [["hi", "hello"]])
+    sessions.save_turn("active-session", "archive-user", None, [["hi", "hello"]])
+    sessions_db.update_one(
+        {"session_id": "idle-session"},
+        {"$set": {"updated_at": datetime.utcnow() - timedelta(days=archive.ARCHIVE_AFTER_DAYS + 1)}}
+    )
+
+    assert archive.archive_idle_sessions() == 1
+    assert sessions_db.find_one({"session_id": "idle-session"}) is None
+    assert sessions_db.find_one({"session_id": "active-session"}) is not None
+    assert "chat_history" not in archived_sessions_db.find_one({"session_id": "idle-session"})
+
+    session = sessions.load_session("idle-session", "archive-user")
+    assert session["chat_history"] == [["hi", "hello"]]
+    assert sessions_db.find_one({"session_id": "idle-session"}) is not None
+    assert archived_sessions_db.find_one({"session_id": "idle-session"}) is None
+
+def test_only_the_owner_rehydrates_an_archived_session():
+    sessions.save_turn("owned-session", "archive-user", None, [["hi", "hello"]])
+    archive.archive_session(sessions_db.find_one({"session_id": "owned-session"}), datetime.utcnow())
+
+    with pytest.raises(HTTPException) as e:
+        sessions.load_session("owned-session", "someone-else")
+    assert e.value.status_code == 403
+    assert archived_sessions_db.find_one({"session_id": "owned-session"}) is not None
+    assert sessions_db.find_one({"session_id": "owned-session"}) is None
+
+def test_archived_sessions_are_listed_without_their_history(monkeypatch):
+    sessions.save_turn("listed-session", "archive-user", None, [["What are my open deals?", "Three."], ["And won?", "Two."]])
+    archive.archive_session(sessions_db.find_one({"session_id": "listed-session"}), datetime.utcnow())
+    monkeypatch.setattr(archive, "decompress_history", lambda blob: pytest.fail("Listing must not decompress"))
+
+    listed = archive.list_archived_sessions("archive-user")
+    assert [(item["session_id"], item["title"], item["turns"], item["archived"]) for item in listed] == [
+        ("listed-session", "What are my open deals?", 2, True)
+    ]
+    assert "history_zstd" not in listed[0] and "chat_history" not in listed[0]
+
+def test_a_turn_saved_after_its_session_was_archived_keeps_the_history():
+    sessions.save_turn("racing-session", "archive-user", None, [["hi", "hello"]])
+    session = sessions.load_session("racing-session", "archive-user")
+    archive.archive_session(sessions_db.find_one({"session_id": "racing-session"}), datetime.utcnow())
+
+    version = sessions.save_turn("racing-session", "archive-user", session, [["hi", "hello"], ["again", "sure"]])
+
+    saved = sessions_db.find_one({"session_id": "racing-session"})
+    assert saved["chat_history"] == [["hi", "hello"], ["again", "sure"]]
+    assert version == 2
+    assert archived_sessions_db.find_one({"session_id": "racing-session"}) is None
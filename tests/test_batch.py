@@ -0,0 +1,73 @@
+from app.batch import plan_waves
+
+def test_items_of_one_session_run_in_order_across_waves():
+    items = [
+        {"query": "a1", "session_id": "a"},
+        {"query": "b1", "session_id": "b"},
+        {"query": "a2", "session_id": "a"},
+        {"query": "x", "session_id": None},
+        {"query": "a3", "session_id": "a"},
+    ]
+
+    waves = plan_waves(items)
+
+    assert [[question for _, _, question in wave] for wave in waves] == [["a1", "b1", "x"], ["a2"], ["a3"]]
+    assert waves[0][2][1] not in ("a", "b")
+
+def test_items_without_session_all_run_in_the_first_wave():
+    waves = plan_waves([{"query": str(i), "session_id": None} for i in range(10)])
+    assert len(waves) == 1
+    assert len({session_id for _, session_id, _ in waves[0]}) == 10
+
+def test_items_take_graph_slots_and_session_locks(monkeypatch):
+    import time
+    from app import admission, batch, sessions, turns
+    from app.agent import sessions_db
+
+    class SlowGraph:
+        def invoke(self, state, config=None):
+            time.sleep(0.3)
+            return {"agent": "crm-agent", "answer": "ok", "chat_history": [*state["chat_history"], [state["question"], "ok"]]}
+
+    monkeypatch.setattr(turns, "get_graph", lambda: SlowGraph())
+    monkeypatch.setattr(turns, "match_command", lambda question: None)
+    monkeypatch.setattr(admission, "graph_gate", admission.ConcurrencyGate(1, 0, 1))
+    monkeypatch.setattr(sessions, "LOCK_ENABLED", True)
+    monkeypatch.setattr(sessions, "LOCK_WAIT", 0.1)
+    user = {"_id": "batch-test-user", "username": "batch-tester"}
+    items = [{"query": "q1", "session_id": "batch-locked"}, {"query": "q2", "session_id": "batch-free"}, {"query": "q3", "session_id": "batch-busy"}]
+
+    try:
+        with sessions.session_lock("batch-locked"):
+            results = {result.get("session_id"): result for result in batch.run_batch(user, items, 4)}
+    finally:
+        sessions_db.delete_many({"user_id": "batch-test-user"})
+
+    assert results["batch-locked"]["status"] == 409
+    # The gate admits one graph run and queues none, so the other item is turned away
+    assert sorted(results[session].get("status", 200) for session in ("batch-free", "batch-busy")) == [200, 429]
+    assert results[None]["failed"] == 2
+
+def test_queued_items_get_their_budget_when_they_start(monkeypatch):
+    import time
+    from app import batch, deadline, turns
+    from app.agent import sessions_db
+
+    class Graph:
+        def invoke(self, state, config=None):
+            time.sleep(0.3)
+            return {"agent": "crm-agent", "answer": "ok", "chat_history": [[state["question"], "ok"]]}
+
+    monkeypatch.setattr(turns, "get_graph", lambda: Graph())
+    monkeypatch.setattr(turns, "match_command", lambda question: None)
+    monkeypatch.setattr(batch, "Deadline", lambda: deadline.Deadline(1.0))
+    user = {"_id": "batch-test-user", "username": "batch-tester"}
+
+    try:
+        results = list(batch.run_batch(user, [{"query": f"q{i}", "session_id": None} for i in range(5)], 1))
+    finally:
+        sessions_db.delete_many({"user_id": "batch-test-user"})
+
+    # Five items at 0.3s run one after another for longer than one item's budget
+    assert [result.get("response") for result in results[:-1]] == ["ok"] * 5
+    assert results[-1]["failed"] == 0
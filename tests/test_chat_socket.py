@@ -0,0 +1,35 @@
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+from app import chat_socket
+
+USER = {"_id": "socket-test-user", "username": "socket-tester"}
+
+@pytest.fixture()
+def client(monkeypatch):
+    monkeypatch.setattr(chat_socket, "verify_token", lambda token: USER if token == "good" else None)
+    monkeypatch.setattr(chat_socket, "load_session", lambda session_id, user_id: None)
+
+    app = FastAPI()
+
+    @app.websocket("/ws/chat")
+    async def socket(websocket: WebSocket, token: str = None):
+        await chat_socket.serve_chat(websocket, token, "socket-session")
+
+    return TestClient(app)
+
+def test_messages_that_are_not_objects_get_an_error_event(client):
+    with client.websocket_connect("/ws/chat?token=good") as websocket:
+        assert websocket.receive_json()["type"] == "ready"
+        for message in ("[1, 2]", '"ask"', "42", "null", '{"type": "ask", "query": 5}'):
+            websocket.send_text(message)
+            event = websocket.receive_json()
+            assert event["type"] == "error" and event["status"] == 400
+
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+def test_auth_message_that_is_not_an_object_is_refused(client):
+    with client.websocket_connect("/ws/chat") as websocket:
+        websocket.send_text('["auth", "good"]')
+        assert websocket.receive_json() == {"type": "error", "status": 400, "detail": "Messages must be JSON objects"}
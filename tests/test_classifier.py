@@ -0,0 +1,28 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.classifier import classifier_node, classifier_prompt, classify, guess_agent, parse_label
+
+def test_parse_label_defaults_to_unknown():
+    assert parse_label(" CRM-Agent\n") == "crm-agent"
+    assert parse_label("I think crm") == "unknown"
+
+def test_classify_routes_on_the_llm_answer():
+    llm = FakeListChatModel(responses=["crm-agent"])
+    assert classify("What about his email?", [("Find Ali", "Found Ali")], llm) == "crm-agent"
+
+def test_classifier_node_only_returns_the_route(monkeypatch):
+    monkeypatch.setattr("app.classifier.chat_model", lambda node, purpose, **kwargs: FakeListChatModel(responses=["unknown"]))
+    assert classifier_node({"question": "hi", "chat_history": [("a", "b")], "session_id": "s"}) == {"agent": "unknown"}
+
+def test_guess_agent():
+    assert guess_agent("Show my open deals") == "crm-agent"
+    assert guess_agent("مخاطب علی را پیدا کن") == "crm-agent"
+    assert guess_agent("Tell me a joke") == "unknown"
+
+def test_prompt_includes_summary_and_last_turn_only_with_history():
+    assert "summary" not in classifier_prompt("hi", [], "ignored")
+
+    prompt = classifier_prompt("And his email?", [("Find Ali", "Found Ali")], "They asked about Ali.")
+    assert "They asked about Ali." in prompt
+    assert "'Find Ali'" in prompt
+
+    assert "summary" not in classifier_prompt("And his email?", [("Find Ali", "Found Ali")])
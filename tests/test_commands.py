@@ -0,0 +1,81 @@
+import pytest
+from app import commands
+from app.agent import sessions_db
+from app.commands import match_command, run_command, COMMAND_AGENT
+from app.turns import run_turn
+
+USER = {"_id": "command-test-user", "username": "command-tester"}
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    sessions_db.delete_many({"user_id": "command-test-user"})
+    yield
+    sessions_db.delete_many({"user_id": "command-test-user"})
+
+class FakeClient:
+    def fetch_users(self):
+        return [{"Id": "u1", "DisplayName": "Ali Rezaei", "Email": "ali@example.com"}]
+
+    def fetch_products(self):
+        return [{"Id": f"p{i}", "Title": f"Lamp {i}", "UnitPrice": 10} for i in range(3)]
+
+    def fetch_search(self, kind, query):
+        return None
+
+    def fetch_cards(self, owner_id, num=10):
+        return [{"Id": "c1", "Title": f"Call back {owner_id}"}]
+
+class FakeResolver:
+    def resolve(self, kind, query):
+        candidates = [{"id": "u1", "name": "Ali Rezaei", "score": 0.85}, {"id": "u2", "name": "Alireza Karimi", "score": 0.85}]
+        if query == "Ali Rezaei":
+            return {"query": query, "match": candidates[0], "candidates": candidates[:1]}
+        return {"query": query, "match": None, "candidates": candidates}
+
+def test_grammar_matches_slash_english_and_persian_commands():
+    assert match_command("/users") == ("users", "")
+    assert match_command("  List   Products ") == ("products", "")
+    assert match_command("لیست كاربران") == ("users", "")
+    assert match_command("جست‌وجوی مشتری 0912 345 6789") == ("contact", "0912 345 6789")
+    assert match_command("کارت‌های علی رضایی") == ("cards", "علی رضایی")
+    assert match_command("list cards of Ali Rezaei") == ("cards", "Ali Rezaei")
+    assert match_command("find contact ali@example.com") == ("contact", "ali@example.com")
+
+def test_questions_are_left_to_the_agent():
+    assert match_command("list products under 100 dollars") is None
+    assert match_command("search contact") is None
+    assert match_command("/unknown") is None
+    assert match_command("Which users closed deals today?") is None
+    assert match_command("find deal with the highest value this month") is None
+    assert match_command("search contact who bought the most") is None
+    assert match_command("cards of Ali that are overdue") is None
+    assert match_command("کارت های امروز من چیست؟") is None
+    assert match_command("/deal with the highest value") == ("deal", "with the highest value")
+
+def test_answers_are_rendered_locally(monkeypatch):
+    monkeypatch.setattr(commands, "COMMAND_MAX_ROWS", 2)
+    client, resolver = FakeClient(), FakeResolver()
+
+    products = run_command("products", "", "list products", client, resolver)
+    assert products.splitlines()[2:] == ["- Lamp 0 (UnitPrice: 10) `p0`", "- Lamp 1 (UnitPrice: 10) `p1`", "- … and 1 more"]
+
+    assert "ali@example.com" in run_command("users", "", "/users", client, resolver)
+    assert run_command("company", "Acme", "/company Acme", client, resolver) == commands.TEXTS["en"]["failed"]
+    assert run_command("contact", "", "/contact", client, resolver).startswith("This command needs")
+    assert "Call back u1" in run_command("cards", "Ali Rezaei", "/cards Ali Rezaei", client, resolver)
+    assert "`u2`" in run_command("cards", "Ali", "/cards Ali", client, resolver)
+    assert run_command("users", "", "لیست کاربران", client, resolver).startswith("**کاربران**")
+
+def test_command_turns_skip_the_graph_and_are_saved(monkeypatch):
+    from app.agents import crm_agent
+    monkeypatch.setattr(crm_agent, "crm_client", FakeClient())
+
+    def graph(state, config):
+        raise AssertionError("The graph must not run for a command")
+
+    result = run_turn(USER, "/products", "command-session", execute=graph)
+
+    assert result["agent"] == COMMAND_AGENT
+    assert "Lamp 0" in result["response"]
+    saved = sessions_db.find_one({"session_id": "command-session"})
+    assert saved["chat_history"] == [["/products", result["response"]]]
@@ -0,0 +1,71 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from typing import Any, Optional
+from app import history, model_policy
+from app.agents import crm_agent
+
+FINAL_ANSWER = '```json\n{"action": "Final Answer", "action_input": "done"}\n```'
+
+calls = []
+
+class RecordingChatModel(BaseChatModel):
+    model: str = ""
+    temperature: float = 0
+    timeout: Optional[float] = None
+    max_retries: int = 0
+    deadline: Any = None
+
+    @property
+    def _llm_type(self):
+        return "recording"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        purpose = self.metadata["purpose"]
+        calls.append((purpose, messages))
+        content = "They asked about {Ali}." if purpose == "summarize" else FINAL_ANSWER
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+def run_node(monkeypatch, chat_history):
+    calls.clear()
+    monkeypatch.setattr(model_policy, "DeadlineChatOpenAI", RecordingChatModel)
+    state = crm_agent.crm_agent_node({"question": "What about his email?", "chat_history": chat_history})
+    return state, calls
+
+def test_short_history_is_passed_as_messages_without_summarizing(monkeypatch):
+    state, calls = run_node(monkeypatch, [("Find Ali", "Found Ali")])
+
+    assert state["answer"] == "done"
+    assert state["chat_history"] == [("Find Ali", "Found Ali"), ("What about his email?", "done")]
+    assert [purpose for purpose, _ in calls] == ["answer"]
+    messages = calls[0][1]
+    assert [message.content for message in messages[1:3]] == ["Find Ali", "Found Ali"]
+    assert messages[-1].content.endswith("What about his email?")
+
+def test_summary_from_the_history_node_is_reused(monkeypatch):
+    calls.clear()
+    monkeypatch.setattr(model_policy, "DeadlineChatOpenAI", RecordingChatModel)
+    monkeypatch.setattr(history, "HISTORY_TURNS", 1)
+
+    crm_agent.crm_agent_node({
+        "question": "And his phone?",
+        "chat_history": [("Find Ali", "Found Ali"), ("His email?", "ali@example.com")],
+        "history_summary": "They looked up Ali."
+    })
+
+    assert [purpose for purpose, _ in calls] == ["answer"]
+    assert "They looked up Ali." in calls[0][1][0].content
+
+def test_only_turns_outside_the_window_are_summarized(monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_TURNS", 2)
+    chat_history = [(f"question {i}", f"answer {i}") for i in range(5)]
+
+    _, calls = run_node(monkeypatch, chat_history)
+
+    assert [purpose for purpose, _ in calls] == ["summarize", "answer"]
+    assert [message.content for message in calls[0][1][1:]] == [
+        "question 0", "answer 0", "question 1", "answer 1", "question 2", "answer 2"
+    ]
+    answer_messages = calls[1][1]
+    assert "They asked about {Ali}." in answer_messages[0].content
+    assert [message.content for message in answer_messages[1:5]] == ["question 3", "answer 3", "question 4", "answer 4"]
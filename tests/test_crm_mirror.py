@@ -0,0 +1,73 @@
+import pytest
+from app import crm_mirror
+
+class FakeCRMClient:
+    def __init__(self, contacts):
+        self.contacts = contacts
+
+    def page_contacts(self, offset, limit):
+        return self.contacts[offset:offset + limit]
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    crm_mirror.mirror_db.mirror_contact.delete_many({})
+    crm_mirror.mirror_db.mirror_state.delete_many({"kind": "contact"})
+    crm_mirror.ensure_indexes()
+    yield
+    crm_mirror.mirror_db.mirror_contact.delete_many({})
+    crm_mirror.mirror_db.mirror_state.delete_many({"kind": "contact"})
+
+def test_passes_write_changes_and_drop_deleted_records(monkeypatch):
+    monkeypatch.setattr(crm_mirror, "PAGE_SIZE", 2)
+    client = FakeCRMClient([{"Id": str(i), "DisplayName": f"contact{i}"} for i in range(5)])
+
+    assert crm_mirror.sync_kind(client, "contact") == 5
+    assert crm_mirror.sync_kind(client, "contact") == 0
+
+    client.contacts[0]["DisplayName"] = "renamed"
+    assert crm_mirror.sync_kind(client, "contact") == 1
+
+    # A change on a later page is found even when the first pages are unchanged
+    client.contacts[4]["DisplayName"] = "renamed"
+    assert crm_mirror.sync_kind(client, "contact") == 1
+
+    client.contacts = client.contacts[:3]
+    crm_mirror.sync_kind(client, "contact")
+    assert crm_mirror.mirror_db.mirror_contact.count_documents({}) == 3
+
+def test_failed_or_empty_passes_keep_the_mirror(monkeypatch):
+    from app.crm_client import CRMClient
+    client = FakeCRMClient([{"Id": str(i), "DisplayName": f"contact{i}"} for i in range(3)])
+    crm_mirror.sync_kind(client, "contact")
+
+    assert CRMClient._items(None, {"Message": "Unauthorized"}) is None
+    assert CRMClient._items(None, {"List": None}) == []
+
+    client.page_contacts = lambda offset, limit: CRMClient._items(None, {"Message": "Unauthorized"})
+    with pytest.raises(RuntimeError):
+        crm_mirror.sync_kind(client, "contact")
+
+    client.contacts = []
+    del client.page_contacts
+    crm_mirror.sync_kind(client, "contact")
+    assert crm_mirror.mirror_db.mirror_contact.count_documents({}) == 3
+
+def test_a_pass_stops_when_its_lease_is_lost(monkeypatch):
+    monkeypatch.setattr(crm_mirror, "PAGE_SIZE", 2)
+    client = FakeCRMClient([{"Id": str(i), "DisplayName": f"contact{i}"} for i in range(5)])
+    renewals = iter([True, False])
+
+    with pytest.raises(crm_mirror.LeaseLost):
+        crm_mirror.sync_kind(client, "contact", renew=lambda: next(renewals))
+    assert crm_mirror.mirror_db.mirror_contact.count_documents({}) == 2
+
+def test_search_reports_freshness():
+    client = FakeCRMClient([{"Id": "1", "DisplayName": "Ali Rezaei", "MobilePhone": "09120000000"}])
+    crm_mirror.sync_kind(client, "contact")
+
+    result = crm_mirror.search("contact", "09120000000")
+    assert result["data"][0]["Id"] == "1"
+    assert "_hash" not in result["data"][0]
+    assert result["freshness"]["source"] == "mirror"
+
+    assert crm_mirror.search("contact", "nobody") is None
@@ -0,0 +1,100 @@
+import pytest
+from fastapi import HTTPException
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from typing import Any, Optional
+from app import model_policy
+from app.agents import crm_agent
+from app.crm_client import CRMClient, CRM_TIMEOUT
+from app.deadline import Deadline, DeadlineExceeded, deadline_scope, request_deadline, call_timeout, REQUEST_DEADLINE_MAX
+
+SEARCH = '```json\n{"action": "Search for a Product", "action_input": "lamp"}\n```'
+FINAL_ANSWER = '```json\n{"action": "Final Answer", "action_input": "done"}\n```'
+
+class ScriptedChatModel(BaseChatModel):
+    model: str = ""
+    temperature: float = 0
+    timeout: Optional[float] = None
+    max_retries: int = 0
+    deadline: Any = None
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Checks the budget before "sending" like DeadlineChatOpenAI does
+        call_timeout(self.timeout, self.deadline)
+        content = FINAL_ANSWER if "TOOL RESPONSE" in str(messages[-1].content) else SEARCH
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+class SlowCRMClient:
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def search_product(self, query):
+        # Uses up the rest of the budget
+        self.deadline.expires_at = 0
+        return "[{'Title': 'Desk lamp'}]"
+
+class FakeHTTP:
+    def __init__(self):
+        self.timeouts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.timeouts.append(timeout)
+        raise ConnectionError()
+
+def test_calls_get_what_is_left_of_the_budget():
+    deadline = Deadline(5)
+    assert call_timeout(10, deadline) <= 5
+    assert call_timeout(2, deadline) == 2
+    assert call_timeout(10) == 10
+
+    deadline.cancel()
+    with pytest.raises(DeadlineExceeded):
+        call_timeout(10, deadline)
+
+def test_request_timeout_is_validated_and_capped():
+    assert request_deadline(str(REQUEST_DEADLINE_MAX * 2)).seconds == REQUEST_DEADLINE_MAX
+    assert request_deadline("3").seconds == 3
+    for value in ("soon", "-1"):
+        with pytest.raises(HTTPException) as e:
+            request_deadline(value)
+        assert e.value.status_code == 400
+
+def test_crm_calls_are_bounded_by_the_deadline_in_scope():
+    client = CRMClient(api_key="key")
+    client._client, client._client_pid = FakeHTTP(), __import__("os").getpid()
+
+    client.list_users()
+    with deadline_scope(Deadline(3)):
+        client.list_users()
+    assert client._client.timeouts[0] == CRM_TIMEOUT
+    assert client._client.timeouts[1] <= 3
+
+    deadline = Deadline(3)
+    deadline.cancel()
+    with deadline_scope(deadline), pytest.raises(DeadlineExceeded):
+        client.list_users()
+    assert len(client._client.timeouts) == 2
+
+def test_react_loop_returns_what_it_found_when_time_runs_out(monkeypatch):
+    deadline = Deadline(30)
+    monkeypatch.setattr(model_policy, "DeadlineChatOpenAI", ScriptedChatModel)
+    monkeypatch.setattr(crm_agent, "crm_client", SlowCRMClient(deadline))
+
+    state = crm_agent.crm_agent_node({"question": "Find the lamp", "chat_history": [], "deadline": deadline})
+
+    assert state["answer"].startswith(crm_agent.PARTIAL_ANSWER)
+    assert "Desk lamp" in state["answer"]
+    assert state["chat_history"] == [("Find the lamp", state["answer"])]
+
+def test_cancelled_turns_are_not_answered(monkeypatch):
+    deadline = Deadline(30)
+    deadline.cancel()
+    monkeypatch.setattr(model_policy, "DeadlineChatOpenAI", ScriptedChatModel)
+
+    with pytest.raises(DeadlineExceeded):
+        crm_agent.crm_agent_node({"question": "Find the lamp", "chat_history": [], "deadline": deadline})
@@ -0,0 +1,22 @@
+import pytest
+from app.deployment import check_worker_settings
+
+def test_multiple_workers_require_shared_key(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.delenv("AUTH_SECRET_KEY", raising=False)
+    monkeypatch.delenv("AUTH_SECRET_KEY_FILE", raising=False)
+    monkeypatch.setenv("AUTH_SHARED_SECRET", "false")
+
+    with pytest.raises(RuntimeError):
+        check_worker_settings()
+
+    monkeypatch.setenv("AUTH_SECRET_KEY", "a-shared-key")
+    check_worker_settings()
+
+def test_single_worker_allows_random_key(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    monkeypatch.delenv("AUTH_SECRET_KEY", raising=False)
+    monkeypatch.delenv("AUTH_SECRET_KEY_FILE", raising=False)
+    monkeypatch.setenv("AUTH_SHARED_SECRET", "false")
+
+    check_worker_settings()
@@ -0,0 +1,65 @@
+import json
+import pytest
+from datetime import date, datetime
+from fastapi import HTTPException
+from app import export
+from app.agent import sessions_db
+from app.archive import archived_sessions_db, archive_session
+
+USER_ID = "export-test-user"
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    sessions_db.delete_many({"user_id": USER_ID})
+    archived_sessions_db.delete_many({"user_id": USER_ID})
+    yield
+    sessions_db.delete_many({"user_id": USER_ID})
+    archived_sessions_db.delete_many({"user_id": USER_ID})
+
+def add_sessions(count: int, updated_at: datetime = datetime(2025, 1, 10)):
+    for index in range(count):
+        sessions_db.insert_one({
+            "session_id": f"export-{index}",
+            "user_id": USER_ID,
+            "chat_history": [[f"question {index}", f"answer {index}"], ["again", "sure"]],
+            "version": 2,
+            "created_at": updated_at,
+            "updated_at": updated_at
+        })
+
+def read(chunks) -> list:
+    return [json.loads(line) for chunk in chunks for line in chunk.decode().splitlines()]
+
+def test_sessions_stream_in_batches_with_resumable_cursors(monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 2)
+    add_sessions(5)
+
+    chunks = list(export.export_sessions(USER_ID))
+    assert len(chunks) == 4
+    lines = read(chunks)
+    assert [line["type"] for line in lines].count("cursor") == 3
+    assert lines[-1] == {"type": "done", "sessions": 5, "turns": 10}
+
+    cursor = [line["cursor"] for line in lines if line["type"] == "cursor"][0]
+    resumed = read(export.export_sessions(USER_ID, cursor=cursor))
+    assert [line["session_id"] for line in resumed if line["type"] == "session"] == ["export-2", "export-3", "export-4"]
+
+def test_turns_include_archived_sessions_and_respect_the_date_range():
+    add_sessions(2)
+    session = sessions_db.find_one({"session_id": "export-1"})
+    archive_session(session, datetime(2025, 2, 1))
+
+    lines = read(export.export_sessions(USER_ID, unit="turn"))
+    turns = [line for line in lines if line["type"] == "turn"]
+    assert [(line["session_id"], line["turn"], line["archived"]) for line in turns] == [
+        ("export-0", 0, False), ("export-0", 1, False), ("export-1", 0, True), ("export-1", 1, True)
+    ]
+    assert turns[2]["question"] == "question 1"
+
+    assert read(export.export_sessions(USER_ID, start=date(2025, 1, 11)))[-1]["sessions"] == 0
+    assert read(export.export_sessions(USER_ID, archived=False))[-1]["sessions"] == 1
+
+def test_bad_cursors_fail_before_streaming():
+    with pytest.raises(HTTPException) as e:
+        export.export_sessions(USER_ID, cursor="not-a-cursor")
+    assert e.value.status_code == 400
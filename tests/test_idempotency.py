@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.idempotency import idempotency_db, run_once, fingerprint
+
+USER_ID = "idempotency-test-user"
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    idempotency_db.delete_many({"_id": {"$regex": f"^{USER_ID}"}})
+    yield
+    idempotency_db.delete_many({"_id": {"$regex": f"^{USER_ID}"}})
+
+class Turn:
+    def __init__(self, delay: float = 0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.runs = 0
+
+    async def __call__(self):
+        self.runs += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise HTTPException(status_code=500, detail="boom")
+        return {"agent": "crm-agent", "response": f"answer {self.runs}", "session_id": "s1"}
+
+def test_retries_replay_the_stored_result():
+    turn = Turn()
+
+    async def main():
+        first = await run_once(USER_ID, "key-1", fingerprint("hi", None), turn, 5)
+        second = await run_once(USER_ID, "key-1", fingerprint("hi", None), turn, 5)
+        other_user = await run_once(f"{USER_ID}-2", "key-1", fingerprint("hi", None), turn, 5)
+        return first, second, other_user
+
+    first, second, other_user = asyncio.run(main())
+    assert first == ({"agent": "crm-agent", "response": "answer 1", "session_id": "s1"}, False)
+    assert second == (first[0], True)
+    assert other_user[0]["response"] == "answer 2"
+    idempotency_db.delete_many({"_id": {"$regex": f"^{USER_ID}-2"}})
+
+def test_concurrent_retries_wait_for_the_running_turn():
+    turn = Turn(delay=0.3)
+
+    async def main():
+        return await asyncio.gather(*[run_once(USER_ID, "key-2", fingerprint("hi", None), turn, 5) for _ in range(3)])
+
+    results = asyncio.run(main())
+    assert turn.runs == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+    assert all(result == results[0][0] for result, _ in results)
+
+def test_failed_turns_are_not_stored_and_reused_keys_must_match():
+    failing = Turn(fail=True)
+
+    async def main():
+        with pytest.raises(HTTPException):
+            await run_once(USER_ID, "key-3", fingerprint("hi", None), failing, 5)
+        result = await run_once(USER_ID, "key-3", fingerprint("hi", None), Turn(), 5)
+        with pytest.raises(HTTPException) as e:
+            await run_once(USER_ID, "key-3", fingerprint("something else", None), Turn(), 5)
+        return result, e.value.status_code
+
+    result, status = asyncio.run(main())
+    assert result[1] is False
+    assert status == 422
+
+def test_a_retry_gives_up_when_its_own_budget_runs_out():
+    async def main():
+        slow = asyncio.ensure_future(run_once(USER_ID, "key-4", fingerprint("hi", None), Turn(delay=1), 5))
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as e:
+            await run_once(USER_ID, "key-4", fingerprint("hi", None), Turn(), 0.2)
+        await slow
+        return e.value.status_code
+
+    assert asyncio.run(main()) == 409
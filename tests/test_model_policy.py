@@ -0,0 +1,37 @@
+import pytest
+from app import model_policy
+from app.model_policy import LatencyTracker
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = LatencyTracker(window=60, min_samples=3)
+    monkeypatch.setattr(model_policy, "latency_tracker", tracker)
+    return tracker
+
+def test_p95_needs_enough_recent_samples():
+    tracker = LatencyTracker(window=60, min_samples=3)
+    key = ("classify.classify", "gpt-3.5-turbo")
+
+    tracker.record(key, 1.0, now=0)
+    tracker.record(key, 2.0, now=1)
+    assert tracker.p95(key, now=2) is None
+
+    tracker.record(key, 3.0, now=2)
+    assert tracker.p95(key, now=2) == 3.0
+    assert tracker.p95(key, now=61) is None
+
+def test_switches_to_fallback_while_primary_is_slow(tracker):
+    entry = model_policy.policy_for("classify", "classify")
+    key = ("classify.classify", entry["model"])
+
+    for _ in range(3):
+        tracker.record(key, entry["p95_ms"] / 1000 / 2)
+    assert model_policy.select_model("classify", "classify") == entry["model"]
+
+    for _ in range(3):
+        tracker.record(key, entry["p95_ms"] / 1000 * 2)
+    assert model_policy.select_model("classify", "classify") == entry["fallback"]
+
+def test_nodes_without_an_entry_use_the_purpose_wide_one():
+    assert model_policy.policy_key("history", "summarize") == "*.summarize"
+    assert model_policy.policy_key("classify", "classify") == "classify.classify"
@@ -0,0 +1,56 @@
+import pytest
+import time
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from app.profiling import profiles_db, request_profile, get_profile, list_profiles, folded, PROFILE_HEADER
+
+ADMIN = {"username": "profile-admin", "permission": "admin"}
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    profiles_db.delete_many({"username": "profile-admin"})
+    yield
+    profiles_db.delete_many({"username": "profile-admin"})
+
+def busy_turn(callbacks=None):
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content="ok")]), metadata={"purpose": "answer"})
+    llm.invoke("hi", config={"callbacks": callbacks})
+    until = time.perf_counter() + 0.1
+    while time.perf_counter() < until:
+        sum(range(1000))
+    return "done"
+
+def test_only_admins_asking_for_it_are_profiled():
+    assert request_profile({}, ADMIN, "/ask") is None
+    assert request_profile({PROFILE_HEADER: "1"}, {"username": "someone", "permission": "user"}, "/ask") is None
+    assert request_profile({PROFILE_HEADER: "1"}, ADMIN, "/ask") is not None
+    assert request_profile({PROFILE_HEADER: "True"}, ADMIN, "/ask") is not None
+    for value in ("0", "false", "no", ""):
+        assert request_profile({PROFILE_HEADER: value}, ADMIN, "/ask") is None
+
+def test_profile_is_stored_with_samples_and_spans():
+    profile = request_profile({PROFILE_HEADER: "1"}, ADMIN, "/ask", "hi")
+
+    assert profile.wrap(busy_turn)(callbacks=[profile.spans]) == "done"
+
+    stored = get_profile(profile.profile_id)
+    assert stored["samples"] > 0
+    assert stored["breakdown"]["cpu"] > 0
+    assert [span["kind"] for span in stored["spans"]] == ["llm"]
+    assert stored["spans"][0]["name"] == "answer"
+    assert any("busy_turn" in line for line in folded(stored).splitlines())
+    assert "stacks" not in list_profiles()[0]
+
+def test_a_profile_too_large_to_store_does_not_fail_the_turn(monkeypatch):
+    from bson.errors import InvalidDocument
+    from app import profiling
+
+    class FullCollection:
+        def insert_one(self, document):
+            raise InvalidDocument("BSON document too large")
+
+    monkeypatch.setattr(profiling, "profiles_db", FullCollection())
+    profile = request_profile({PROFILE_HEADER: "1"}, ADMIN, "/ask", "hi")
+
+    assert profile.wrap(busy_turn)() == "done"
+    assert profile.saved is False
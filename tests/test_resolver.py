@@ -0,0 +1,107 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from typing import Any, Optional
+from app import model_policy
+from app.agents import crm_agent
+from app.resolver import CRMResolver, NameIndex, normalize
+
+ALI_ID = "0b1c2d3e-0000-4000-8000-000000000001"
+USERS = [
+    {"Id": ALI_ID, "DisplayName": "Ali Rezaei", "Email": "ali@example.com"},
+    {"Id": "0b1c2d3e-0000-4000-8000-000000000002", "FirstName": "Alireza", "LastName": "Karimi"},
+    {"Id": "0b1c2d3e-0000-4000-8000-000000000003", "DisplayName": "سارا احمدی"},
+]
+PIPELINES = [
+    {"Id": "p1", "Title": "Sales", "Stages": [{"Id": "s1", "Title": "Won"}, {"Id": "s2", "Title": "Lead"}]},
+    {"Id": "p2", "Title": "Support", "Stages": [{"Id": "s3", "Title": "Open"}]},
+]
+
+scripted_calls = []
+
+class FakeCRMClient:
+    def __init__(self):
+        self.fetches = 0
+        self.cards_of = []
+
+    def fetch_users(self):
+        self.fetches += 1
+        return USERS
+
+    def fetch_pipelines(self):
+        return PIPELINES
+
+    def get_cards(self, owner_id):
+        self.cards_of.append(owner_id)
+        return "[{'Title': 'Call back'}]"
+
+class ScriptedChatModel(BaseChatModel):
+    model: str = ""
+    temperature: float = 0
+    timeout: Optional[float] = None
+    max_retries: int = 0
+    deadline: Any = None
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if "TOOL RESPONSE" in str(messages[-1].content):
+            content = '```json\n{"action": "Final Answer", "action_input": "done"}\n```'
+        else:
+            content = '```json\n{"action": "Fetch a list of an Owner\'s Cards", "action_input": "Ali"}\n```'
+        scripted_calls.append(content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+def test_names_are_normalized_across_scripts():
+    assert normalize("علي  رضايي") == normalize("علی رضایی")
+    assert normalize("۱۲۳") == "123"
+    assert normalize("Ali-Rezaei!") == "ali rezaei"
+
+def test_matching_prefers_whole_names_and_tolerates_typos():
+    index = NameIndex([
+        {"id": "1", "kind": "user", "name": "Ali Rezaei", "names": ["Ali Rezaei"]},
+        {"id": "2", "kind": "user", "name": "Alireza Karimi", "names": ["Alireza Karimi"]},
+    ])
+    assert [match["id"] for match in index.match("Ali")] == ["1", "2"]
+    assert index.match("Ali Rezai")[0]["id"] == "1"
+    assert index.match("Bob") == []
+
+def test_resolver_caches_and_reports_ambiguity():
+    client = FakeCRMClient()
+    resolver = CRMResolver(client)
+
+    assert resolver.resolve("user", "ali")["match"]["id"] == ALI_ID
+    assert resolver.resolve("user", "سارا")["match"]["name"] == "سارا احمدی"
+    assert client.fetches == 1
+
+    ambiguous = resolver.resolve("user", "Al")
+    assert ambiguous["match"] is None
+    assert len(ambiguous["candidates"]) == 2
+
+    assert resolver.resolve("pipeline", "sales won")["match"]["id"] == "s1"
+
+def test_pipelines_and_stages_resolve_by_name():
+    resolver = CRMResolver(FakeCRMClient())
+
+    sales = resolver.resolve("pipeline", "Sales")["match"]
+    assert (sales["id"], sales["kind"]) == ("p1", "pipeline")
+    assert resolver.resolve("pipeline", "support")["match"]["id"] == "p2"
+
+    lead = resolver.resolve("pipeline", "Sales Lead")["match"]
+    assert (lead["id"], lead["kind"]) == ("s2", "stage")
+    assert resolver.resolve("pipeline", "Open")["match"]["id"] == "s3"
+
+def test_cards_of_a_named_owner_take_one_tool_step(monkeypatch):
+    client = FakeCRMClient()
+    scripted_calls.clear()
+    monkeypatch.setattr(model_policy, "DeadlineChatOpenAI", ScriptedChatModel)
+    monkeypatch.setattr(crm_agent, "crm_client", client)
+    monkeypatch.setattr(crm_agent, "resolver", CRMResolver(client))
+
+    state = crm_agent.crm_agent_node({"question": "Show the cards of Ali", "chat_history": []})
+
+    assert state["answer"] == "done"
+    assert len(scripted_calls) == 2
+    assert client.cards_of == [ALI_ID]
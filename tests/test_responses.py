@@ -0,0 +1,15 @@
+from datetime import datetime
+from bson import ObjectId
+from app.main import SessionResponse, UserResponse
+from app.responses import ORJSONResponse, projection
+
+def test_projection_reads_only_declared_fields():
+    assert projection(UserResponse) == {"_id": 0, "username": 1, "permission": 1}
+    assert "password" not in projection(UserResponse)
+    assert projection(SessionResponse)["chat_history"] == 1
+
+def test_orjson_response_encodes_mongo_values():
+    object_id = ObjectId()
+    response = ORJSONResponse({"id": object_id, "at": datetime(2025, 1, 1), "text": "سلام"})
+    assert response.body == f'{{"id":"{object_id}","at":"2025-01-01T00:00:00","text":"سلام"}}'.encode("utf-8")
+    assert response.media_type == "application/json"
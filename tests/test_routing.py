@@ -0,0 +1,30 @@
+from langgraph.graph import END
+from app import routing
+
+def test_speculation_is_kept_when_classify_agrees(monkeypatch):
+    monkeypatch.setattr(routing, "summarize_older_turns", lambda chat_history, deadline=None: "summary")
+    monkeypatch.setitem(routing.AGENT_NODES, "unknown", lambda state: {
+        **state, "answer": "hi!", "chat_history": [*state["chat_history"], (state["question"], "hi!")]
+    })
+
+    state = {"question": "Tell me a joke", "chat_history": []}
+    state.update(routing.speculate_node(state))
+    assert state["history_summary"] == "summary"
+    assert state["speculation"]["agent"] == "unknown"
+
+    state["agent"] = "unknown"
+    assert routing.route(state) == END
+    assert routing.dispatch_node(state) == {"answer": "hi!", "chat_history": [("Tell me a joke", "hi!")]}
+
+def test_speculation_is_discarded_when_classify_disagrees():
+    state = {
+        "question": "Tell me a joke",
+        "chat_history": [],
+        "agent": "crm-agent",
+        "speculation": {"agent": "unknown", "answer": "hi!", "chat_history": [("Tell me a joke", "hi!")]}
+    }
+    assert routing.route(state) == "crm-agent"
+    assert routing.dispatch_node(state) == {}
+
+    del state["speculation"]
+    assert routing.route(state) == "crm-agent"
@@ -0,0 +1,39 @@
+import pytest
+from fastapi import HTTPException
+from app import sessions
+from app.agent import sessions_db
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    sessions_db.delete_many({"session_id": "concurrent-session"})
+    yield
+    sessions_db.delete_many({"session_id": "concurrent-session"})
+
+def test_stale_turn_is_merged(monkeypatch):
+    monkeypatch.setattr(sessions, "CONFLICT_POLICY", "merge")
+    assert sessions.save_turn("concurrent-session", "user", None, [["hi", "hello"]]) == 1
+
+    first = sessions.load_session("concurrent-session", "user")
+    second = sessions.load_session("concurrent-session", "user")
+
+    assert sessions.save_turn("concurrent-session", "user", first, first["chat_history"] + [["a", "1"]]) == 2
+    assert sessions.save_turn("concurrent-session", "user", second, second["chat_history"] + [["b", "2"]]) == 3
+
+    history = sessions.load_session("concurrent-session", "user")["chat_history"]
+    assert history == [["hi", "hello"], ["a", "1"], ["b", "2"]]
+
+def test_stale_turn_is_rejected(monkeypatch):
+    monkeypatch.setattr(sessions, "CONFLICT_POLICY", "reject")
+    sessions.save_turn("concurrent-session", "user", None, [["hi", "hello"]])
+    stale = sessions.load_session("concurrent-session", "user")
+    sessions.save_turn("concurrent-session", "user", stale, stale["chat_history"] + [["a", "1"]])
+
+    with pytest.raises(HTTPException) as e:
+        sessions.save_turn("concurrent-session", "user", stale, stale["chat_history"] + [["b", "2"]])
+    assert e.value.status_code == 409
+
+def test_session_of_another_user_is_forbidden():
+    sessions.save_turn("concurrent-session", "user", None, [["hi", "hello"]])
+    with pytest.raises(HTTPException) as e:
+        sessions.load_session("concurrent-session", "someone-else")
+    assert e.value.status_code == 403
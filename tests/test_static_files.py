@@ -0,0 +1,47 @@
+import gzip
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.static_files import IMMUTABLE, REVALIDATE, PrecompressedFiles
+
+def make_client(tmp_path):
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "index.html").write_text("<html>" + "page " * 500 + "</html>")
+    (tmp_path / "index.html.gz").write_bytes(gzip.compress((tmp_path / "index.html").read_bytes()))
+    (tmp_path / "index.html.br").write_bytes(b"not really brotli")
+    (tmp_path / "assets" / "app-1a2b.js").write_text("console.log(1);")
+
+    api = FastAPI()
+    api.mount("/app", PrecompressedFiles(str(tmp_path), index="index.html"))
+    return TestClient(api)
+
+def test_negotiates_precompressed_variants(tmp_path):
+    client = make_client(tmp_path)
+
+    # Streamed so the client does not try to decode the fake brotli body
+    with client.stream("GET", "/app/", headers={"Accept-Encoding": "gzip, br"}) as br:
+        assert br.status_code == 200
+    assert br.headers["content-encoding"] == "br"
+    assert br.headers["vary"] == "Accept-Encoding"
+    assert br.headers["cache-control"] == REVALIDATE
+
+    gz = client.get("/app/index.html", headers={"Accept-Encoding": "gzip, br;q=0"})
+    assert gz.headers["content-encoding"] == "gzip"
+    assert "page page" in gz.text
+
+    plain = client.get("/app/index.html", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert len({br.headers["etag"], gz.headers["etag"], plain.headers["etag"]}) == 3
+
+def test_hashed_assets_are_immutable_and_revalidate_with_etag(tmp_path):
+    client = make_client(tmp_path)
+
+    res = client.get("/app/assets/app-1a2b.js")
+    assert res.status_code == 200
+    assert res.headers["cache-control"] == IMMUTABLE
+    assert "vary" not in res.headers
+
+    cached = client.get("/app/assets/app-1a2b.js", headers={"If-None-Match": res.headers["etag"]})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    assert client.get("/app/assets/missing.js").status_code == 404
@@ -0,0 +1,78 @@
+import pytest
+import time
+from fastapi import HTTPException
+from app import tenants
+from app.crm_client import CRMClient, FAILURE_MESSAGE
+from app.tenants import CRMClientPool, TenantProxy, tenants_db, tenant_scope, user_tenant, DEFAULT_TENANT
+
+@pytest.fixture(scope="function", autouse=True)
+def shops(monkeypatch):
+    tenants_db.delete_many({"tenant_id": {"$regex": "^test-shop"}})
+    for index in range(3):
+        tenants_db.insert_one({"tenant_id": f"test-shop-{index}", "didar_api_key": f"key-{index}", "rate_per_second": 2, "burst": 1})
+    tenants_db.insert_one({"tenant_id": "test-shop-off", "didar_api_key": "key-off", "disabled": True})
+    yield
+    tenants_db.delete_many({"tenant_id": {"$regex": "^test-shop"}})
+
+class FakeHTTP:
+    def __init__(self):
+        self.calls = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.calls += 1
+        raise ConnectionError()
+
+def test_each_tenant_gets_its_own_client_and_caches():
+    pool = CRMClientPool(max_size=4)
+    first, second = pool.get("test-shop-0"), pool.get("test-shop-1")
+
+    assert first.client.api_key == "key-0" and second.client.api_key == "key-1"
+    assert first.resolver is not second.resolver and first.analytics is not second.analytics
+    assert pool.get("test-shop-0") is first
+    assert user_tenant({"username": "x"}) == DEFAULT_TENANT
+
+def test_unknown_and_disabled_tenants_are_refused():
+    pool = CRMClientPool()
+    for tenant in ("test-shop-missing", "test-shop-off"):
+        with pytest.raises(HTTPException) as e:
+            pool.get(tenant)
+        assert e.value.status_code == 403
+
+def test_least_recently_used_and_idle_clients_are_closed(monkeypatch):
+    closed = []
+    monkeypatch.setattr(CRMClient, "close", lambda self: closed.append(self.api_key))
+    pool = CRMClientPool(max_size=2, idle_seconds=60)
+
+    pool.get("test-shop-0")
+    pool.get("test-shop-1")
+    pool.get("test-shop-0")
+    pool.get("test-shop-2")
+    assert list(pool.entries) == ["test-shop-0", "test-shop-2"]
+    assert closed == ["key-1"]
+
+    pool.entries["test-shop-0"].last_used = time.monotonic() - 120
+    pool.get("test-shop-2")
+    assert list(pool.entries) == ["test-shop-2"]
+    assert closed == ["key-1", "key-0"]
+    assert pool.stats()["evicted"] == 2
+
+def test_proxy_follows_the_tenant_in_scope(monkeypatch):
+    pool = CRMClientPool()
+    monkeypatch.setattr(tenants, "crm_pool", pool)
+    client = TenantProxy("client")
+
+    with tenant_scope("test-shop-1"):
+        assert client.api_key == "key-1"
+    with tenant_scope("test-shop-2"):
+        assert client.api_key == "key-2"
+
+def test_calls_beyond_the_tenant_rate_limit_wait_or_fail():
+    client = CRMClient(api_key="key", rate=2, burst=1)
+    client._client, client._client_pid = FakeHTTP(), __import__("os").getpid()
+
+    started = time.monotonic()
+    client.list_users()
+    client.list_users()
+    assert time.monotonic() - started >= 0.4
+    assert client._throttle(0.1) is False
+    assert client._post("User/List", {}) == FAILURE_MESSAGE
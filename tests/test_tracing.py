@@ -0,0 +1,117 @@
+import pytest
+import time
+from typing import TypedDict
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.graph import StateGraph, END
+from app import tracing
+from app.tracing import TraceCallbackHandler, TraceWriter, traces_db, slowest_spans, get_trace
+
+USER = {"_id": "trace-test-user", "username": "trace-tester"}
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    traces_db.delete_many({"username": "trace-tester"})
+    yield
+    traces_db.delete_many({"username": "trace-tester"})
+
+class State(TypedDict):
+    question: str
+    answer: str
+
+class ListWriter:
+    def __init__(self):
+        self.traces = []
+
+    def submit(self, trace):
+        self.traces.append(trace)
+
+def build_graph(sleep: float = 0, fail: bool = False):
+    def answer(state):
+        llm = GenericFakeChatModel(messages=iter([AIMessage(content="ok")]), metadata={"purpose": "answer"})
+        time.sleep(sleep)
+        if fail:
+            raise RuntimeError("boom")
+        return {"answer": llm.invoke(state["question"]).content}
+
+    graph = StateGraph(State)
+    graph.add_node("answer", answer)
+    graph.set_entry_point("answer")
+    graph.add_edge("answer", END)
+    return graph.compile()
+
+def run(graph, writer, sample_rate=0.0):
+    handler = TraceCallbackHandler(USER, "trace-session", writer)
+    handler.head_sampled = sample_rate >= 1
+    try:
+        graph.invoke({"question": "hi"}, config={"callbacks": [handler]})
+    except RuntimeError:
+        pass
+    return handler
+
+def test_fast_unsampled_runs_are_dropped_but_slow_and_failed_ones_are_kept(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SLOW_MS", 50)
+    writer = ListWriter()
+
+    run(build_graph(), writer)
+    assert writer.traces == []
+
+    run(build_graph(sleep=0.06), writer)
+    run(build_graph(fail=True), writer)
+    run(build_graph(), writer, sample_rate=1)
+    assert [trace["kept_by"] for trace in writer.traces] == ["slow", "error", "sample"]
+    assert writer.traces[1]["status"] == "error"
+
+    kinds = [(span["kind"], span["name"]) for span in writer.traces[0]["spans"]]
+    assert kinds == [("graph", "LangGraph"), ("node", "answer"), ("llm", "answer")]
+
+def test_writer_batches_in_the_background_and_drops_when_full():
+    writer = TraceWriter(max_size=2)
+    handlers = [run(build_graph(), writer, sample_rate=1) for _ in range(2)]
+    writer.stop()
+
+    assert writer.stats()["written"] == 2
+    assert get_trace(handlers[0].trace_id)["username"] == "trace-tester"
+
+    full = TraceWriter(max_size=1)
+    full._ensure_started = lambda: None
+    assert full.submit({}) is True
+    assert full.submit({}) is False
+    assert full.stats()["dropped"] == 1
+
+def test_slowest_spans_are_found_by_kind_and_name():
+    writer = TraceWriter()
+    for sleep in (0, 0.03, 0.01):
+        run(build_graph(sleep=sleep), writer, sample_rate=1)
+    writer.stop()
+
+    slowest = slowest_spans("node", "answer", limit=2)
+    assert len(slowest) == 2
+    assert slowest[0]["span"]["duration_ms"] >= slowest[1]["span"]["duration_ms"] >= 10
+    assert slowest_spans("tool") == []
+
+def test_traces_collection_is_capped_before_the_first_write(monkeypatch):
+    from pymongo.errors import CollectionInvalid
+    calls = []
+
+    class ExistingDB:
+        def create_collection(self, name, **options):
+            raise CollectionInvalid(f"collection {name} already exists")
+
+        def command(self, *args, **kwargs):
+            calls.append(("command", *args))
+
+    class UncappedTraces:
+        def options(self):
+            return {}
+
+        def insert_many(self, batch, ordered=True):
+            calls.append(("insert", len(batch)))
+
+    monkeypatch.setattr(tracing, "crm_db", ExistingDB())
+    monkeypatch.setattr(tracing, "traces_db", UncappedTraces())
+
+    writer = TraceWriter()
+    writer._write([{}, {}])
+    writer._write([{}])
+    assert calls == [("command", "convertToCapped", "traces"), ("insert", 2), ("insert", 1)]
@@ -0,0 +1,45 @@
+import pytest
+from datetime import datetime
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from app.callbacks import UsageCallbackHandler
+from app.usage import usage_db, record_usage, query_usage, cost
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanup():
+    usage_db.delete_many({"username": "usage-testuser"})
+    yield
+    usage_db.delete_many({"username": "usage-testuser"})
+
+def fake_llm(purpose):
+    message = AIMessage(
+        content="ok",
+        usage_metadata={"input_tokens": 100, "output_tokens": 20, "total_tokens": 120, "input_token_details": {"cache_read": 40}},
+        response_metadata={"model_name": "gpt-4o-mini"}
+    )
+    return GenericFakeChatModel(messages=iter([message]), metadata={"purpose": purpose})
+
+def test_handler_attributes_tokens_by_node_and_purpose():
+    handler = UsageCallbackHandler(node="title")
+    fake_llm("title").invoke("hi", config={"callbacks": [handler]})
+    fake_llm("title").invoke("hi", config={"callbacks": [handler]})
+
+    counts = handler.totals[("title", "title", "gpt-4o-mini")]
+    assert counts["calls"] == 2
+    assert counts["prompt_tokens"] == 200
+    assert counts["completion_tokens"] == 40
+    assert counts["cached_tokens"] == 80
+
+def test_usage_is_rolled_up_per_day():
+    handler = UsageCallbackHandler(node="title")
+    fake_llm("title").invoke("hi", config={"callbacks": [handler]})
+
+    record_usage(handler.totals, "user-id", "usage-testuser", "session-1")
+    record_usage(handler.totals, "user-id", "usage-testuser", "session-1")
+
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    rows = query_usage(today, today, "usage-testuser")
+    assert len(rows) == 1
+    assert rows[0]["calls"] == 2
+    assert rows[0]["total_tokens"] == 240
+    assert rows[0]["cost_usd"] == round(2 * cost("gpt-4o-mini", 100, 20, 40), 6)
@@ -3,5 +3,7 @@ import react from '@vitejs/plugin-react'
 
 // https://vite.dev/config/
 export default defineConfig({
+  // Served by the API under /app/, see scripts/build_static.py
+  base: '/app/',
   plugins: [react()],
 })